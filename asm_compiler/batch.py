@@ -0,0 +1,149 @@
+import io
+import os
+import time
+import traceback
+import contextlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from asm_compiler import compiler
+from asm_compiler import incremental
+from input_preprocessor import preprocessor
+
+# The outcome of compiling one source file: status is 0 on success, or the id of the error that stopped it
+BatchResult = namedtuple('BatchResult', ('input', 'output', 'status', 'seconds', 'messages'))
+
+# The ProcessorArchitecture every worker process compiles against, sent once when the worker starts
+_worker_architecture = None
+
+
+def _init_worker(pa):
+    global _worker_architecture
+    _worker_architecture = pa
+
+
+def _compile_in_worker(source, output, options):
+    return BatchCompiler.compile_source(source, output, _worker_architecture, options)
+
+
+class BatchCompiler:
+    """Compiles many source files against the same processor architecture, in parallel"""
+
+    DEFAULT_OPTIONS = {
+        'output_binary': True,
+        'output_object': False,
+        'byteorder': 'big',
+        'bitorder': 'msb',
+        'stream': False,
+        'incremental': False,
+        'optimize': False,
+        'output_hex': False,
+        'output_srec': False,
+        'relocatable': False
+    }
+
+    @classmethod
+    def read_manifest(cls, file):
+        """Reads a manifest, where each line holds a source file and (optionally) the name of its output files.
+        Empty lines and lines starting with '#' are ignored. Relative paths are relative to the manifest.
+        :param file: The manifest to read.
+        """
+        base = os.path.dirname(file)
+        jobs = []
+        with open(file, 'r') as fin:
+            for line in fin:
+                fields = line.split()
+                if len(fields) == 0 or fields[0].startswith('#'):
+                    continue
+                source = os.path.join(base, fields[0])
+                output = os.path.join(base, fields[1]) if len(fields) > 1 else cls.default_output(source)
+                jobs.append((source, output))
+        return jobs
+
+    @classmethod
+    def default_output(cls, source, directory=None):
+        """Returns the name of the output files of a source file: its own name without extension"""
+        output = os.path.splitext(source)[0]
+        return output if directory is None else os.path.join(directory, os.path.basename(output))
+
+    @classmethod
+    def compile_source(cls, source, output, pa, options):
+        """Compiles a single source file, returning a BatchResult instead of exiting on errors"""
+        options = dict(cls.DEFAULT_OPTIONS, **options)
+        messages = io.StringIO()
+        status = 0
+        start = time.perf_counter()
+
+        try:
+            # The compiler reports problems on the standard output, so keep them along with the result
+            with contextlib.redirect_stdout(messages):
+                if options['stream']:
+                    lines = preprocessor.InputPreprocessor.iter_file(source)
+                    compiler.Compiler.parse_stream(lines, output, pa, options['output_binary'],
+                                                   options['output_object'], options['byteorder'],
+                                                   options['bitorder'], options['output_hex'], options['output_srec'],
+                                                   lambda: preprocessor.InputPreprocessor.iter_file(source))
+                else:
+                    labels = {}
+                    symbols = {}
+                    # (Cached and optimized lines still use labels, see Compiler.parse_file)
+                    compiler_labels = options['incremental'] or options['optimize']
+                    lines = preprocessor.InputPreprocessor.parse_file(source, labels=labels, symbols=symbols,
+                                                                      replace_labels=not compiler_labels)
+                    cache = None
+                    if options['incremental']:
+                        cache = incremental.EncodingCache.load(incremental.EncodingCache.path(output), pa)
+                    if options['relocatable']:
+                        compiler.Compiler.parse_relocatable(lines, output, pa, labels, symbols, cache)
+                    else:
+                        compiler.Compiler.parse_file(lines, output, pa, options['output_binary'],
+                                                     options['output_object'], options['byteorder'],
+                                                     options['bitorder'], cache, optimize=options['optimize'],
+                                                     output_hex=options['output_hex'],
+                                                     output_srec=options['output_srec'],
+                                                     labels=labels if compiler_labels else None)
+                    if cache is not None:
+                        cache.save(incremental.EncodingCache.path(output))
+        except SystemExit as e:
+            # Errors are reported through exit(error_id)
+            status = e.code if isinstance(e.code, int) and e.code != 0 else 1
+        except Exception:
+            status = -1
+            messages.write(traceback.format_exc())
+
+        return BatchResult(source, output, status, time.perf_counter() - start, messages.getvalue())
+
+    @classmethod
+    def compile_batch(cls, jobs, pa, options=None, workers=None):
+        """Compiles every (source, output) pair in jobs, distributing them over a pool of worker processes.
+        A source file that can't be compiled doesn't stop the others.
+        :param jobs: The source files to compile, and the name of their output files.
+        :param pa: A ProcessorArchitecture instance. It's sent once to each worker.
+        :param options: The compilation options (see DEFAULT_OPTIONS).
+        :param workers: How many worker processes to use. Defaults to the number of CPUs.
+        :return: A BatchResult for each job, in the same order.
+        """
+        options = options or {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(pa,)) as executor:
+            futures = [executor.submit(_compile_in_worker, source, output, options) for source, output in jobs]
+            results = []
+            for (source, output), future in zip(jobs, futures):
+                try:
+                    results.append(future.result())
+                except Exception:
+                    # The worker itself died (i.e. it was killed), which says nothing about the other jobs
+                    results.append(BatchResult(source, output, -1, 0.0, traceback.format_exc()))
+        return results
+
+    @classmethod
+    def print_summary(cls, results, seconds):
+        """Prints what went wrong, along with aggregate timings, and returns the number of failed jobs"""
+        failed = [result for result in results if result.status != 0]
+        for result in failed:
+            print('FAILED {} (error {}):\n{}'.format(result.input, result.status, result.messages.rstrip()))
+
+        compile_time = sum(result.seconds for result in results)
+        slowest = max(results, key=lambda result: result.seconds, default=None)
+        print('Compiled {} of {} source file(s) in {:.3f}s ({:.3f}s of compile time{}).'.format(
+            len(results) - len(failed), len(results), seconds, compile_time,
+            '' if slowest is None else ', slowest: {} in {:.3f}s'.format(slowest.input, slowest.seconds)))
+        return len(failed)
@@ -1,6 +1,21 @@
-import re
+import io
+import os
+import sys
 import math
+import mmap
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import cycle, islice
+from operator import getitem
 from instruction_set_parser import is_parser
+from instruction_set_parser import lexer
+from asm_compiler import program as program_ir
+from asm_compiler import optimizer
+from asm_compiler import records
+from asm_compiler import incremental
+from asm_compiler import relocatable
+from input_preprocessor import preprocessor
+from profiling import profiler
 
 
 class CompilerError(Exception):
@@ -18,14 +33,19 @@ class CompilerError(Exception):
     def __str__(self):
         return self.error_msg
 
-    def print_err(self, ln, ctx):
-        print('COMPILER ERROR {} on line {}: {}\n\t--> {}'.format(self.error_id, ln, self.error_msg, ctx))
+    def print_err(self, ln, ctx, column=None):
+        if column is None:
+            print('COMPILER ERROR {} on line {}: {}\n\t--> {}'.format(self.error_id, ln, self.error_msg, ctx))
+        else:
+            # Point at the column under the context
+            print('COMPILER ERROR {} on line {}, column {}: {}\n\t--> {}\n\t    {}^'.format(
+                self.error_id, ln, column, self.error_msg, ctx, ' ' * column))
 
     def print_warn(self, ln, ctx):
         print('COMPILER WARNING {} on line {}: {}\n\t--> {}'.format(self.error_id, ln, self.error_msg, ctx))
 
-    def print_exit(self, ln, ctx):
-        self.print_err(ln, ctx)
+    def print_exit(self, ln, ctx, column=None):
+        self.print_err(ln, ctx, column)
         exit(self.error_id)
 
 
@@ -35,39 +55,48 @@ COMPILER_ERR_UNDEFINED_INSTRUCTION = CompilerError(3, 'Undefined instruction sig
 COMPILER_ERR_UNCOMPILABLE_INSTRUCTION = CompilerError(4, 'Instruction size mismatch. '
                                                          'The instruction may be being called incorrectly, '
                                                          'or a literal larger than WORD_SIZE is being passed.')
+COMPILER_ERR_UNDEFINED_LABEL = CompilerError(5, 'Undefined label, or address outside of the program.')
+COMPILER_ERR_INVALID_TOKEN = CompilerError(6, 'Expected instruction, register, number, label or memory location.')
+COMPILER_ERR_DUPLICATE_LABEL = CompilerError(7, 'Duplicate label; a label with the same name is already defined.')
+COMPILER_ERR_TEXT_STREAM = CompilerError(8, 'Binary output can\'t be written on a text stream that has no binary '
+                                            'stream under it.')
 
 COMPILER_WARN_NO_OUTPUT = CompilerError(101, 'No output filename specified or no output flags set. Won\'t do anything.')
 
 
+# The ProcessorArchitecture used by worker processes when compiling in parallel, sent once when the worker starts, and
+# the position of each of its instructions
+_worker_architecture = None
+_worker_positions = None
+
+
+def _init_worker(pa):
+    global _worker_architecture, _worker_positions
+    _worker_architecture = pa
+    _worker_positions = program_ir.Program.positions(pa.INSTRUCTION_SET)
+
+
+def _compile_chunk(chunk):
+    lns, lines = chunk
+    program = program_ir.Program(_worker_architecture.INSTRUCTION_SET,
+                                 Compiler._new_object(_worker_architecture.WORD_SIZE), _worker_positions)
+    for ln, line in zip(lns, lines):
+        program.append(Compiler._compile_line(_worker_architecture, ln, line))
+    return program.columns()
+
+
 class Compiler:
 
     @classmethod
     def _tokenize_line(cls, line):
-        # Note: Please don't try to understand it. One victim is enough already. Just know that it works.
-        regexp = r'^(?P<instruction>\w+)(?:\s+(?P<arg1>\(?\.?[a-zA-Z0-9]+\)?)' \
-                 r'(?P<extraargs>(?:\s*,\s*\(?\s*[a-zA-Z0-9]+\s*\)?\s*)*))?$'
-        # Examples covered by this regex:
-        # LD A, B
-        # LD A,B
-        # LD A, .label
-        # LD A, 0
-        # CPLX A, 1,   2  , B
-        # And many more (see tests/compiler_tests.py)
-        match = re.match(regexp, line)
-        if match is None:
+        """Splits a line of code into its instruction and arguments (see the 'lexer' module), or returns None"""
+        try:
+            tokens = lexer.Lexer.tokenize_line(line)
+        except lexer.LexerError:
             # Something in the syntax was wrong, such as a literal not being provided
             # The parse_file method will raise an exception, but this one is private and it should be silent.
             return None
-
-        instr = match.group('instruction')
-        arg1 = match.group('arg1')
-        if arg1 is not None:
-            args = [arg1] + match.group('extraargs').split(',')
-            args = [arg.strip() for arg in args if len(arg.strip()) > 0]
-        else:
-            args = []
-
-        return {'name': instr, 'args': args}
+        return {'name': tokens[0].text, 'args': [token.text for token in tokens[1:]]}
 
     @classmethod
     def _tokenize_instruction(cls, instr):
@@ -75,28 +104,8 @@ class Compiler:
         # $literal: A numeric constant.
         # $address: A label name.
         # But a line will only contain actual values, and parsing must first be done.
-
-        # Note: This is blasphemy! This is madness!
-        #       Madness...
-        #       ...
-        regexp = r'^(?P<instruction>\w+)(?:\s(?P<arg1>\(?(?:[a-zA-Z]+|\$address|\$literal)\)?)' \
-                 r'(?P<extraargs>(?:,[\s_]?\(?(?:[a-zA-Z]+|\$address|\$literal)\)?\s*)*))?$'
-
-        match = re.match(regexp, instr.name)
-
-        if match is None:
-            # Ouch. The parser did a good job, but there are syntax errors.
-            return None
-
-        instr = match.group('instruction')
-        arg1 = match.group('arg1')
-        if arg1 is not None:
-            args = [arg1] + match.group('extraargs').split(',')
-            args = [arg.replace('_', ' ').strip() for arg in args if len(arg.replace('_', ' ').strip()) > 0]
-        else:
-            args = []
-
-        return {'name': instr, 'args': args}
+        # The InstructionSetParser already knows how to split them, since it indexes them when parsing.
+        return is_parser.InstructionSetParser._tokenize_signature(instr.name)
 
     @classmethod
     def _is_literal(cls, arg):
@@ -105,26 +114,57 @@ class Compiler:
         except ValueError:
             return False
 
+    @classmethod
+    def _literal_value(cls, arg):
+        """Returns the number passed by an argument, which may be a memory location ('(12)'), or None"""
+        if isinstance(arg, int):
+            return arg
+        # Remove parentheses in literals that represent memory locations
+        if arg[:1] == '(' and arg[-1:] == ')':
+            arg = arg[1:-1]
+        # (Arguments were normalized by the lexer, so numerals are in decimal)
+        return int(arg) if arg.isdecimal() else None
+
+    # Masks over the arguments of a line, grouped by how many arguments they keep (most first). See _mask_levels.
+    _MASK_LEVELS = {}
+
+    @classmethod
+    def _mask_levels(cls, argc):
+        levels = cls._MASK_LEVELS.get(argc)
+        if levels is None:
+            levels = [[mask for mask in range(1 << argc) if bin(mask).count('1') == kept]
+                      for kept in range(argc, -1, -1)]
+            cls._MASK_LEVELS[argc] = levels
+        return levels
+
     @classmethod
     def _find_matching_instruction(cls, pa, tokens):
-        matching_instr = None
-        best_score = -1  # The number of arguments that are the same
-        for instr in pa.INSTRUCTION_SET:
-            # instr.name is actually the whole human-readable instruction with some special keywords in it
-            # So it must be tokenized as well
-            instr_tokens = cls._tokenize_instruction(instr)
-            # Find the best match for this instruction
-            if instr_tokens['name'] == tokens['name'] and len(instr_tokens['args']) == len(tokens['args']):
-                score = 0
-                for i in range(0, len(tokens['args'])):
-                    score += 1 if tokens['args'][i] == instr_tokens['args'][i] else 0
-                    i += 1
-
-                if score > best_score:
-                    best_score = score
-                    matching_instr = instr
-
-        return matching_instr
+        # An architecture that wasn't loaded through the InstructionSetParser (or that was modified since) hasn't been
+        # indexed yet, or its index is stale
+        if len(pa.SIGNATURES) != len(pa.INSTRUCTION_SET):
+            is_parser.InstructionSetParser._build_signature_index(pa)
+
+        name = tokens['name']
+        args = tokens['args']
+        # The best match is the signature with the most arguments in common with the line (ties go to the one that
+        # was defined first). Try to keep as many arguments as possible, and stop as soon as a signature is found.
+        # Arguments that aren't kept still have to be of the same kind as the signature's.
+        kinds = [is_parser.InstructionSetParser.operand_kind(arg) for arg in args]
+        levels = cls._mask_levels(len(args))
+        for depth, level in enumerate(levels):
+            best = None
+            for mask in level:
+                pattern = tuple(arg if mask & (1 << i) else kinds[i] for i, arg in enumerate(args))
+                match = pa.SIGNATURE_INDEX.get((name, len(args), pattern))
+                if match is not None and (best is None or match[0] < best[0]):
+                    best = match
+            if best is not None:
+                break
+
+        if profiler.Profiler.enabled:
+            profiler.Profiler.count('signature_lookups')
+            profiler.Profiler.count('signatures_probed', sum(len(level) for level in levels[:depth + 1]))
+        return best[1] if best is not None else None
 
     @classmethod
     def _encode_instruction(cls, signature, args, word_size):
@@ -132,14 +172,10 @@ class Compiler:
 
         if len(args) > 0:
             # Skip non-literals since they can't be encoded and are assumed to be part of the opcode
-            for i, arg in enumerate(args):
-                # Remove parentheses in literals that represent memory locations
-                _match = re.match(r'\((\d+)\)', str(arg))
-                if _match is not None:
-                    arg = _match.group(1)
+            for arg in args:
                 # Append the argument to the encoded instruction
-                if cls._is_literal(arg):
-                    iarg = int(arg)
+                iarg = cls._literal_value(arg)
+                if iarg is not None:
                     # (It cannot be larger than a single word, but it can be smaller)
                     if iarg.bit_length() > word_size:
                         return None
@@ -150,99 +186,646 @@ class Compiler:
 
         return encoded_instr
 
+    # Binary representations of every possible word, by word size and line terminator. See _bit_strings.
+    _BIT_STRINGS = {}
+    # Words up to this size are looked up in a table directly
+    _BIT_STRINGS_WORD_SIZE = 16
+    # How many words of the object file are converted to text and written at once
+    _WRITE_BLOCK_SIZE = 1 << 16
+
+    @classmethod
+    def _bit_strings(cls, word_size, end=''):
+        """Returns a table of the binary representation of every word of word_size bits, followed by end"""
+        table = cls._BIT_STRINGS.get((word_size, end))
+        if table is None:
+            fmt = ('{0:0%db}' % word_size).format
+            table = [fmt(word) + end for word in range(1 << word_size)]
+            cls._BIT_STRINGS[(word_size, end)] = table
+        return table
+
+    @classmethod
+    def _word_strings(cls, obj, word_size, end=''):
+        """Lazily converts every word to its binary representation, followed by end"""
+        if word_size <= cls._BIT_STRINGS_WORD_SIZE:
+            return map(cls._bit_strings(word_size, end).__getitem__, obj)
+
+        # Larger words that fill a machine type are looked up one byte at a time, straight from the binary file
+        if word_size % 8 == 0 and word_size // 8 in cls._ARRAY_TYPECODES:
+            tables = [cls._bit_strings(8)] * (word_size // 8 - 1) + [cls._bit_strings(8, end)]
+            return map(getitem, cycle(tables), cls._pack_words(obj, word_size))
+
+        return map(('{0:0%db}' % word_size + end).format, obj)
+
     @classmethod
     def _binary_to_ascii(cls, obj, word_size):
-        str_out = ''
-        for byte in obj:
-            str_out += '{0:b}'.format(byte).zfill(word_size) + '\n'
-        return str_out
-
-    @classmethod
-    def _calculate_offset(cls, program, until):
-        offset = 0
-        for i in range(0, until):
-            offset += program[i]['instruction'].size - 1
-        return offset
-
-    @classmethod
-    def _adjust_addresses(cls, call, program):
-        # Tokenize the instruction
-        instr_tokens = cls._tokenize_instruction(call['instruction'])
-        # Get the number of addresses encoded by this instruction
-        addrs = [(i, arg) for i, arg in enumerate(instr_tokens['args'])
-                 if re.match(r'\$address', arg) is not None]
-        # Don't do anything if this instruction doesn't encode any
-        if len(addrs) == 0:
-            return
-        # For each encoded address
-        for i, addr in addrs:
-            # Calculate the offset from the beginning of the program
-            call['args'][i] = int(call['args'][i]) + cls._calculate_offset(program, int(call['args'][i]))
+        return ''.join(cls._word_strings(obj, word_size, '\n'))
+
+    @classmethod
+    def _ascii_blocks(cls, obj, word_size):
+        """Lazily yields the text of the object file, one word per line, a large block of lines at a time"""
+        lines = cls._word_strings(obj, word_size, '\n')
+        return iter(lambda: ''.join(islice(lines, cls._WRITE_BLOCK_SIZE)), '')
+
+    @classmethod
+    def _write_ascii(cls, obj, word_size, fout):
+        """Writes the object file as text, one word per line, a large block of lines at a time"""
+        fout.writelines(cls._ascii_blocks(obj, word_size))
+
+    # Array typecodes by item size in bytes (the smallest typecode wins when more than one has the same size)
+    _ARRAY_TYPECODES = {array(typecode).itemsize: typecode for typecode in 'QLIHB'}
+    # Every byte with its bits in reverse order
+    _BIT_REVERSAL = bytes(int('{0:08b}'.format(byte)[::-1], 2) for byte in range(256))
+
+    @classmethod
+    def _new_object(cls, word_size):
+        """Returns an empty container for the encoded words, which is an array of the smallest type that fits them"""
+        for size in sorted(cls._ARRAY_TYPECODES):
+            if size * 8 >= word_size:
+                return array(cls._ARRAY_TYPECODES[size])
+        # Words this large don't fit any machine type
+        return []
+
+    # How many words are packed at once, when they don't fit a machine type (see _pack_into)
+    _PACK_BLOCK_SIZE = 1 << 16
+
+    @classmethod
+    def _packed_size(cls, count, word_size):
+        """Returns how many bytes count densely packed words take"""
+        return -(-count * word_size // 8)
+
+    @classmethod
+    def _pack_into(cls, obj, word_size, image, byteorder='big', bitorder='msb'):
+        """Packs the encoded words into image, a writable buffer of exactly _packed_size bytes (such as a bytearray or
+        a memory-mapped file), without building the packed words anywhere else first. See _pack_words."""
+        # (Releasing the view as soon as it is done with, so that a mapped file can be closed)
+        with memoryview(image) as image:
+            width = word_size // 8
+            typecode = cls._ARRAY_TYPECODES.get(width) if word_size % 8 == 0 else None
+
+            if typecode is not None:
+                # Words that are as large as a machine type are copied as they are (possibly swapping their bytes, which
+                # is done in place, and undone once copied)
+                if not isinstance(obj, array) or obj.typecode != typecode:
+                    obj = array(typecode, obj)
+                swap = width > 1 and byteorder != sys.byteorder
+                if swap:
+                    obj.byteswap()
+                try:
+                    image[:] = memoryview(obj).cast('B')
+                finally:
+                    if swap:
+                        obj.byteswap()
+            else:
+                # Otherwise chain the bits of a block of words together, most significant first, and read them 8 at a
+                # time (blocks are made of whole bytes, so they can be packed one after the other)
+                step = 8 // math.gcd(word_size, 8) * cls._PACK_BLOCK_SIZE
+                offset = 0
+                for start in range(0, len(obj), step):
+                    bits = ''.join(cls._word_strings(obj[start:start + step], word_size))
+                    bits += '0' * (-len(bits) % 8)
+                    block = int(bits, 2).to_bytes(len(bits) // 8, 'big')
+                    # Byte-aligned words that are too large for a machine type have their bytes swapped
+                    if word_size % 8 == 0 and width > 1 and byteorder == 'little':
+                        swapped = bytearray(len(block))
+                        for i in range(width):
+                            swapped[i::width] = block[width - 1 - i::width]
+                        block = swapped
+                    image[offset:offset + len(block)] = block
+                    offset += len(block)
+
+            if bitorder == 'lsb':
+                for start in range(0, len(image), cls._WRITE_BLOCK_SIZE):
+                    end = start + cls._WRITE_BLOCK_SIZE
+                    image[start:end] = image[start:end].tobytes().translate(cls._BIT_REVERSAL)
+
+    @classmethod
+    def _pack_words(cls, obj, word_size, byteorder='big', bitorder='msb'):
+        """Packs the encoded words as densely as possible, with no padding between them (only at the very end).
+        :param obj: The encoded words.
+        :param word_size: The number of bits of each word.
+        :param byteorder: The order of the bytes of each word ('big' or 'little'). Only applies to word sizes that
+                          are a multiple of 8, since other words don't start and end on byte boundaries.
+        :param bitorder: 'msb' if the first bit of a byte is its most significant, 'lsb' if it's its least significant.
+        """
+        packed = bytearray(cls._packed_size(len(obj), word_size))
+        cls._pack_into(obj, word_size, packed, byteorder, bitorder)
+        return packed
+
+    @classmethod
+    def _packed_blocks(cls, obj, word_size, byteorder='big', bitorder='msb'):
+        """Lazily yields the packed words (see _pack_words) in blocks of about _WRITE_BLOCK_SIZE bytes, so that they
+        can be compared with a file without packing all of them at once"""
+        # Blocks are made of whole bytes, so that they can be packed one after the other
+        align = 8 // math.gcd(word_size, 8)
+        step = max(align, cls._WRITE_BLOCK_SIZE * 8 // word_size // align * align)
+        for start in range(0, len(obj), step):
+            yield cls._pack_words(obj[start:start + step], word_size, byteorder, bitorder)
+
+    @classmethod
+    def _write_binary(cls, obj, word_size, output, byteorder='big', bitorder='msb'):
+        """Writes the packed words to the file named output, which is sized in advance and mapped in memory, so that
+        the words are packed straight into it"""
+        size = cls._packed_size(len(obj), word_size)
+        with open(output, 'w+b') as fout:
+            # (Empty files can't be mapped)
+            if size == 0:
+                return
+            try:
+                fout.truncate(size)
+                image = mmap.mmap(fout.fileno(), size)
+            except (OSError, ValueError):
+                # Not every file can be mapped (or resized), but every file can be written on
+                fout.seek(0)
+                fout.write(cls._pack_words(obj, word_size, byteorder, bitorder))
+                return
+            with image:
+                cls._pack_into(obj, word_size, image, byteorder, bitorder)
+
+    @classmethod
+    def _encoded_position(cls, args, i):
+        """Returns the position of the i-th argument in the encoded instruction (see _encode_instruction)"""
+        position = 1
+        for arg in args[:i]:
+            if cls._literal_value(arg) is not None:
+                position += 1
+        return position
+
+    @classmethod
+    def _match_line(cls, pa, ln, line):
+        """Returns the instruction called by a line of code and the arguments given to it"""
+        # Split the line in tokens (which also converts numerals to decimal)
+        try:
+            tokens = lexer.Lexer.tokenize_line(line)
+        except lexer.LexerError as e:
+            error = COMPILER_ERR_MISSING_SYMBOL if e.missing else COMPILER_ERR_INVALID_TOKEN
+            error.print_exit(ln, line, e.column)
+        args = [token.text for token in tokens[1:]]
+        # Find the instruction with the best-matching signature
+        instr = cls._find_matching_instruction(pa, {'name': tokens[0].text, 'args': args})
+        if instr is None:
+            COMPILER_ERR_UNDEFINED_INSTRUCTION.print_exit(ln, line)
+        return instr, args
+
+    @classmethod
+    def _compile_line(cls, pa, ln, line):
+        """Compiles a single line of code, which doesn't depend on any other line.
+        The addresses encoded by the line still point to lines of code, and are listed in 'relocations' as positions
+        in 'words', so that they can be relocated once the whole program is laid out (see Program.relocate).
+        Labels that weren't replaced by the preprocessor are encoded as 0 and listed in 'externals' (or in 'constants',
+        if they're passed as literals), to be resolved once the program is laid out (see compile_program) or by the
+        linker (see compile_relocatable). Since such lines don't depend on where the labels are, they're the ones kept
+        by an EncodingCache across edits.
+        """
+        instr, args = cls._match_line(pa, ln, line)
+
+        # Get the arguments that are addresses according to this instruction's (already tokenized) signature
+        relocations = []
+        externals = []
+        constants = []
+        for i, arg in enumerate(pa.SIGNATURES[instr]['args']):
+            if arg == '$address':
+                if cls._is_literal(args[i]):
+                    relocations.append(cls._encoded_position(args, i))
+                else:
+                    externals.append((cls._encoded_position(args, i), args[i]))
+                    args[i] = '0'
+            elif arg in ('$literal', '($literal)') and cls._literal_value(args[i]) is None:
+                # A label passed as a literal stands for the number of its line, as the preprocessor would replace it
+                label = args[i][1:-1] if arg[0] == '(' else args[i]
+                constants.append((cls._encoded_position(args, i), label))
+                args[i] = '0'
+
+        # Encode the instruction and its arguments
+        words = cls._encode_instruction(instr, args, pa.WORD_SIZE)
+        if words is None:
+            COMPILER_ERR_UNCOMPILABLE_INSTRUCTION.print_exit(ln, line)
+
+        return program_ir.CompiledLine(instr, tuple(words), tuple(relocations), tuple(externals), tuple(constants))
+
+    # How many chunks of lines each process gets when compiling in parallel (more chunks balance the load better,
+    # fewer chunks mean less overhead)
+    _CHUNKS_PER_JOB = 4
+
+    @classmethod
+    def _compile_lines(cls, pa, lines, encoding_cache=None, jobs=1):
+        """Compiles every line of code (see _compile_line), possibly in parallel, and returns the resulting Program"""
+        program = program_ir.Program(pa.INSTRUCTION_SET, cls._new_object(pa.WORD_SIZE))
+        if jobs <= 1:
+            for ln, cur_line in enumerate(lines):
+                call = encoding_cache.get(cur_line) if encoding_cache is not None else None
+                if call is None:
+                    call = cls._compile_line(pa, ln, cur_line)
+                    if encoding_cache is not None:
+                        encoding_cache.put(cur_line, call)
+                program.append(call)
+            return program
+
+        # Worker processes send back the columns of each chunk of lines (see Program.columns), rather than one
+        # CompiledLine per line, which would take about as long to unpickle as it takes to compile it
+        positions = program_ir.Program.positions(pa.INSTRUCTION_SET)
+        if encoding_cache is None:
+            # Chunks of consecutive lines are added to the program in bulk, in order
+            lines = lines if isinstance(lines, list) else list(lines)
+            if len(lines) == 0:
+                return program
+            chunk_size = max(1, -(-len(lines) // (jobs * cls._CHUNKS_PER_JOB)))
+            chunks = [(range(i, min(i + chunk_size, len(lines))), lines[i:i + chunk_size])
+                      for i in range(0, len(lines), chunk_size)]
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(pa,)) as executor:
+                for columns in executor.map(_compile_chunk, chunks):
+                    program.extend(columns)
+            return program
+
+        calls = []
+        # Lines that aren't in the cache, and their position in the program
+        pending_lns = array('L')
+        pending = []
+        for ln, cur_line in enumerate(lines):
+            call = encoding_cache.get(cur_line)
+            if call is None:
+                pending_lns.append(ln)
+                pending.append(cur_line)
+            calls.append(call)
+
+        if len(pending) > 0:
+            # Lines don't depend on each other, so they can be compiled in any order by any process
+            chunk_size = max(1, -(-len(pending) // (jobs * cls._CHUNKS_PER_JOB)))
+            chunks = [(pending_lns[i:i + chunk_size], pending[i:i + chunk_size])
+                      for i in range(0, len(pending), chunk_size)]
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(pa,)) as executor:
+                for (lns, chunk), columns in zip(chunks, executor.map(_compile_chunk, chunks)):
+                    # The cache keeps every line on its own
+                    compiled = program_ir.Program(pa.INSTRUCTION_SET, cls._new_object(pa.WORD_SIZE), positions)
+                    compiled.extend(columns)
+                    layout = compiled.layout()
+                    for i, (ln, cur_line) in enumerate(zip(lns, chunk)):
+                        call = compiled.compiled_line(i, layout)
+                        calls[ln] = call
+                        encoding_cache.put(cur_line, call)
+
+        for call in calls:
+            program.append(call)
+        return program
 
     @classmethod
-    def parse_file(cls, lines, output, pa, output_binary=True, output_object=False):
+    def parse_file(cls, lines, output, pa, output_binary=True, output_object=False, byteorder='big', bitorder='msb',
+                   encoding_cache=None, jobs=1, optimize=False, cost_report=None, output_hex=False, output_srec=False,
+                   labels=None):
         """Compiles a preprocessed source file and outputs a binary or textual representation.
         :param lines: The preprocessed file to compile. See the 'input_preprocessor' package.
         :param output: What name should the output files have?
         :param pa: A ProcessorArchitecture instance. See the 'is_parser' package.
         :param output_binary: If true, outputs a binary file.
         :param output_object: If true, outputs a text file where each bit is encoded as a character.
+        :param byteorder: The byte order of the words in the binary file. See _pack_words.
+        :param bitorder: The bit order of the bytes in the binary file. See _pack_words.
+        :param encoding_cache: An EncodingCache holding lines compiled previously. Only lines that aren't in it are
+                               compiled, and then added to it. See the 'incremental' module.
+        :param jobs: How many processes compile the lines. Only laying out and relocating addresses is done serially.
+        :param optimize: If true, remove unreachable code and needless jumps and moves. See the 'optimizer' module.
+                         Labels passed as literals are only renumbered along with the lines if they're resolved by the
+                         compiler (i.e. if labels is given), since the preprocessor turns them into plain numbers.
+        :param cost_report: A CostReport that measures the compiled program. See the 'costs' module.
+        :param output_hex: If true, outputs an Intel HEX file. See the 'records' module.
+        :param output_srec: If true, outputs a Motorola S-record file. See the 'records' module.
+        :param labels: The line of code each label points to, if lines still use labels rather than line numbers
+                       (see InputPreprocessor.parse_file). Lines that only use labels compile to the same words
+                       wherever the labels are, so this is how an encoding_cache keeps them across edits.
+        """
+
+        # No output? Nothing to do.
+        if not output or not (output_binary or output_object or output_hex or output_srec):
+            COMPILER_WARN_NO_OUTPUT.print_warn(-1, '')
+            return
+
+        obj = cls.compile_program(lines, pa, encoding_cache, jobs, optimize, cost_report, labels)
+        cls._write_output(obj, output, pa, output_binary, output_object, byteorder, bitorder, output_hex, output_srec)
+
+    @classmethod
+    def _check_constants(cls, program, lines):
+        """Stops at the first literal that is neither a number nor a label of the program (see _compile_line), which
+        can't be encoded"""
+        if len(program.constants) > 0:
+            ln = program.line_at(program.constants[0][0], program.layout())
+            COMPILER_ERR_UNCOMPILABLE_INSTRUCTION.print_exit(ln, lines[ln])
+
+    @classmethod
+    def compile_program(cls, lines, pa, encoding_cache=None, jobs=1, optimize=False, cost_report=None, labels=None):
+        """Compiles a preprocessed source file and returns the encoded words, without writing anything.
+        See parse_file for the meaning of the parameters.
+        """
+
+        # Program, contains the instruction called by each line and its encoding (i.e. the object file, before
+        # addresses are relocated)
+        program = cls._compile_lines(pa, lines, encoding_cache, jobs)
+        if labels is not None:
+            # Point the labels used by each line to the line they're defined on, as the preprocessor would have
+            position = program.resolve(labels, pa.WORD_SIZE)
+            if position is not None:
+                ln = program.line_at(position, program.layout())
+                COMPILER_ERR_UNCOMPILABLE_INSTRUCTION.print_exit(ln, lines[ln])
+        if len(program.externals) > 0:
+            # A whole program can't use labels it doesn't define
+            ln = program.line_at(program.externals[0][0], program.layout())
+            COMPILER_ERR_UNDEFINED_LABEL.print_exit(ln, lines[ln])
+        cls._check_constants(program, lines)
+        if optimize:
+            program = optimizer.Optimizer.optimize(program, pa, cost_report.labels if cost_report is not None else None)
+
+        # An address initially points to the correct line of code, but as instructions are encoded the object file
+        # grows larger than the source, so every line has to be mapped to the address it will actually be encoded at.
+        layout = program.layout()
+        position = program.relocate(layout, pa.WORD_SIZE)
+        if position is not None:
+            ln = program.line_at(position, layout)
+            COMPILER_ERR_UNCOMPILABLE_INSTRUCTION.print_exit(ln, program.instruction(ln))
+        if cost_report is not None:
+            cost_report.measure(program, layout)
+
+        if profiler.Profiler.enabled:
+            profiler.Profiler.count('lines', len(program))
+            profiler.Profiler.count('address_fixups', len(program.relocations))
+        # Object, contains compiled code
+        obj = program.words
+        return obj
+
+    @classmethod
+    def parse_relocatable(cls, lines, output, pa, labels, symbols, encoding_cache=None, jobs=1):
+        """Compiles a preprocessed source file into a relocatable object (<output>.krel), to be linked with others.
+        See compile_relocatable for the meaning of the parameters.
+        """
+
+        # No output? Nothing to do.
+        if not output:
+            COMPILER_WARN_NO_OUTPUT.print_warn(-1, '')
+            return
+
+        data = cls.compile_relocatable(lines, pa, labels, symbols, encoding_cache, jobs).dumps()
+        path = relocatable.RelocatableObject.path(output)
+        if not cls._file_holds(path, len(data), lambda: [data]):
+            with open(path, 'wb') as fout:
+                fout.write(data)
+
+    @classmethod
+    def compile_relocatable(cls, lines, pa, labels, symbols, encoding_cache=None, jobs=1):
+        """Compiles a preprocessed source file as a module of a larger program, and returns a RelocatableObject.
+        Labels declared GLOBAL are exported, and labels declared EXTERN are left for the linker to resolve.
+        :param lines: The preprocessed file to compile. See the 'input_preprocessor' package.
+        :param pa: A ProcessorArchitecture instance. See the 'is_parser' package.
+        :param labels: The line of code each label points to (see InputPreprocessor.parse_file).
+        :param symbols: The labels declared by GLOBAL and EXTERN directives (see InputPreprocessor.parse_file).
+        :param encoding_cache: An EncodingCache holding lines compiled previously (see parse_file).
+        :param jobs: How many processes compile the lines (see parse_file).
+        """
+        program = cls._compile_lines(pa, lines, encoding_cache, jobs)
+        layout = program.layout()
+        # (Lines may still use the module's own labels, see parse_file)
+        position = program.resolve(labels, pa.WORD_SIZE)
+        if position is not None:
+            ln = program.line_at(position, layout)
+            COMPILER_ERR_UNCOMPILABLE_INSTRUCTION.print_exit(ln, lines[ln])
+        for position, label in program.externals:
+            if symbols.get(label) != preprocessor.InputPreprocessor.EXTERN:
+                ln = program.line_at(position, layout)
+                COMPILER_ERR_UNDEFINED_LABEL.print_exit(ln, lines[ln])
+        cls._check_constants(program, lines)
+
+        # Addresses of the module's own lines are relocated as if it started at address 0
+        position = program.relocate(layout, pa.WORD_SIZE)
+        if position is not None:
+            ln = program.line_at(position, layout)
+            COMPILER_ERR_UNCOMPILABLE_INSTRUCTION.print_exit(ln, program.instruction(ln))
+
+        exports = {}
+        for label, kind in symbols.items():
+            if kind != preprocessor.InputPreprocessor.GLOBAL:
+                continue
+            if label not in labels:
+                COMPILER_ERR_UNDEFINED_LABEL.print_exit(-1, '{} {}'.format(kind, label))
+            exports[label] = layout[labels[label]]
+
+        if profiler.Profiler.enabled:
+            profiler.Profiler.count('lines', len(program))
+            profiler.Profiler.count('address_fixups', len(program.relocations))
+        return relocatable.RelocatableObject(incremental.EncodingCache.architecture_digest(pa), pa.WORD_SIZE,
+                                             program.words, program.relocations, exports, program.externals)
+
+    @classmethod
+    def parse_stream(cls, lines, output, pa, output_binary=True, output_object=False, byteorder='big', bitorder='msb',
+                     output_hex=False, output_srec=False, reread=None):
+        """Compiles a source file while it's being preprocessed, encoding each line as soon as it's read.
+        Only the labels, the address of each line and the object file are kept in memory: addresses (and labels passed
+        as literals) that point forward are encoded as 0 and patched once the whole file has been read.
+        :param lines: The lines to compile, as yielded by InputPreprocessor.iter_file (i.e. with labels unresolved).
+        :param output: What name should the output files have?
+        :param pa: A ProcessorArchitecture instance. See the 'is_parser' package.
+        :param output_binary: If true, outputs a binary file.
+        :param output_object: If true, outputs a text file where each bit is encoded as a character.
+        :param byteorder: The byte order of the words in the binary file. See _pack_words.
+        :param bitorder: The bit order of the bytes in the binary file. See _pack_words.
+        :param output_hex: If true, outputs an Intel HEX file. See the 'records' module.
+        :param output_srec: If true, outputs a Motorola S-record file. See the 'records' module.
+        :param reread: A function that returns the lines again (such as lambda: InputPreprocessor.iter_file(path)),
+                       which is only called to show the line of code a forward reference that can't be patched is on,
+                       since lines aren't kept. Without it, errors only show the label.
         """
 
         # No output? Nothing to do.
-        if not output or (not output_binary and not output_object):
+        if not output or not (output_binary or output_object or output_hex or output_srec):
             COMPILER_WARN_NO_OUTPUT.print_warn(-1, '')
             return
 
-        # Program, contains instruction signatures and their given arguments
-        program = []
         # Object, contains compiled code
-        obj = bytearray()
+        obj = cls._new_object(pa.WORD_SIZE)
+        # The line every label points to, and the address of every line of code (numeric addresses point to lines,
+        # like in parse_file)
+        label_lines = {}
+        line_addresses = array('L')
+        # Addresses and labels passed as literals that couldn't be encoded yet, as (position in obj, label or line
+        # number, line number)
+        fixups = []
+        constants = []
 
-        ln = 0  # Line number
         for cur_line in lines:
-            # Borrow the _replace_numerals function from the InstructionSetParser
-            cur_line = is_parser.InstructionSetParser._replace_numerals(cur_line)
-            # Split the line in tokens
-            tokens = cls._tokenize_line(cur_line)
-            if tokens is None:
-                COMPILER_ERR_MISSING_SYMBOL.print_exit(ln, cur_line)
-            # Find the instruction with the best-matching signature
-            instr = cls._find_matching_instruction(pa, tokens)
-            if instr is None:
-                COMPILER_ERR_UNDEFINED_INSTRUCTION.print_exit(ln, cur_line)
-            # Add the instruction and its given args to the program
-            program.append({'instruction': instr, 'args': tokens['args']})
-            ln += 1
-
-        for i, call in enumerate(program):
-            # Apply an offset to every address. An address initially points to the correct line of code (i),
-            # but as instructions are encoded, the object file grows larger and the offset must be recalculated.
-            # So, if an instruction encodes an address, we have to add the computed sum of the extra size of the i-1
-            # instructions preceding it.
-            cls._adjust_addresses(call, program)
+            # Labels point to whatever comes next, which is the next line of code
+            if cur_line.endswith(':'):
+                if cur_line[:-1] in label_lines:
+                    COMPILER_ERR_DUPLICATE_LABEL.print_exit(len(line_addresses), cur_line)
+                label_lines[cur_line[:-1]] = len(line_addresses)
+                continue
+
+            ln = len(line_addresses)  # Line number
+            line_addresses.append(len(obj))
+
+            instr, args = cls._match_line(pa, ln, cur_line)
+
+            # Resolve the addresses and labels that are already known, and leave a placeholder for the others
+            for i, arg in enumerate(pa.SIGNATURES[instr]['args']):
+                if arg == '$address':
+                    is_label = not cls._is_literal(args[i])
+                    target = label_lines.get(args[i], args[i]) if is_label else int(args[i])
+                    if isinstance(target, int) and target < len(line_addresses):
+                        args[i] = line_addresses[target]
+                        if profiler.Profiler.enabled and is_label:
+                            profiler.Profiler.count('labels_substituted')
+                    else:
+                        fixups.append((len(obj) + cls._encoded_position(args, i), target, ln))
+                        args[i] = 0
+                elif arg in ('$literal', '($literal)') and cls._literal_value(args[i]) is None:
+                    # A label passed as a literal stands for the number of its line (see _compile_line)
+                    label = args[i][1:-1] if arg[0] == '(' else args[i]
+                    if label in label_lines:
+                        args[i] = label_lines[label]
+                        if profiler.Profiler.enabled:
+                            profiler.Profiler.count('labels_substituted')
+                    else:
+                        constants.append((len(obj) + cls._encoded_position(args, i), label, ln))
+                        args[i] = 0
 
             # Encode the instruction, and its arguments, and append it to the object file
-            encoded_instr = cls._encode_instruction(call['instruction'], call['args'], pa.WORD_SIZE)
+            encoded_instr = cls._encode_instruction(instr, args, pa.WORD_SIZE)
             if encoded_instr is None:
-                COMPILER_ERR_UNCOMPILABLE_INSTRUCTION.print_exit(i, call['instruction'])
+                COMPILER_ERR_UNCOMPILABLE_INSTRUCTION.print_exit(ln, cur_line)
 
             obj.extend(encoded_instr)
 
+        # Patch the addresses that pointed forward
+        for position, target, ln in fixups:
+            target = label_lines.get(target, target)
+            if not isinstance(target, int):
+                COMPILER_ERR_UNDEFINED_LABEL.print_exit(ln, cls._streamed_line(reread, ln, target))
+            # (A line right past the end of the program is where the program ends)
+            address = line_addresses[target] if target < len(line_addresses) else \
+                len(obj) if target == len(line_addresses) else None
+            if address is None:
+                COMPILER_ERR_UNDEFINED_LABEL.print_exit(ln, cls._streamed_line(reread, ln, target))
+            if address.bit_length() > pa.WORD_SIZE:
+                COMPILER_ERR_UNCOMPILABLE_INSTRUCTION.print_exit(ln, cls._streamed_line(reread, ln, target))
+            obj[position] = address
+        # And the labels passed as literals, which are the number of their line (and aren't labels otherwise)
+        for position, label, ln in constants:
+            line = label_lines.get(label)
+            if line is None or line.bit_length() > pa.WORD_SIZE:
+                COMPILER_ERR_UNCOMPILABLE_INSTRUCTION.print_exit(ln, cls._streamed_line(reread, ln, label))
+            obj[position] = line
+
+        if profiler.Profiler.enabled:
+            profiler.Profiler.count('lines', len(line_addresses))
+            profiler.Profiler.count('address_fixups', len(fixups) + len(constants))
+        cls._write_output(obj, output, pa, output_binary, output_object, byteorder, bitorder, output_hex, output_srec)
+
+    @classmethod
+    def _streamed_line(cls, reread, ln, default):
+        """Returns the ln-th line of code of a source that was compiled while it was read (see parse_stream), reading
+        it again if it can be, or default otherwise"""
+        if reread is None:
+            return default
+        code = (cur_line for cur_line in reread() if not cur_line.endswith(':'))
+        return next(islice(code, ln, None), default)
+
+    @classmethod
+    def _file_holds(cls, path, size, chunks):
+        """Returns whether the file named path holds exactly size bytes (if size isn't None), made of the chunks of
+        bytes returned by chunks(). Chunks are only made if the size matches, and are compared one at a time as they
+        are read.
+        Files that already hold what would be written aren't written again, so that their modification time only
+        changes along with their content (and whatever depends on them isn't needlessly rebuilt)."""
+        try:
+            if size is not None and os.path.getsize(path) != size:
+                return False
+            with open(path, 'rb') as fin:
+                for chunk in chunks():
+                    if fin.read(len(chunk)) != chunk:
+                        return False
+                if len(fin.read(1)) > 0:
+                    return False
+        except OSError:
+            return False
+
+        if profiler.Profiler.enabled:
+            profiler.Profiler.count('outputs_unchanged')
+        return True
+
+    @classmethod
+    def _write_output(cls, obj, output, pa, output_binary, output_object, byteorder='big', bitorder='msb',
+                      output_hex=False, output_srec=False):
+        # Packed words are bytes, which a text stream that isn't backed by a binary one (such as a StringIO) can't take
+        if output_binary and isinstance(getattr(output, 'buffer', output), io.TextIOBase):
+            COMPILER_ERR_TEXT_STREAM.print_exit(-1, type(output).__name__)
+
+        # The formats that are made from the packed words share them, so that they're only packed once (otherwise the
+        # binary file is packed straight into the file, see _write_binary)
+        image = None
+        if output_hex or output_srec or (output_binary and hasattr(output, 'write')):
+            image = cls._pack_words(obj, pa.WORD_SIZE, byteorder, bitorder)
+
         if output_binary:
-            # If something that can be written on has been passed, use it
+            # If something that can be written on has been passed, use it (or the binary stream under it, if it's a
+            # text stream such as the standard output)
             if hasattr(output, 'write'):
-                output.write(str(obj))
+                stream = getattr(output, 'buffer', output)
+                if stream is not output:
+                    output.flush()
+                stream.write(image)
             else:
                 # Otherwise assume that output is a filename
-                with open(output + '.kasm', 'wb') as fout:
-                    fout.write(obj)
+                path = output + '.kasm'
+                size = cls._packed_size(len(obj), pa.WORD_SIZE)
+                packed = (lambda: [image]) if image is not None else \
+                    (lambda: cls._packed_blocks(obj, pa.WORD_SIZE, byteorder, bitorder))
+                if not cls._file_holds(path, size, packed):
+                    if image is not None:
+                        with open(path, 'wb') as fout:
+                            fout.write(image)
+                    else:
+                        cls._write_binary(obj, pa.WORD_SIZE, path, byteorder, bitorder)
 
         if output_object:
             # If something that can be written on has been passed, use it
             if hasattr(output, 'write'):
-                output.write(cls._binary_to_ascii(obj, pa.WORD_SIZE))
+                cls._write_ascii(obj, pa.WORD_SIZE, output)
+            else:
+                # Otherwise assume that output is a filename
+                path = output + '.kobj'
+                size = len(obj) * (pa.WORD_SIZE + 1)
+                text = lambda: (block.encode('ascii') for block in cls._ascii_blocks(obj, pa.WORD_SIZE))
+                if not cls._file_holds(path, size, text):
+                    with open(path, 'w') as fout:
+                        cls._write_ascii(obj, pa.WORD_SIZE, fout)
+
+        for enabled, extension, lines in ((output_hex, '.hex', records.RecordWriter.intel_hex),
+                                          (output_srec, '.srec', records.RecordWriter.srec)):
+            if not enabled:
+                continue
+            # If something that can be written on has been passed, use it
+            if hasattr(output, 'write'):
+                output.writelines(records.RecordWriter.blocks(lines(image)))
             else:
                 # Otherwise assume that output is a filename
-                with open(output + '.kobj', 'w') as fout:
-                    fout.write(cls._binary_to_ascii(obj, pa.WORD_SIZE))
+                path = output + extension
+                text = lambda: (block.encode('ascii') for block in records.RecordWriter.blocks(lines(image)))
+                if not cls._file_holds(path, None, text):
+                    with open(path, 'w') as fout:
+                        fout.writelines(records.RecordWriter.blocks(lines(image)))
+
+    @classmethod
+    def _escape_dependency(cls, path):
+        """Escapes a path for a Makefile rule"""
+        return path.replace(' ', '\\ ').replace('#', '\\#').replace('$', '$$')
+
+    @classmethod
+    def write_depfile(cls, path, targets, dependencies, phony=()):
+        """Writes a Makefile rule saying that targets depend on dependencies, as C compilers do (gcc -MD).
+        Like the output files, the depfile isn't written again if it wouldn't change.
+        :param path: The name of the depfile.
+        :param targets: The output files.
+        :param dependencies: The files the output files were compiled from (source, architecture and included files).
+        :param phony: Dependencies that also get an empty rule, so that make doesn't fail if they're removed.
+        """
+        text = ' '.join(map(cls._escape_dependency, targets)) + ': ' + \
+            ' \\\n  '.join(map(cls._escape_dependency, dependencies)) + '\n'
+        text += ''.join('\n{}:\n'.format(cls._escape_dependency(dependency)) for dependency in phony)
+        data = text.encode('utf-8')
+        if not cls._file_holds(path, len(data), lambda: [data]):
+            with open(path, 'wb') as fout:
+                fout.write(data)
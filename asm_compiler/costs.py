@@ -0,0 +1,73 @@
+import sys
+import json
+from collections import OrderedDict
+
+
+class CostReport:
+    """Adds up how many words and how many cycles (best and worst case, see Instruction.cycles) each block of a compiled
+    program takes, where blocks are delimited by labels, and the whole program too.
+    Costs are static: every line of a block is counted once, no matter how many times it would actually run. A block
+    that calls an instruction whose cycles aren't known doesn't have a cycle count (and neither does the program).
+    See Compiler.compile_program."""
+
+    def __init__(self, labels=None):
+        """
+        :param labels: The line of code each label points to ({label: line}, see InputPreprocessor.parse_file).
+        """
+        self.labels = labels if labels is not None else {}
+        self.blocks = []
+        self.program = None
+
+    @classmethod
+    def _costs(cls, sizes, cycles, instructions):
+        """Returns the words and cycles taken by the given lines (as positions in the instruction set)"""
+        words = 0
+        best = 0
+        worst = 0
+        for i in instructions:
+            words += sizes[i]
+            if cycles[i] is None:
+                best = worst = None
+            elif best is not None:
+                best += cycles[i][0]
+                worst += cycles[i][1]
+        return OrderedDict((('words', words), ('best_cycles', best), ('worst_cycles', worst)))
+
+    def measure(self, program, layout):
+        """Measures a compiled Program, given the address of each of its lines (see Program.layout)"""
+        sizes = [instr.size for instr in program.instruction_set]
+        cycles = [instr.cycles for instr in program.instruction_set]
+        n = len(program)
+
+        # Lines that are pointed to by the same labels belong to the same block
+        starts = {}
+        for label, line in sorted(self.labels.items(), key=lambda item: (item[1], item[0])):
+            if line < n:
+                starts.setdefault(line, []).append(label)
+        if 0 not in starts:
+            # (Code before the first label)
+            starts[0] = []
+        lines = sorted(starts)
+
+        self.blocks = []
+        for start, end in zip(lines, lines[1:] + [n]):
+            block = OrderedDict((('labels', starts[start]), ('line', start), ('address', layout[start])))
+            block.update(self._costs(sizes, cycles, program.instructions[start:end]))
+            self.blocks.append(block)
+        self.program = self._costs(sizes, cycles, program.instructions)
+
+    def report(self, **info):
+        """Returns the costs of the program and of each block, along with any other info about it, as a dictionary"""
+        report = OrderedDict(info)
+        report['program'] = self.program
+        report['blocks'] = self.blocks
+        return report
+
+    def write_report(self, path, stream=None, **info):
+        """Writes the report as JSON to path (or to stream, the standard output by default, if path is '-')"""
+        text = json.dumps(self.report(**info), indent=2)
+        if path == '-':
+            print(text, file=stream if stream is not None else sys.stdout)
+        else:
+            with open(path, 'w') as fout:
+                fout.write(text + '\n')
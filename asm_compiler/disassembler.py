@@ -0,0 +1,227 @@
+import sys
+import math
+from array import array
+from io import StringIO
+from collections import namedtuple
+from asm_compiler import compiler
+from instruction_set_parser import is_parser
+from input_preprocessor import preprocessor
+
+
+class DisassemblerError(Exception):
+    """Specifies an error that occurred while reading an image"""
+
+    error_id = 0
+    error_msg = 'An error occurred during the disassembling process.'
+
+    def __init__(self, error_id, error_msg):
+        self.error_id = error_id
+        self.error_msg = error_msg
+
+    def __str__(self):
+        return self.error_msg
+
+    def print_err(self, ctx):
+        print('DISASSEMBLER ERROR {}: {}\n\t--> {}'.format(self.error_id, self.error_msg, ctx))
+
+    def print_exit(self, ctx):
+        self.print_err(ctx)
+        exit(self.error_id)
+
+DISASSEMBLER_ERR_INVALID_FILE = DisassemblerError(1, 'Could not read the image file.')
+DISASSEMBLER_ERR_INVALID_OBJECT = DisassemblerError(2, 'The object file holds something other than words of bits.')
+
+
+# How to decode an instruction: how many words it takes, how to format them as source (the arguments that are encoded
+# are replaced by {}) and which of its words are addresses (as positions in the instruction)
+DecodeEntry = namedtuple('DecodeEntry', ('instruction', 'size', 'template', 'addresses'))
+
+
+class Disassembler:
+    """Turns images (.kasm or .kobj files) back into source, by looking up the opcode of each instruction in a decode
+    table built from the ProcessorArchitecture, and skipping as many words as the instruction's size."""
+
+    LABEL_FORMAT = 'label_{}'
+    # How many lines of source are written at once
+    _WRITE_BLOCK_SIZE = 1 << 14
+
+    @classmethod
+    def _decode_entry(cls, pa, instr):
+        tokens = pa.SIGNATURES.get(instr)
+        if tokens is None:
+            return None
+        args = []
+        addresses = []
+        position = 1
+        for arg in tokens['args']:
+            if arg in ('$literal', '$address'):
+                if arg == '$address':
+                    addresses.append(position)
+                args.append('{}')
+                position += 1
+            elif arg == '($literal)':
+                args.append('({})')
+                position += 1
+            else:
+                args.append(arg)
+        # Instructions whose size doesn't match their signature can't be compiled, so they're never in an image
+        if position != instr.size:
+            return None
+        template = tokens['name'] + (' ' + ', '.join(args) if len(args) > 0 else '')
+        return DecodeEntry(instr, instr.size, template, tuple(addresses))
+
+    @classmethod
+    def decode_table(cls, pa):
+        """Returns the decode table of a ProcessorArchitecture: a DecodeEntry for every opcode (or None), as a list
+        indexed by opcode for word sizes up to 16 bits, or as a dictionary otherwise"""
+        if len(pa.SIGNATURES) != len(pa.INSTRUCTION_SET):
+            is_parser.InstructionSetParser._build_signature_index(pa)
+        entries = {instr.opcode: cls._decode_entry(pa, instr) for instr in pa.INSTRUCTION_SET}
+        if pa.WORD_SIZE > 16:
+            return entries
+        return [entries.get(opcode) for opcode in range(1 << pa.WORD_SIZE)]
+
+    @classmethod
+    def _unpack_words(cls, data, word_size, byteorder='big', bitorder='msb'):
+        """Returns the words packed in data (see Compiler._pack_words). Since the last byte is padded with zeroes, words
+        that don't fill whole bytes may be followed by zero words that are actually padding: they're kept, since they
+        can't be told apart from real words whose value is 0 (such as a last instruction whose opcode is 0)."""
+        if bitorder == 'lsb':
+            data = data.translate(compiler.Compiler._BIT_REVERSAL)
+
+        width = word_size // 8
+        typecode = compiler.Compiler._ARRAY_TYPECODES.get(width) if word_size % 8 == 0 else None
+        if typecode is not None:
+            # Words that are as large as a machine type are read in bulk
+            words = array(typecode)
+            words.frombytes(data[:len(data) - len(data) % width])
+            if width > 1 and byteorder != sys.byteorder:
+                words.byteswap()
+            return words
+
+        words = compiler.Compiler._new_object(word_size)
+        if word_size % 8 == 0 and width > 1 and byteorder == 'little':
+            swapped = bytearray(len(data))
+            for i in range(width):
+                swapped[i::width] = data[width - 1 - i::width]
+            data = swapped
+        # Otherwise read the bits of whole blocks of words at once (see Compiler._pack_into)
+        step = width if word_size % 8 == 0 else word_size // math.gcd(word_size, 8)
+        step *= compiler.Compiler._PACK_BLOCK_SIZE
+        for start in range(0, len(data), step):
+            block = data[start:start + step]
+            bits = '{0:0{1}b}'.format(int.from_bytes(block, 'big'), len(block) * 8)
+            words.extend(int(bits[i:i + word_size], 2) for i in range(0, len(bits) - word_size + 1, word_size))
+        return words
+
+    @classmethod
+    def read_image(cls, file, word_size, byteorder='big', bitorder='msb'):
+        """Returns the words of an image: an object file (.kobj, one word of bits per line) or a binary file"""
+        try:
+            if file.endswith('.kobj'):
+                with open(file, 'r') as fin:
+                    lines = fin.read().split()
+            else:
+                with open(file, 'rb') as fin:
+                    return cls._unpack_words(fin.read(), word_size, byteorder, bitorder)
+        except FileNotFoundError:
+            DISASSEMBLER_ERR_INVALID_FILE.print_exit(file)
+
+        words = compiler.Compiler._new_object(word_size)
+        try:
+            words.extend(map(int, lines, [2] * len(lines)))
+        except (ValueError, OverflowError):
+            DISASSEMBLER_ERR_INVALID_OBJECT.print_exit(file)
+        return words
+
+    @classmethod
+    def _lookup(cls, table):
+        # (Words always fit the word size, so a list table can be indexed by any of them)
+        return table.get if isinstance(table, dict) else table.__getitem__
+
+    @classmethod
+    def _instruction_starts(cls, words, table):
+        """Walks the image once, and returns where each instruction starts (as flags) and every address it uses"""
+        lookup = cls._lookup(table)
+        starts = bytearray(len(words) + 1)
+        targets = set()
+        i = 0
+        end = len(words)
+        while i < end:
+            starts[i] = 1
+            entry = lookup(words[i])
+            if entry is None:
+                i += 1
+                continue
+            for position in entry.addresses:
+                if i + position < end:
+                    targets.add(words[i + position])
+            i += entry.size
+        if i == end:
+            starts[end] = 1
+        return starts, targets
+
+    @classmethod
+    def iter_source(cls, words, pa, table=None):
+        """Lazily yields the source of an image, one line at a time. Addresses that point to an instruction (or right
+        past the end of the image) are given a label, and words that don't decode to an instruction are emitted as
+        comments, which makes this an error for verify."""
+        table = table if table is not None else cls.decode_table(pa)
+        lookup = cls._lookup(table)
+        starts, targets = cls._instruction_starts(words, table)
+        labels = {address: cls.LABEL_FORMAT.format(address) for address in targets
+                  if address < len(starts) and starts[address]}
+
+        i = 0
+        end = len(words)
+        while i < end:
+            if i in labels:
+                yield labels[i] + ':'
+            entry = lookup(words[i])
+            if entry is None or i + entry.size > end:
+                yield '\t; {:#x}: unknown word {:#x}'.format(i, words[i])
+                i += 1
+                continue
+
+            args = list(words[i + 1:i + entry.size])
+            for position in entry.addresses:
+                args[position - 1] = labels.get(args[position - 1], args[position - 1])
+            yield '\t' + entry.template.format(*args)
+            i += entry.size
+        if end in labels:
+            yield labels[end] + ':'
+
+    @classmethod
+    def disassemble(cls, words, pa, fout):
+        """Writes the source of an image to fout, a large block of lines at a time"""
+        lines = cls.iter_source(words, pa)
+        block = []
+        for line in lines:
+            block.append(line)
+            if len(block) >= cls._WRITE_BLOCK_SIZE:
+                fout.write('\n'.join(block) + '\n')
+                block = []
+        if len(block) > 0:
+            fout.write('\n'.join(block) + '\n')
+
+    @classmethod
+    def verify(cls, words, pa):
+        """Checks that an image decodes to instructions only, and that compiling its source gives the same image back.
+        Returns None if it does, or the position of the first word that differs (0 if the source doesn't compile at
+        all, in which case the compiler says why).
+        Images are compared once packed (see Compiler._pack_words), so the padding words of a binary image (see
+        _unpack_words) don't count as a difference."""
+        source = StringIO()
+        cls.disassemble(words, pa, source)
+        source.seek(0)
+        try:
+            compiled = compiler.Compiler.compile_program(preprocessor.InputPreprocessor.parse_file(source), pa)
+        except SystemExit:
+            return 0
+        if compiler.Compiler._pack_words(compiled, pa.WORD_SIZE) == compiler.Compiler._pack_words(words, pa.WORD_SIZE):
+            return None
+        for i, (expected, actual) in enumerate(zip(words, compiled)):
+            if expected != actual:
+                return i
+        return None if len(words) == len(compiled) else min(len(words), len(compiled))
+
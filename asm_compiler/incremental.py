@@ -0,0 +1,77 @@
+import os
+import pickle
+import hashlib
+import tempfile
+from instruction_set_parser import arch_cache
+
+
+class EncodingCache:
+    """Remembers how every line of a source file was compiled, so that rebuilding it only compiles the lines that
+    changed. Lines are keyed by their (preprocessed) content, and the whole cache by the processor architecture they
+    were compiled against: a cache built for a different architecture, or by another version of kasmc, is empty.
+    See Compiler.parse_file and Compiler._compile_line."""
+
+    # Bump this whenever what Compiler._compile_line returns changes, so that older caches are ignored
+    FORMAT = 4
+
+    def __init__(self, pa):
+        self.digest = self.architecture_digest(pa)
+        # Every compiled line known to the cache, and the ones that were used by the last compilation
+        self.lines = {}
+        self.used_lines = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def architecture_digest(cls, pa):
+        """Returns a key that only depends on what a ProcessorArchitecture encodes, not on where it was loaded from"""
+        content = repr((arch_cache.KASMC_VERSION, cls.FORMAT, pa.WORD_SIZE, pa.INSTRUCTION_SET))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def path(cls, output):
+        """Returns where the cache of an output file is kept"""
+        return output + '.kcache'
+
+    @classmethod
+    def load(cls, path, pa):
+        """Loads the cache stored in path, or returns an empty one if there isn't a valid cache for pa there"""
+        cache = cls(pa)
+        try:
+            with open(path, 'rb') as fin:
+                digest, lines = pickle.load(fin)
+        except FileNotFoundError:
+            return cache
+        except Exception:
+            # A corrupted cache is as good as a missing one, and will be overwritten
+            return cache
+
+        if digest == cache.digest and isinstance(lines, dict):
+            cache.lines = lines
+        return cache
+
+    def get(self, line):
+        call = self.lines.get(line)
+        if call is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used_lines[line] = call
+        return call
+
+    def put(self, line, call):
+        self.lines[line] = call
+        self.used_lines[line] = call
+
+    def save(self, path):
+        """Atomically stores the lines used by the last compilation (forgetting the others, so that the cache doesn't
+        grow forever)"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.kcache-')
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                pickle.dump((self.digest, self.used_lines), fout, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
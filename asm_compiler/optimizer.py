@@ -0,0 +1,213 @@
+from array import array
+from asm_compiler import program as program_ir
+from profiling import profiler
+
+# What an instruction does to the flow of the program, as far as the optimizer can tell from its signature
+# Never falls through to the next line: HALT
+TERMINATOR = 'terminator'
+# Always jumps to its address: JP $address
+JUMP = 'jump'
+# May jump to its address, or fall through: JP Z,_$address
+BRANCH = 'branch'
+# Jumps somewhere that isn't known until the program runs: JP (B)
+INDIRECT = 'indirect'
+# Copies a register into another one: LD A,_B
+MOVE = 'move'
+
+
+class Optimizer:
+    """Removes code that can't be reached and jumps that can be avoided from a compiled Program, before its addresses
+    are relocated (see Compiler.compile_program).
+
+    The program is split in basic blocks, starting at the first line, at every line that's jumped to and after every
+    jump. Only the blocks that can be reached from the first line are kept, jumps to an unconditional jump go straight
+    to where that one goes, unconditional jumps to the next line are dropped, and so are moves that undo the one right
+    before them (LD A, B then LD B, A). Addresses (and line numbers passed as literals) still point to lines of code at
+    this point, so they're simply renumbered once lines are removed.
+
+    Instruction sets say which instructions are jumps by their mnemonic (see ProcessorArchitecture.JUMPS, TERMINATORS
+    and MOVES), and instructions they don't declare are assumed to fall through to the next line, so a program whose
+    instruction set declares none of them is left as it is. Only the first line is assumed to be an entry point, and if
+    the program has indirect jumps (whose target isn't known) no line is removed at all.
+    """
+
+    @classmethod
+    def _kind(cls, tokens, pa):
+        """Returns what an instruction does to the flow of the program (or None), given its tokenized signature.
+        Terminators stop the program, or return to wherever they were called from (which is right after a call, and
+        calls are always assumed to fall through), and must take no arguments. Jumps are unconditional if their only
+        argument is an address, conditional if they take others too, and indirect if they don't take an address at
+        all. Moves copy their second argument (a register) into the first one (a register)."""
+        if tokens is None:
+            return None
+        name = tokens['name'].upper()
+        args = tokens['args']
+        if name in pa.TERMINATORS and len(args) == 0:
+            return TERMINATOR
+        if name in pa.JUMPS:
+            if args == ['$address']:
+                return JUMP
+            return BRANCH if '$address' in args else INDIRECT
+        if name in pa.MOVES and len(args) == 2 and args[0].isalpha() and args[1].isalpha():
+            return MOVE
+        return None
+
+    @classmethod
+    def _follow(cls, target, kinds, jump_targets):
+        """Returns where a jump to target ends up, going through every unconditional jump on the way"""
+        seen = set()
+        while target < len(kinds) and kinds[target] == JUMP and target not in seen:
+            seen.add(target)
+            target = jump_targets[target]
+        return target
+
+    @classmethod
+    def _reachable(cls, kinds, targets):
+        """Returns which lines (as flags) belong to a basic block that can be reached from the first line.
+        :param kinds: What each line does to the flow of the program.
+        :param targets: The lines each line jumps to, for the lines that have addresses ({line: [line, ...]}).
+        """
+        n = len(kinds)
+        # Blocks start at the first line, at every line that's jumped to and right after every jump
+        leaders = {0}
+        for ln, lines in targets.items():
+            leaders.update(target for target in lines if target < n)
+            leaders.add(ln + 1)
+        for ln in range(n):
+            if kinds[ln] in (TERMINATOR, JUMP):
+                leaders.add(ln + 1)
+        starts = sorted(leader for leader in leaders if leader < n)
+        block_of = {start: i for i, start in enumerate(starts)}
+        ends = starts[1:] + [n]
+
+        reachable = bytearray(n)
+        pending = [0] if n > 0 else []
+        visited = set(pending)
+        while len(pending) > 0:
+            block = pending.pop()
+            start, end = starts[block], ends[block]
+            reachable[start:end] = b'\x01' * (end - start)
+
+            successors = [block_of[target] for ln in range(start, end) for target in targets.get(ln, ())
+                          if target < n]
+            if kinds[end - 1] not in (TERMINATOR, JUMP) and end < n:
+                successors.append(block + 1)
+            for successor in successors:
+                if successor not in visited:
+                    visited.add(successor)
+                    pending.append(successor)
+        return reachable
+
+    @classmethod
+    def optimize(cls, program, pa, labels=None):
+        """Returns an optimized copy of a Program whose addresses haven't been relocated yet (see Program.relocate).
+        Labels passed as literals are only renumbered if the program resolved them (see Program.literals), rather than
+        the preprocessor.
+        :param labels: The line each label points to ({label: line}), which is updated to the lines of the copy.
+        """
+        n = len(program)
+        layout = program.layout()
+        words = program.words
+        signatures = [pa.SIGNATURES.get(instr) for instr in program.instruction_set]
+        instruction_kinds = [cls._kind(tokens, pa) for tokens in signatures]
+        kinds = [instruction_kinds[i] for i in program.instructions]
+
+        # The positions (in words) of the addresses of each line, and the line each one points to
+        relocations = {}
+        for position in program.relocations:
+            relocations.setdefault(program.line_at(position, layout), []).append(position)
+        targets = {ln: [words[position] for position in positions] for ln, positions in relocations.items()}
+        jump_targets = {ln: targets[ln][0] for ln in targets if kinds[ln] == JUMP}
+        # The positions of the line numbers passed as literals, which don't change the flow of the program
+        literals = {}
+        for position in program.literals:
+            literals.setdefault(program.line_at(position, layout), []).append(position)
+
+        # Jumps to jumps go straight to the last one
+        threaded = 0
+        for ln, lines in targets.items():
+            if kinds[ln] not in (JUMP, BRANCH):
+                continue
+            for i, target in enumerate(lines):
+                final = cls._follow(target, kinds, jump_targets)
+                if final != target:
+                    lines[i] = final
+                    threaded += 1
+            if kinds[ln] == JUMP:
+                jump_targets[ln] = lines[0]
+
+        keep = bytearray(b'\x01' * n)
+        if INDIRECT not in kinds:
+            keep = cls._reachable(kinds, targets)
+
+            # Unconditional jumps to the next line that's kept can simply fall through to it
+            next_kept = n
+            for ln in range(n - 1, -1, -1):
+                if not keep[ln]:
+                    continue
+                if kinds[ln] == JUMP and jump_targets[ln] == next_kept:
+                    keep[ln] = 0
+                    continue
+                next_kept = ln
+
+            # A move that undoes the one right before it does nothing, unless something jumps to it (jumps to lines that
+            # were removed go to the next line that's kept), and neither does a move of a register into itself
+            jumped_to = set()
+            for ln, lines in targets.items():
+                if keep[ln]:
+                    for target in lines:
+                        while target < n and not keep[target]:
+                            target += 1
+                        jumped_to.add(target)
+            previous = None
+            for ln in range(n):
+                if not keep[ln]:
+                    continue
+                if ln in jumped_to:
+                    previous = None
+                move = None
+                if kinds[ln] == MOVE:
+                    tokens = signatures[program.instructions[ln]]
+                    move = (tokens['name'], tokens['args'][0], tokens['args'][1])
+                    if move[1] == move[2] or (previous is not None and move == (previous[0], previous[2], previous[1])):
+                        keep[ln] = 0
+                        continue
+                previous = move
+
+        # Number the lines that are kept again. Lines that are removed are replaced by the next line that's kept,
+        # which is where the program would have gone from them.
+        renumbered = array('L', [0]) * (n + 1)
+        count = sum(keep)
+        next_line = count
+        renumbered[n] = count
+        for ln in range(n - 1, -1, -1):
+            if keep[ln]:
+                next_line -= 1
+            renumbered[ln] = next_line
+
+        renumber = lambda line: renumbered[line] if line <= n else line - n + count
+        if labels is not None:
+            for label, line in labels.items():
+                labels[label] = renumber(line)
+
+        optimized = program_ir.Program(program.instruction_set, words[:0])
+        for ln in range(n):
+            if not keep[ln]:
+                continue
+            start = layout[ln]
+            line_words = list(words[start:layout[ln + 1]])
+            positions = relocations.get(ln, ())
+            for position, target in zip(positions, targets.get(ln, ())):
+                # (Addresses outside of the program stay outside of it, so that relocating them still fails)
+                line_words[position - start] = renumber(target)
+            offset = len(optimized.words) - start
+            for position in literals.get(ln, ()):
+                line_words[position - start] = renumber(words[position])
+                optimized.literals.append(position + offset)
+            optimized.append(program_ir.CompiledLine(program.instruction(ln), tuple(line_words),
+                                                     tuple(position - start for position in positions)))
+
+        if profiler.Profiler.enabled:
+            profiler.Profiler.count('lines_removed', n - count)
+            profiler.Profiler.count('jumps_threaded', threaded)
+        return optimized
@@ -0,0 +1,159 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from heapq import merge
+from itertools import accumulate, chain
+
+# A single compiled line of code (see Compiler._compile_line).
+# words are the encoded instruction and arguments, where addresses still point to lines of code, and relocations are
+# the positions of those addresses in words. externals are the addresses that still point to a label, which are
+# encoded as 0 until the label is resolved (see Program.resolve) or until the modules are linked (see the 'relocatable'
+# module), as (position in words, label). constants are the labels passed as literals ('LD A, end'), which stand for the
+# number of the line they point to rather than for its address, and are encoded as 0 until they're resolved as well.
+CompiledLine = namedtuple('CompiledLine', ('instruction', 'words', 'relocations', 'externals', 'constants'))
+CompiledLine.__new__.__defaults__ = ((), ())
+
+
+class Program:
+    """The compiled lines of a source file, stored column by column in arrays instead of one object per line:
+        instructions: the position in the instruction set of the instruction called by each line
+        words: the encoded words of every line, back to back (i.e. the object file, once relocated)
+        relocations: the positions in words that hold the number of a line of code, rather than its address
+        externals: the positions in words that hold the address of a label that wasn't resolved yet, as
+                   (position, label)
+        constants: the positions in words that hold the line number of a label that wasn't resolved yet, as
+                   (position, label)
+        literals: the positions in words that hold the line number of a label that was resolved (see resolve), which
+                  isn't relocated but still has to be renumbered if lines are removed (see the 'optimizer' module)
+    so that a program of a million lines only takes a few bytes per line.
+    The words of a line are as many as the size of its instruction, so where each line starts is found by adding up
+    the sizes of the lines before it (see layout).
+    """
+
+    __slots__ = ('instruction_set', 'instructions', 'words', 'relocations', 'externals', 'constants', 'literals',
+                 '_positions')
+
+    def __init__(self, instruction_set, words, positions=None):
+        """
+        :param instruction_set: The instructions that can be called (i.e. ProcessorArchitecture.INSTRUCTION_SET).
+        :param words: An empty array to hold the encoded words, able to store any word (see Compiler._new_object).
+        :param positions: The position of each instruction in instruction_set ({instruction: position}), if it was
+                          already computed (see positions).
+        """
+        self.instruction_set = instruction_set
+        self.instructions = array('L')
+        self.words = words
+        self.relocations = array('L')
+        # (Only lines that use labels that aren't resolved yet have any, so they're kept in a plain list)
+        self.externals = []
+        self.constants = []
+        self.literals = array('L')
+        self._positions = positions if positions is not None else self.positions(instruction_set)
+
+    @classmethod
+    def positions(cls, instruction_set):
+        return {instr: i for i, instr in enumerate(instruction_set)}
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def append(self, line):
+        """Adds a CompiledLine at the end of the program"""
+        start = len(self.words)
+        self.instructions.append(self._positions[line.instruction])
+        self.words.extend(line.words)
+        for position in line.relocations:
+            self.relocations.append(start + position)
+        for position, label in line.externals:
+            self.externals.append((start + position, label))
+        for position, label in line.constants:
+            self.constants.append((start + position, label))
+
+    def columns(self):
+        """Returns the program as (instructions, words, relocations, externals, constants), to be added to another one
+        with extend. A few arrays take much less time to pickle and unpickle than a CompiledLine per line."""
+        return self.instructions, self.words, self.relocations, self.externals, self.constants
+
+    def extend(self, columns):
+        """Adds the lines of another program at the end of this one, given as its columns (see columns)"""
+        instructions, words, relocations, externals, constants = columns
+        start = len(self.words)
+        self.instructions.extend(instructions)
+        self.words.extend(words)
+        self.relocations.extend(array('L', [start + position for position in relocations]) if start > 0
+                                else relocations)
+        for position, label in externals:
+            self.externals.append((start + position, label))
+        for position, label in constants:
+            self.constants.append((start + position, label))
+
+    def compiled_line(self, ln, layout):
+        """Returns a line as a CompiledLine (i.e. the opposite of append)"""
+        start, end = layout[ln], layout[ln + 1]
+        relocations = self.relocations[bisect_left(self.relocations, start):bisect_left(self.relocations, end)]
+        externals = self.externals[bisect_left(self.externals, (start,)):bisect_left(self.externals, (end,))]
+        constants = self.constants[bisect_left(self.constants, (start,)):bisect_left(self.constants, (end,))]
+        return CompiledLine(self.instruction(ln), tuple(self.words[start:end]),
+                            tuple(position - start for position in relocations),
+                            tuple((position - start, label) for position, label in externals),
+                            tuple((position - start, label) for position, label in constants))
+
+    def instruction(self, ln):
+        """Returns the instruction called by a line"""
+        return self.instruction_set[self.instructions[ln]]
+
+    def layout(self):
+        """Returns the address of each line in the object file (plus the address right past its end)"""
+        sizes = [instr.size for instr in self.instruction_set]
+        return array('L', accumulate(chain((0,), (sizes[i] for i in self.instructions))))
+
+    def line_at(self, position, layout):
+        """Returns the line whose words include the given position"""
+        return bisect_right(layout, position) - 1
+
+    def resolve(self, labels, word_size):
+        """Points every address in externals whose label is in labels ({label: line}) to the line of that label,
+        which makes it a relocation, and replaces every label in constants with the number of its line (which is never
+        relocated). Addresses and constants of other labels are left in externals and constants.
+        Returns the position of the first one whose line doesn't fit in a word (leaving it and the ones after it as
+        they are), or None if every one was resolved."""
+        words = self.words
+        constants = []
+        for position, label in self.constants:
+            line = labels.get(label)
+            if line is None:
+                constants.append((position, label))
+                continue
+            if line.bit_length() > word_size:
+                return position
+            words[position] = line
+            self.literals.append(position)
+        self.constants = constants
+
+        externals = []
+        resolved = []
+        for position, label in self.externals:
+            line = labels.get(label)
+            if line is None:
+                externals.append((position, label))
+                continue
+            if line.bit_length() > word_size:
+                return position
+            words[position] = line
+            resolved.append(position)
+        if len(resolved) > 0:
+            self.relocations = array('L', merge(self.relocations, resolved))
+        self.externals = externals
+        return None
+
+    def relocate(self, layout, word_size):
+        """Replaces every line number in words with the address of that line (which must only be done once).
+        Returns the position of the first one that is outside of the program or doesn't fit in a word (leaving it
+        and the ones after it as they are), or None if every one was relocated."""
+        words = self.words
+        for position in self.relocations:
+            target = words[position]
+            if target >= len(layout) or layout[target].bit_length() > word_size:
+                return position
+            words[position] = layout[target]
+        return None
@@ -0,0 +1,64 @@
+from itertools import islice
+
+
+class RecordWriter:
+    """Formats a packed image (see Compiler._pack_words) as Intel HEX or Motorola S-records, the text formats read by
+    most loaders and simulators. The image is split in records of RECORD_SIZE bytes, each with its own checksum, and
+    the lines are yielded lazily, straight from the image (which is never copied as a whole)."""
+
+    # How many bytes of the image each data record holds
+    RECORD_SIZE = 16
+    # How many records are joined together before being written
+    _WRITE_BLOCK_SIZE = 1 << 12
+
+    @classmethod
+    def _intel_hex_record(cls, address, kind, data):
+        # The checksum is the two's complement of the sum of every other byte of the record
+        checksum = -(len(data) + (address >> 8) + (address & 0xFF) + kind + sum(data)) & 0xFF
+        return ':{:02X}{:04X}{:02X}{}{:02X}\n'.format(len(data), address, kind, data.hex().upper(), checksum)
+
+    @classmethod
+    def intel_hex(cls, image):
+        """Lazily yields the lines of the Intel HEX file of an image. Images larger than 64KiB get extended linear
+        address records (type 04) every 64KiB."""
+        view = memoryview(image)
+        upper = 0
+        for start in range(0, len(view), cls.RECORD_SIZE):
+            if start >> 16 != upper:
+                upper = start >> 16
+                yield cls._intel_hex_record(0, 4, upper.to_bytes(2, 'big'))
+            yield cls._intel_hex_record(start & 0xFFFF, 0, view[start:start + cls.RECORD_SIZE])
+        yield cls._intel_hex_record(0, 1, b'')
+
+    @classmethod
+    def _srec_record(cls, kind, address, address_size, data):
+        address = address.to_bytes(address_size, 'big')
+        count = address_size + len(data) + 1
+        # The checksum is the one's complement of the sum of the count, address and data bytes
+        checksum = 0xFF - (count + sum(address) + sum(data)) & 0xFF
+        return 'S{}{:02X}{}{}{:02X}\n'.format(kind, count, address.hex().upper(), data.hex().upper(), checksum)
+
+    @classmethod
+    def srec(cls, image, header=b''):
+        """Lazily yields the lines of the Motorola S-record file of an image: a header (S0), the data (S1, S2 or S3,
+        depending on how many bytes the addresses of the image take), how many data records there are (S5 or S6)
+        and the end of the file (S9, S8 or S7)."""
+        view = memoryview(image)
+        address_size = 2 if len(view) <= 1 << 16 else 3 if len(view) <= 1 << 24 else 4
+        kind = address_size - 1
+
+        yield cls._srec_record(0, 0, 2, header)
+        count = 0
+        for start in range(0, len(view), cls.RECORD_SIZE):
+            yield cls._srec_record(kind, start, address_size, view[start:start + cls.RECORD_SIZE])
+            count += 1
+        if count <= 0xFFFF:
+            yield cls._srec_record(5, count, 2, b'')
+        elif count <= 0xFFFFFF:
+            yield cls._srec_record(6, count, 3, b'')
+        yield cls._srec_record(10 - kind, 0, address_size, b'')
+
+    @classmethod
+    def blocks(cls, lines):
+        """Lazily joins lines (such as the ones yielded by intel_hex or srec) in large blocks of text"""
+        return iter(lambda: ''.join(islice(lines, cls._WRITE_BLOCK_SIZE)), '')
@@ -0,0 +1,111 @@
+import sys
+import json
+from array import array
+
+
+class RelocatableObject:
+    """A module compiled on its own (see Compiler.compile_relocatable), to be linked with others into a single image
+    (see the 'linker' package). Its words are laid out as if the module started at address 0:
+        relocations: the positions in words that hold the address of a line of the module, which move along with it
+        exports: the address of every label declared GLOBAL by the module ({label: address})
+        externals: the positions in words that hold the address of a label of another module (encoded as 0), as
+                   (position, label)
+    so that linking a module only takes adding where it starts to its relocations, and patching its externals.
+    Objects are keyed by the processor architecture they were compiled against (see EncodingCache.architecture_digest),
+    and only objects compiled against the same one can be linked together.
+    """
+
+    # Bump this whenever what's stored in an object file changes, so that older ones are rejected
+    FORMAT = 2
+    EXTENSION = '.krel'
+    # Object files start with MAGIC and FORMAT on a line of their own, followed by a line with the JSON table of
+    # everything but the words, and by the words themselves: as they're stored in memory (in little-endian byte order)
+    # if they fit a machine type, or else as big-endian numbers of as many bytes as it takes to hold WORD_SIZE bits.
+    # Nothing in them is ever run, and every position they hold is checked to be one of their words when they're read,
+    # so linking an object that came from anywhere is safe.
+    MAGIC = 'KREL'
+    _TYPECODES = {array(typecode).itemsize: typecode for typecode in 'QLIHB'}
+
+    def __init__(self, digest, word_size, words, relocations=None, exports=None, externals=None):
+        self.digest = digest
+        self.word_size = word_size
+        self.words = words
+        self.relocations = relocations if relocations is not None else array('L')
+        self.exports = exports if exports is not None else {}
+        self.externals = externals if externals is not None else []
+
+    @classmethod
+    def path(cls, output):
+        """Returns where the object file of an output is written"""
+        return output + cls.EXTENSION
+
+    @classmethod
+    def _header(cls):
+        return '{} {}\n'.format(cls.MAGIC, cls.FORMAT).encode('ascii')
+
+    def dumps(self):
+        """Returns the content of the object file"""
+        if isinstance(self.words, array):
+            itemsize = self.words.itemsize
+            words = self.words
+            if itemsize > 1 and sys.byteorder != 'little':
+                words = array(words.typecode, words)
+                words.byteswap()
+            data = words.tobytes()
+        else:
+            itemsize = 0
+            width = -(-self.word_size // 8)
+            data = b''.join(word.to_bytes(width, 'big') for word in self.words)
+
+        table = {'digest': self.digest, 'word_size': self.word_size, 'count': len(self.words), 'itemsize': itemsize,
+                 'relocations': list(self.relocations), 'exports': self.exports, 'externals': self.externals}
+        return self._header() + json.dumps(table, sort_keys=True).encode('utf-8') + b'\n' + data
+
+    @classmethod
+    def loads(cls, data):
+        """Reads the content of an object file, raising a ValueError if it isn't one (or was written by an older
+        version of kasmc)"""
+        header = cls._header()
+        if not data.startswith(header):
+            raise ValueError('Not an object file, or one with another format.')
+        # (Decoding errors are ValueErrors as well)
+        table, _, data = data[len(header):].partition(b'\n')
+        table = json.loads(table.decode('utf-8'))
+        try:
+            count = table['count']
+            itemsize = table['itemsize']
+            if itemsize > 0:
+                words = array(cls._TYPECODES[itemsize])
+                if len(data) != count * itemsize:
+                    raise ValueError('Truncated object file.')
+                words.frombytes(data)
+                if itemsize > 1 and sys.byteorder != 'little':
+                    words.byteswap()
+            else:
+                width = -(-table['word_size'] // 8)
+                if len(data) != count * width:
+                    raise ValueError('Truncated object file.')
+                words = [int.from_bytes(data[i:i + width], 'big') for i in range(0, len(data), width)]
+            relocations = array('L', table['relocations'])
+            externals = [(position, label) for position, label in table['externals']]
+            exports = dict(table['exports'])
+        except (KeyError, TypeError, OverflowError):
+            raise ValueError('Not an object file.')
+
+        # The linker patches words at these positions, so one outside of the object would patch another one (or fail)
+        if not all(cls._is_position(position, count) for position in relocations) or \
+                not all(cls._is_position(position, count) and isinstance(label, str) for position, label in externals):
+            raise ValueError('Corrupted object file: a position is outside of its words.')
+        # (A label can also be defined right after the last word)
+        if not all(cls._is_position(address, count + 1) for address in exports.values()):
+            raise ValueError('Corrupted object file: an exported label is outside of its words.')
+        return cls(table['digest'], table['word_size'], words, relocations, exports, externals)
+
+    @classmethod
+    def _is_position(cls, position, count):
+        return type(position) is int and 0 <= position < count
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as fin:
+            return cls.loads(fin.read())
@@ -0,0 +1,48 @@
+import json
+import argparse
+from benchmarks import run_benchmarks
+
+
+class Comparison:
+    """Compares two benchmark reports (see run_benchmarks), stage by stage"""
+
+    @classmethod
+    def compare(cls, baseline, candidate, threshold=0.1, minimum=0.001):
+        """Returns (case name, stage, baseline time, candidate time, is a regression) for each stage of each case that
+        appears in both reports. A stage regressed if it got slower by more than threshold (a fraction), ignoring
+        stages that take less than minimum seconds in both reports, since they're mostly noise."""
+        baseline_cases = {result['name']: result for result in baseline['results']}
+        rows = []
+        for result in candidate['results']:
+            old = baseline_cases.get(result['name'])
+            if old is None:
+                continue
+            for stage in run_benchmarks.Benchmark.STAGES:
+                old_time, new_time = old['stages'][stage], result['stages'][stage]
+                regression = max(old_time, new_time) >= minimum and new_time > old_time * (1 + threshold)
+                rows.append((result['name'], stage, old_time, new_time, regression))
+        return rows
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Compare two benchmark reports and flag regressions.')
+    arg_parser.add_argument('baseline', help='The report to compare against.')
+    arg_parser.add_argument('candidate', help='The new report.')
+    arg_parser.add_argument('-t', '--threshold', type=float, default=10.0,
+                            help='How much slower (in percent) a stage can get before it is a regression.')
+
+    args = arg_parser.parse_args()
+    with open(args.baseline, 'r') as fin:
+        baseline = json.load(fin)
+    with open(args.candidate, 'r') as fin:
+        candidate = json.load(fin)
+
+    rows = Comparison.compare(baseline, candidate, args.threshold / 100)
+    for name, stage, old_time, new_time, regression in rows:
+        print('{:<50} {:<20} {:>10.4f}s {:>10.4f}s {:>+8.1f}%{}'.format(
+            name, stage, old_time, new_time, (new_time / old_time - 1) * 100 if old_time > 0 else 0.0,
+            '  REGRESSION' if regression else ''))
+
+    regressions = sum(1 for row in rows if row[4])
+    print('\n{} regression(s) over {}%.'.format(regressions, args.threshold))
+    exit(1 if regressions > 0 else 0)
@@ -0,0 +1,96 @@
+import random
+
+
+class ArchitectureGenerator:
+    """Generates processor architecture files with any number of instructions"""
+
+    REGISTERS = 'ABCDEFGH'
+    # The syntax of the generated instructions and their size. Each form gets its own mnemonic (in each group), since
+    # a line matches the first signature that shares the most arguments with it: 'OP A,_B' would otherwise be chosen
+    # for 'OP (1), B' over 'OP ($literal),_B'.
+    FORMS = [
+        ('LD{group} {a},_$literal', 2),
+        ('ST{group} ($literal),_{a}', 2),
+        ('MV{group} {a},_{b}', 1),
+        ('LM{group} {a},_({b})', 1),
+        ('JP{group} {a},_$address', 2)
+    ]
+
+    @classmethod
+    def word_size(cls, instructions, words=0):
+        """Returns the smallest word size that fits every opcode and every address of a program of the given size"""
+        return max(8, (instructions - 1).bit_length(), words.bit_length())
+
+    @classmethod
+    def instructions(cls, count):
+        """Returns the (opcode, size, syntax) of count instructions, which are always HALT and JP first"""
+        instructions = [(0, 1, 'HALT'), (1, 2, 'JP $address')]
+        variants = len(cls.FORMS) * len(cls.REGISTERS)
+        for opcode in range(len(instructions), count):
+            group, variant = divmod(opcode - 2, variants)
+            form, register = divmod(variant, len(cls.REGISTERS))
+            syntax, size = cls.FORMS[form]
+            syntax = syntax.format(group=group, a=cls.REGISTERS[register],
+                                   b=cls.REGISTERS[(register + 1) % len(cls.REGISTERS)])
+            instructions.append((opcode, size, syntax))
+        return instructions[:count]
+
+    @classmethod
+    def generate(cls, count, word_size=None):
+        """Returns the text of an architecture file with count instructions"""
+        word_size = word_size or cls.word_size(count)
+        lines = ['WORD_SIZE({})'.format(word_size), '']
+        lines += ['INSTRUCTION({}, {}, \'{}\')'.format(opcode, size, syntax)
+                  for opcode, size, syntax in cls.instructions(count)]
+        return '\n'.join(lines) + '\n'
+
+
+class SourceGenerator:
+    """Generates source files that call the instructions of an architecture"""
+
+    # How often labels are defined, and how many lines jump somewhere, for each mix of source code
+    MIXES = {
+        # No labels, no jumps
+        'plain': (0, 0.0),
+        # A label every 4 lines, a few jumps
+        'labels': (4, 0.1),
+        # A label every 16 lines, half of the lines jump
+        'jumps': (16, 0.5)
+    }
+
+    @classmethod
+    def _call(cls, instr, rng, literal_bits, labels):
+        line = instr.name.replace('_', ' ')
+        while '$literal' in line:
+            line = line.replace('$literal', str(rng.getrandbits(literal_bits)), 1)
+        while '$address' in line:
+            line = line.replace('$address', rng.choice(labels) if labels else '0', 1)
+        return '\t' + line
+
+    @classmethod
+    def generate(cls, instruction_set, lines, mix='plain', word_size=8, seed=0):
+        """Returns the text of a source file with the given number of lines of code.
+        :param instruction_set: The instructions to call (i.e. ProcessorArchitecture.INSTRUCTION_SET).
+        :param lines: How many lines of code (excluding labels) to generate.
+        :param mix: The kind of source code to generate. See MIXES.
+        :param word_size: The word size of the architecture, so that literals fit in a word.
+        :param seed: The seed of the random generator, so that the same source can be generated again.
+        """
+        label_every, jump_ratio = cls.MIXES[mix]
+        rng = random.Random(seed)
+
+        jumps = [instr for instr in instruction_set if '$address' in instr.name]
+        others = [instr for instr in instruction_set if '$address' not in instr.name]
+        labels = ['L{}'.format(i) for i in range(0, lines, label_every)] if label_every > 0 else []
+        literal_bits = min(word_size, 8)
+
+        out = []
+        for ln in range(lines):
+            if label_every > 0 and ln % label_every == 0:
+                out.append('L{}:'.format(ln))
+            if jumps and labels and rng.random() < jump_ratio:
+                instr = rng.choice(jumps)
+            else:
+                instr = rng.choice(others)
+            out.append(cls._call(instr, rng, literal_bits, labels))
+        return '\n'.join(out) + '\n'
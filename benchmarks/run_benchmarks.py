@@ -0,0 +1,121 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import itertools
+from io import StringIO
+from asm_compiler import compiler
+from input_preprocessor import preprocessor
+from instruction_set_parser import is_parser
+from instruction_set_parser import arch_cache
+from benchmarks import generators
+
+PRESETS = {
+    'quick': {'instructions': [16, 256], 'lines': [1000, 10000], 'mixes': ['plain', 'labels', 'jumps']},
+    'full': {'instructions': [16, 256, 4096, 65536], 'lines': [1000, 10000, 100000, 1000000],
+             'mixes': ['plain', 'labels', 'jumps']}
+}
+
+
+class Benchmark:
+    """Times each stage of the pipeline on generated architectures and sources"""
+
+    STAGES = ('parse_architecture', 'preprocess', 'compile', 'write_output')
+
+    @classmethod
+    def case_name(cls, instructions, lines, mix):
+        return 'instructions={},lines={},mix={}'.format(instructions, lines, mix)
+
+    @classmethod
+    def _time(cls, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        return time.perf_counter() - start, result
+
+    @classmethod
+    def run_case(cls, instructions, lines, mix, repeat=3, directory=None):
+        """Runs one benchmark case, returning the best time of each stage over repeat runs"""
+        word_size = generators.ArchitectureGenerator.word_size(instructions, 2 * lines + 2)
+        architecture_text = generators.ArchitectureGenerator.generate(instructions, word_size)
+        pa = is_parser.InstructionSetParser.parse_file(StringIO(architecture_text))
+        source_text = generators.SourceGenerator.generate(pa.INSTRUCTION_SET, lines, mix, word_size)
+
+        with tempfile.TemporaryDirectory(dir=directory) as work_dir:
+            architecture_path = os.path.join(work_dir, 'architecture.txt')
+            source_path = os.path.join(work_dir, 'source.txt')
+            output = os.path.join(work_dir, 'output')
+            with open(architecture_path, 'w') as fout:
+                fout.write(architecture_text)
+            with open(source_path, 'w') as fout:
+                fout.write(source_text)
+
+            best = {stage: float('inf') for stage in cls.STAGES}
+            words = 0
+            for _ in range(repeat):
+                times = {}
+                times['parse_architecture'], pa = cls._time(is_parser.InstructionSetParser.parse_file,
+                                                            architecture_path)
+                times['preprocess'], source = cls._time(preprocessor.InputPreprocessor.parse_file, source_path)
+                times['compile'], obj = cls._time(compiler.Compiler.compile_program, source, pa)
+                # (Outputs that are already there aren't written again, see Compiler._file_holds)
+                for extension in ('.kasm', '.kobj'):
+                    if os.path.exists(output + extension):
+                        os.remove(output + extension)
+                times['write_output'], _ = cls._time(compiler.Compiler._write_output, obj, output, pa, True, True)
+                words = len(obj)
+                for stage in cls.STAGES:
+                    best[stage] = min(best[stage], times[stage])
+
+        return {
+            'name': cls.case_name(instructions, lines, mix),
+            'instructions': instructions,
+            'lines': lines,
+            'mix': mix,
+            'word_size': word_size,
+            'words': words,
+            'stages': best,
+            'lines_per_second': lines / best['compile'] if best['compile'] > 0 else None
+        }
+
+    @classmethod
+    def run(cls, instructions, lines, mixes, repeat=3, verbose=True):
+        results = []
+        for count, size, mix in itertools.product(instructions, lines, mixes):
+            result = cls.run_case(count, size, mix, repeat)
+            results.append(result)
+            if verbose:
+                print('{:<50} {}'.format(result['name'], '  '.join('{}={:.4f}s'.format(stage, result['stages'][stage])
+                                                                  for stage in cls.STAGES)))
+        return {
+            'kasmc_version': arch_cache.KASMC_VERSION,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': repeat,
+            'results': results
+        }
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Time each stage of kasmc on generated architectures and sources.')
+    arg_parser.add_argument('-p', '--preset', choices=sorted(PRESETS), default='quick',
+                            help='Which set of architecture and source sizes to run.')
+    arg_parser.add_argument('--instructions', type=int, nargs='+', help='Architecture sizes (overrides the preset).')
+    arg_parser.add_argument('--lines', type=int, nargs='+', help='Source sizes (overrides the preset).')
+    arg_parser.add_argument('--mixes', nargs='+', choices=sorted(generators.SourceGenerator.MIXES),
+                            help='Kinds of source code (overrides the preset).')
+    arg_parser.add_argument('-r', '--repeat', type=int, default=3, help='How many times to run each case.')
+    arg_parser.add_argument('-o', '--output', help='Where to write the results (as JSON).')
+
+    args = arg_parser.parse_args()
+    preset = PRESETS[args.preset]
+    report = Benchmark.run(args.instructions or preset['instructions'], args.lines or preset['lines'],
+                           args.mixes or preset['mixes'], args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(report, fout, indent=2)
+        print('Results written to {}.'.format(args.output))
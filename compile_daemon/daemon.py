@@ -0,0 +1,176 @@
+import io
+import os
+import sys
+import json
+import socket
+import traceback
+import contextlib
+import socketserver
+from instruction_set_parser import arch_cache
+
+
+class DaemonError(Exception):
+    """Specifies an error that occurred while starting the compile daemon"""
+
+    error_id = 0
+    error_msg = 'An error occurred while starting the compile daemon.'
+
+    def __init__(self, error_id, error_msg):
+        self.error_id = error_id
+        self.error_msg = error_msg
+
+    def __str__(self):
+        return self.error_msg
+
+    def print_err(self, ctx):
+        print('DAEMON ERROR {}: {}\n\t--> {}'.format(self.error_id, self.error_msg, ctx))
+
+    def print_exit(self, ctx):
+        self.print_err(ctx)
+        exit(self.error_id)
+
+DAEMON_ERR_ALREADY_RUNNING = DaemonError(1, 'A compile daemon is already listening on this socket.')
+DAEMON_ERR_UNSUPPORTED = DaemonError(2, 'Unix sockets are not supported on this platform. Use the stdin/stdout mode.')
+
+
+class CompileDaemon:
+    """Serves compile requests from a long-running process, so that modules are imported only once and parsed
+    processor architectures stay in memory (see ArchitectureCache).
+
+    Requests and responses are single lines of JSON:
+        {"argv": ["-i", "source.txt", ...], "cwd": "/where/the/client/runs"}
+        {"status": 0, "output": "what kasmc.py would have printed", "errors": "and printed on the standard error"}
+    ("errors" is left out if nothing was printed there.)
+    A {"shutdown": true} request stops the daemon. Requests are served one at a time, since each one runs in the
+    working directory of its client.
+    """
+
+    @classmethod
+    def default_socket(cls):
+        return os.environ.get('KASMC_SOCKET', os.path.join(arch_cache.ArchitectureCache.default_directory(),
+                                                           'kasmd.sock'))
+
+    @classmethod
+    def handle_request(cls, request, main):
+        """Runs main(argv) as if it had been invoked by the client, and returns its response"""
+        output = io.StringIO()
+        errors = io.StringIO()
+        status = 0
+        cwd = os.getcwd()
+        try:
+            os.chdir(request.get('cwd', cwd))
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(errors):
+                status = main(request.get('argv', []), use_daemon=False) or 0
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+            if isinstance(e.code, str):
+                output.write(e.code + '\n')
+        except Exception:
+            status = 1
+            output.write(traceback.format_exc())
+        finally:
+            os.chdir(cwd)
+        response = {'status': status, 'output': output.getvalue()}
+        if len(errors.getvalue()) > 0:
+            response['errors'] = errors.getvalue()
+        return response
+
+    @classmethod
+    def serve_lines(cls, fin, fout, main):
+        """Serves requests read from fin, one per line, writing each response to fout"""
+        for line in fin:
+            if len(line.strip()) == 0:
+                continue
+            request = json.loads(line)
+            if request.get('shutdown'):
+                fout.write(json.dumps({'status': 0, 'output': ''}) + '\n')
+                fout.flush()
+                return True
+            fout.write(json.dumps(cls.handle_request(request, main)) + '\n')
+            fout.flush()
+        return False
+
+    @classmethod
+    def serve(cls, path, main):
+        """Serves requests from a Unix socket (or from the standard input, if path is '-') until shut down"""
+        if path == '-':
+            # Keep the protocol on the real standard output, whatever the compiler prints
+            cls.serve_lines(sys.stdin, sys.stdout, main)
+            return
+
+        if not hasattr(socket, 'AF_UNIX'):
+            DAEMON_ERR_UNSUPPORTED.print_exit(path)
+        if DaemonClient.is_running(path):
+            DAEMON_ERR_ALREADY_RUNNING.print_exit(path)
+        # Nobody is listening, so whatever is left there belongs to a daemon that died
+        if os.path.exists(path):
+            os.remove(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fout = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+                if cls.serve_lines(io.TextIOWrapper(self.rfile, encoding='utf-8'), fout, main):
+                    self.server.shutdown_requested = True
+
+        with socketserver.UnixStreamServer(path, Handler) as server:
+            server.shutdown_requested = False
+            print('Listening on {}.'.format(path))
+            try:
+                while not server.shutdown_requested:
+                    server.handle_request()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.remove(path)
+
+
+class DaemonClient:
+    """Forwards a command line to a running CompileDaemon"""
+
+    @classmethod
+    def _connect(cls, path):
+        if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+            return None
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(path)
+        except OSError:
+            client.close()
+            return None
+        return client
+
+    @classmethod
+    def is_running(cls, path):
+        client = cls._connect(path)
+        if client is None:
+            return False
+        client.close()
+        return True
+
+    @classmethod
+    def request(cls, path, request):
+        """Sends a request to the daemon listening on path, and returns its response (or None if there's no daemon)"""
+        client = cls._connect(path)
+        if client is None:
+            return None
+        try:
+            with client, client.makefile('rw', encoding='utf-8') as stream:
+                stream.write(json.dumps(request) + '\n')
+                stream.flush()
+                client.shutdown(socket.SHUT_WR)
+                response = stream.readline()
+        except OSError:
+            return None
+        return json.loads(response) if len(response) > 0 else None
+
+    @classmethod
+    def compile(cls, path, argv):
+        """Compiles through the daemon listening on path, as if argv had been passed to kasmc.py.
+        Returns the exit status, or None if there's no daemon to do it."""
+        response = cls.request(path, {'argv': argv, 'cwd': os.getcwd()})
+        if response is None:
+            return None
+        print(response['output'], end='')
+        print(response.get('errors', ''), end='', file=sys.stderr)
+        return response['status']
@@ -0,0 +1,51 @@
+import os
+import mmap
+
+
+class LineReader:
+    """Reads the lines of a file lazily, from a memory mapping of the file, so that a source is never held in memory
+    more than once. Lines that are empty (or only whitespace) or that are comments are skipped before they're even
+    decoded. Anything that can be read (such as a StringIO) works too, one line at a time."""
+
+    ENCODING = 'utf-8'
+    # How many bytes of the mapping are split in lines at once (rounded up to the end of a line)
+    BLOCK_SIZE = 1 << 20
+
+    @classmethod
+    def _read_lines(cls, fin, comment):
+        for line in fin:
+            stripped = line.strip()
+            if len(stripped) > 0 and (comment is None or not stripped.startswith(comment)):
+                yield line.rstrip('\r\n')
+
+    @classmethod
+    def _mapped_lines(cls, fin, comment):
+        with fin:
+            # Empty files can't be mapped
+            if os.fstat(fin.fileno()).st_size == 0:
+                return
+            with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                comment = comment.encode(cls.ENCODING) if comment is not None else None
+                # Splitting a whole block of lines at once is much faster than reading one line at a time
+                start = 0
+                while start < len(mapping):
+                    end = mapping.find(b'\n', min(start + cls.BLOCK_SIZE, len(mapping)))
+                    end = len(mapping) if end < 0 else end + 1
+                    for line in mapping[start:end].split(b'\n'):
+                        stripped = line.strip()
+                        if len(stripped) > 0 and (comment is None or not stripped.startswith(comment)):
+                            yield line.rstrip(b'\r').decode(cls.ENCODING)
+                    start = end
+
+    @classmethod
+    def lines(cls, file, comment=None):
+        """Returns an iterator over the non-empty lines of a file (without their line terminators).
+        Raises FileNotFoundError right away if the file doesn't exist.
+        :param file: A filename, or anything that can be read.
+        :param comment: If given, lines whose first non-whitespace characters are this are skipped too.
+        """
+        # If something that can be read has been passed, use it
+        if hasattr(file, 'read'):
+            return cls._read_lines(file, comment)
+        # Otherwise assume that file is a filename
+        return cls._mapped_lines(open(file, 'rb'), comment)
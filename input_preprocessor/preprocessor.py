@@ -1,4 +1,8 @@
+import os
 import re
+from collections import OrderedDict
+from profiling import profiler
+from file_input import reader
 
 
 class PreprocessorError(Exception):
@@ -28,12 +32,17 @@ class PreprocessorError(Exception):
 
 PREPROCESSOR_ERR_INVALID_FILE = PreprocessorError(1, 'Could not read the input file.')
 PREPROCESSOR_ERR_INVALID_LABEL = PreprocessorError(2, 'Labels must be defined on a separate line.')
+PREPROCESSOR_ERR_INVALID_INCLUDE = PreprocessorError(3, 'Could not read the included file.')
+PREPROCESSOR_ERR_DUPLICATE_LABEL = PreprocessorError(4, 'Duplicate label; a label with the same name is already '
+                                                        'defined (or exported by an included file).')
 
 
 class InputPreprocessor:
 
     @classmethod
     def _remove_comments(cls, line):
+        if profiler.Profiler.enabled:
+            profiler.Profiler.count('regex_evaluations')
         match = re.search(r'(;.*?)$', line)
         if match is None:
             return line
@@ -45,70 +54,268 @@ class InputPreprocessor:
 
     @classmethod
     def _is_label_defined(cls, line):
+        if profiler.Profiler.enabled:
+            profiler.Profiler.count('regex_evaluations')
         return re.search(r'\w+:', line) is not None
 
+    # Labels can only be used as arguments, so everything up to the first whitespace (the instruction) is skipped
+    INSTRUCTION_REGEXP = re.compile(r'^\S+\s+')
+    # Any word in the arguments could be a label, but only whole words are (so 'end' won't touch 'endloop')
+    WORD_REGEXP = re.compile(r'\w+')
+
     @classmethod
     def _replace_label_usage(cls, line, addr_dict):
-        labels_used = [l for l in addr_dict if line.find(l)]
+        match = cls.INSTRUCTION_REGEXP.match(line)
+        if profiler.Profiler.enabled:
+            profiler.Profiler.count('regex_evaluations', 1 if match is None else 2)
+        if match is None:
+            return line
 
-        for label in labels_used:
-            line = line.replace(label, str(addr_dict[label]))
+        def replace(word):
+            address = addr_dict.get(word.group(0))
+            if address is None:
+                return word.group(0)
+            if profiler.Profiler.enabled:
+                profiler.Profiler.count('labels_substituted')
+            return str(address)
 
-        return line
+        return line[:match.end()] + cls.WORD_REGEXP.sub(replace, line[match.end():])
 
     @classmethod
     def _extract_label(cls, line):
+        if profiler.Profiler.enabled:
+            profiler.Profiler.count('regex_evaluations')
         match = re.search(r'^(\w+):$', line)
         if match is None:
             return None
         return match.group(1)
 
     @classmethod
-    def parse_file(cls, file):
-        """Parses a source file and performs label replacement, whitespace stripping and comment removal.
-        Doesn't care about syntax.
-        :param file: The file to parse.
+    def _read_lines(cls, file):
+        """Lazily yields the lines of a file (or of anything that can be read), without their line terminators.
+        Lines that are empty or only hold a comment are skipped (see the 'file_input' package)."""
+        try:
+            lines = reader.LineReader.lines(file, comment=';')
+        except FileNotFoundError:
+            PREPROCESSOR_ERR_INVALID_FILE.print_exit(-1, '')
+        return lines
+
+    # INCLUDE "file", where file is relative to the directory of the file that includes it
+    INCLUDE_REGEXP = re.compile(r'^INCLUDE\s+"(.+)"$', re.IGNORECASE)
+    # Included files that were already preprocessed ({path: (mtime, size, lines)}), so that a file included by many
+    # sources (or compiled many times by a long-running process, see the 'compile_daemon' package) is only read once.
+    # Only the most recent INCLUDE_CACHE_SIZE ones are kept.
+    INCLUDE_CACHE_SIZE = 64
+    _included = OrderedDict()
+
+    @classmethod
+    def _included_lines(cls, path):
+        """Returns the preprocessed lines of an included file (see _preprocess_lines), reading it again only if it was
+        modified since the last time"""
+        stat = os.stat(path)
+        entry = cls._included.get(path)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            cls._included.move_to_end(path)
+            return entry[2]
+
+        lines = list(cls._preprocess_lines(path))
+        cls._included[path] = (stat.st_mtime_ns, stat.st_size, lines)
+        while len(cls._included) > cls.INCLUDE_CACHE_SIZE:
+            cls._included.popitem(last=False)
+        return lines
+
+    # GLOBAL label[, label...] exports labels to the modules this one is linked with, EXTERN label[, label...] imports
+    # labels from them (see the 'relocatable' module)
+    GLOBAL = 'GLOBAL'
+    EXTERN = 'EXTERN'
+    LINKAGE_REGEXP = re.compile(r'^(GLOBAL|EXTERN)\s+(\w+(?:\s*,\s*\w+)*)$', re.IGNORECASE)
+
+    @classmethod
+    def _is_directive(cls, line):
+        """Returns whether a line may be an INCLUDE, GLOBAL or EXTERN directive (rather than an instruction)"""
+        return line[:7].upper() == 'INCLUDE' or line[:6].upper() in (cls.GLOBAL, cls.EXTERN)
+
+    @classmethod
+    def _scope_labels(cls, lines, scope):
+        """Returns the lines of an included file, where the labels it defines but doesn't declare GLOBAL are renamed to
+        scope__label (both where they're defined and where the file uses them), so that they can't clash with the
+        labels of any other file. Labels the file uses but doesn't define are left as they are."""
+        exported = set()
+        for cur_line in lines:
+            if cur_line[:6].upper() == cls.GLOBAL:
+                linkage = cls.LINKAGE_REGEXP.match(cur_line)
+                if profiler.Profiler.enabled:
+                    profiler.Profiler.count('regex_evaluations')
+                if linkage is not None:
+                    exported.update(label.strip() for label in linkage.group(2).split(','))
+        local = {cur_line[:-1]: '{}__{}'.format(scope, cur_line[:-1]) for cur_line in lines
+                 if cur_line.endswith(':') and cur_line[:-1] not in exported}
+        if len(local) == 0:
+            return lines
+
+        scoped = []
+        for cur_line in lines:
+            if cur_line.endswith(':'):
+                cur_line = local.get(cur_line[:-1], cur_line[:-1]) + ':'
+            elif not cls._is_directive(cur_line):
+                cur_line = cls._replace_label_usage(cur_line, local)
+            scoped.append(cur_line)
+        return scoped
+
+    @classmethod
+    def _locate(cls, source, index):
+        """Returns the number (counting from 1) and the text of the line of a source file that was preprocessed into its
+        index-th line (see _preprocess_lines), and the name of the file, to point errors at it. The file is read again
+        if it can be, otherwise the line number is only as good as index."""
+        name = source if isinstance(source, str) else '<input>'
+        try:
+            if isinstance(source, str):
+                fin = open(source, 'r')
+            else:
+                source.seek(0)
+                fin = source
+            code_lines = 0
+            for number, line in enumerate(fin, 1):
+                # (Lines that preprocessing drops are empty once their comment is removed)
+                if len(line.split(';', 1)[0].strip()) == 0:
+                    continue
+                if code_lines == index:
+                    return number, line.strip(), name
+                code_lines += 1
+        except (OSError, AttributeError, ValueError):
+            pass
+        return index + 1, '', name
+
+    @classmethod
+    def _error_context(cls, error, source, index, line):
+        """Stops with an error on the index-th preprocessed line of a source file (see _locate)"""
+        number, text, name = cls._locate(source, index)
+        error.print_exit(number, '{}  (in {})'.format(text or line, name))
+
+    @classmethod
+    def _expand_includes(cls, lines, directory, included, symbols, source=None, origin=None):
+        """Replaces every INCLUDE directive in lines with the lines of the file it includes, and removes every GLOBAL
+        and EXTERN directive, adding the labels they declare to symbols.
+        A file is only included the first time it's found (which also keeps files from including each other forever),
+        and its lines are spliced where it was included, so that they're laid out along with the ones of the file that
+        includes it. Each included file has labels of its own, and only shares the ones it declares GLOBAL (see
+        _scope_labels); it can still use the labels of the files that include it.
+        :param source: The file lines come from, to point errors at it.
+        :param origin: A list that gets the file and the position in it of the line that was yielded last, as
+                       [source, index] (see iter_file).
         """
+        for index, cur_line in enumerate(lines):
+            if origin is not None:
+                origin[:] = (source, index)
+            match = cls.INCLUDE_REGEXP.match(cur_line)
+            if profiler.Profiler.enabled:
+                profiler.Profiler.count('regex_evaluations')
+            if match is None:
+                # (Only lines that start like a directive are matched against it)
+                linkage = None
+                if cur_line[:6].upper() in (cls.GLOBAL, cls.EXTERN):
+                    linkage = cls.LINKAGE_REGEXP.match(cur_line)
+                    if profiler.Profiler.enabled:
+                        profiler.Profiler.count('regex_evaluations')
+                if linkage is None:
+                    yield cur_line
+                    continue
+                for label in linkage.group(2).split(','):
+                    symbols[label.strip()] = linkage.group(1).upper()
+                continue
 
-        # If something that can be read has been passed, use it
-        if hasattr(file, 'read'):
-                lines = file.read().split('\n')
-        # Otherwise assume that file is a filename
-        else:
+            path = os.path.realpath(os.path.join(directory, match.group(1)))
+            if path in included:
+                continue
+            # Every file that's included gets a scope of its own, named after the file and after how many files were
+            # included before it (so that files with the same name don't share one)
+            scope = '{}_{}'.format(re.sub(r'\W', '_', os.path.splitext(os.path.basename(path))[0]), len(included))
+            included.add(path)
             try:
-                with open(file, 'r') as fin:
-                    lines = fin.read().split('\n')
-            except FileNotFoundError:
-                PREPROCESSOR_ERR_INVALID_FILE.print_exit(-1, '')
-
-        # Remove empty lines
-        lines = [line for line in lines if len(line.strip()) > 0]
+                include_lines = cls._included_lines(path)
+            except OSError:
+                cls._error_context(PREPROCESSOR_ERR_INVALID_INCLUDE, source, index, cur_line)
+            yield from cls._expand_includes(cls._scope_labels(include_lines, scope), os.path.dirname(path), included,
+                                            symbols, path, origin)
 
-        # Keep a list of pre-processed lines to return
-        out_lines = []
-        # Store the address pointed to by labels
-        label_addresses = {}
+    @classmethod
+    def iter_file(cls, file, included=None, symbols=None, origin=None):
+        """Lazily preprocesses a source file and yields its lines one at a time, with comments and whitespace removed.
+        Label definitions are yielded as they are ('label:'), and labels used by instructions are left untouched,
+        so that whoever consumes the lines can resolve them (see Compiler.parse_stream).
+        :param file: The file to parse.
+        :param included: A set that gets the path of every file included by the source file.
+        :param symbols: A dictionary that gets the labels declared by GLOBAL and EXTERN directives ({label: GLOBAL or
+                        EXTERN}).
+        :param origin: A list that gets where the line that was yielded last comes from, as [file, index of the line
+                       among the preprocessed lines of that file] (see _locate).
+        """
+        included = included if included is not None else set()
+        symbols = symbols if symbols is not None else {}
+        if isinstance(file, str):
+            included.add(os.path.realpath(file))
+            directory = os.path.dirname(file)
+        else:
+            # Files included by something that isn't a file are relative to the working directory
+            directory = ''
+        return cls._expand_includes(cls._preprocess_lines(file), directory, included, symbols, file, origin)
 
-        # Begin analyzing the file line by line
+    @classmethod
+    def _preprocess_lines(cls, file):
+        """Lazily yields the preprocessed lines of a single file (see iter_file), leaving INCLUDE directives as they
+        are"""
         ln = 0  # Line number
-        for cur_line in lines:
+        for cur_line in cls._read_lines(file):
             # Take care of comments
             cur_line = cls._remove_comments(cur_line)
             # Take care of trailing whitespace
             cur_line = cls._strip_trailing_whitespace(cur_line)
+            # Skip empty lines (including those which only contained a comment)
+            if len(cur_line) == 0:
+                continue
+
+            # If a label was defined (label:) but it wasn't alone on its own line, raise an INVALID_LABEL error.
+            if cls._is_label_defined(cur_line) and cls._extract_label(cur_line) is None:
+                PREPROCESSOR_ERR_INVALID_LABEL.print_exit(ln, cur_line)
+
+            yield cur_line
+            if not cur_line.endswith(':'):
+                ln += 1
 
-            if cls._is_label_defined(cur_line):
-                label = cls._extract_label(cur_line)
-                # If a label was defined (label:) but it wasn't alone on its own line, raise an INVALID_LABEL error.
-                if label is None:
-                    PREPROCESSOR_ERR_INVALID_LABEL.print_exit(ln, cur_line)
+    @classmethod
+    def parse_file(cls, file, included=None, labels=None, symbols=None, replace_labels=True):
+        """Parses a source file and performs label replacement, whitespace stripping and comment removal.
+        Doesn't care about syntax.
+        :param file: The file to parse.
+        :param included: A set that gets the path of every file included by the source file.
+        :param labels: A dictionary that gets the line of code each label points to.
+        :param symbols: A dictionary that gets the labels declared by GLOBAL and EXTERN directives (see iter_file).
+        :param replace_labels: If false, labels used by instructions are left as they are, for the compiler to resolve
+                               (see Compiler.compile_program).
+        """
+
+        # Keep a list of pre-processed lines to return
+        out_lines = []
+        # Store the address pointed to by labels
+        label_addresses = labels if labels is not None else {}
+
+        # Begin analyzing the file line by line
+        origin = [file, 0]
+        for cur_line in cls.iter_file(file, included, symbols, origin):
+            label = cls._extract_label(cur_line)
+            if label is not None:
+                # A label can't be defined twice, whether by the same file or by the labels included files export
+                if label in label_addresses:
+                    cls._error_context(PREPROCESSOR_ERR_DUPLICATE_LABEL, origin[0], origin[1], cur_line)
                 # Set the address pointed to by this label to the current line number.
                 # NOTE: The compiler will take care of offsetting these values accordingly.
-                label_addresses[label] = ln
+                label_addresses[label] = len(out_lines)
             else:
-                # Otherwise output this line and increase the line counter
+                # Otherwise output this line
                 out_lines.append(cur_line)
-                ln += 1
+
+        if not replace_labels:
+            return out_lines
 
         # Re-iterate every line of code and replace labels in instruction calls with their address
         for idx, line in enumerate(out_lines):
@@ -0,0 +1,132 @@
+import os
+import pickle
+import hashlib
+import tempfile
+from io import StringIO
+from collections import OrderedDict
+from instruction_set_parser import is_parser
+
+# Cached architectures are only valid for the version of kasmc that parsed them.
+# Bump this whenever ProcessorArchitecture (or anything derived from it when parsing) changes.
+KASMC_VERSION = '0.4.3'
+
+
+class ArchitectureCache:
+    """Keeps parsed ProcessorArchitecture objects on disk, so that an architecture file is parsed only once.
+    Entries are keyed by the content of the architecture file and by the version of kasmc, so an entry is never used
+    for a file that changed, or by a version of kasmc that could parse the file differently."""
+
+    PREFIX = 'arch-'
+    SUFFIX = '.pickle'
+    # Architectures loaded by this process, so that a long-running process (see the 'compile_daemon' package) doesn't
+    # even have to read them from disk again. Only the most recent MEMORY_SIZE ones are kept.
+    MEMORY_SIZE = 16
+    _memory = OrderedDict()
+
+    @classmethod
+    def default_directory(cls):
+        directory = os.environ.get('KASMC_CACHE_DIR')
+        if directory is None:
+            directory = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                                     'kasmc')
+        return directory
+
+    @classmethod
+    def _read(cls, file):
+        # If something that can be read has been passed, use it
+        if hasattr(file, 'read'):
+            return file.read()
+        # Otherwise assume that file is a filename
+        try:
+            with open(file, 'r') as fin:
+                return fin.read()
+        except FileNotFoundError:
+            is_parser.PARSER_ERR_INVALID_FILE.print_exit(-1, '')
+
+    @classmethod
+    def digest(cls, content):
+        """Returns the key of an architecture file's content"""
+        return hashlib.sha256((KASMC_VERSION + '\n' + content).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _path(cls, directory, digest):
+        return os.path.join(directory, cls.PREFIX + digest + cls.SUFFIX)
+
+    @classmethod
+    def _load_entry(cls, path):
+        """Returns the ProcessorArchitecture stored in path, or None if there's no valid entry there"""
+        try:
+            with open(path, 'rb') as fin:
+                pa = pickle.load(fin)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # A corrupted (or otherwise unreadable) entry is as good as a missing one, and will be overwritten
+            return None
+        return pa if isinstance(pa, is_parser.ProcessorArchitecture) else None
+
+    @classmethod
+    def _store_entry(cls, path, pa):
+        """Atomically stores a ProcessorArchitecture in path, so that nobody can ever read a partial entry"""
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + cls.PREFIX)
+            try:
+                with os.fdopen(fd, 'wb') as fout:
+                    pickle.dump(pa, fout, pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        except OSError:
+            # Not being able to cache something is not an error, it only means it'll be parsed again next time
+            pass
+
+    @classmethod
+    def load(cls, file, directory=None):
+        """Returns the ProcessorArchitecture of an Instruction Set file, parsing it only if it's not in the cache.
+        Its warnings are printed either way, just like parsing it would.
+        :param file: The file to parse.
+        :param directory: Where the cache is kept. Defaults to $KASMC_CACHE_DIR, or to kasmc in the user's cache.
+        """
+        content = cls._read(file)
+        digest = cls.digest(content)
+
+        parsed = False
+        pa = cls._memory.get(digest)
+        if pa is None:
+            path = cls._path(directory or cls.default_directory(), digest)
+            pa = cls._load_entry(path)
+            if pa is None:
+                pa = is_parser.InstructionSetParser.parse_file(StringIO(content))
+                cls._store_entry(path, pa)
+                parsed = True
+
+        cls._memory[digest] = pa
+        cls._memory.move_to_end(digest)
+        while len(cls._memory) > cls.MEMORY_SIZE:
+            cls._memory.popitem(last=False)
+
+        if not parsed:
+            is_parser.InstructionSetParser.print_warnings(pa)
+        return pa
+
+    @classmethod
+    def clear(cls, directory=None):
+        """Removes every cached architecture, returning how many were removed"""
+        directory = directory or cls.default_directory()
+        cls._memory.clear()
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return 0
+
+        removed = 0
+        for name in names:
+            if name.startswith(cls.PREFIX) and name.endswith(cls.SUFFIX):
+                try:
+                    os.remove(os.path.join(directory, name))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
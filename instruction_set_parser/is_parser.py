@@ -1,16 +1,42 @@
 import re
+from profiling import profiler
+from instruction_set_parser import lexer
+from file_input import reader
 from collections import namedtuple
 
-Instruction = namedtuple('Instruction', ('opcode', 'size', 'name'))
+# cycles is how many cycles the instruction takes, as (best case, worst case), or None if it isn't known
+Instruction = namedtuple('Instruction', ('opcode', 'size', 'name', 'cycles'))
+Instruction.__new__.__defaults__ = (None,)
 
 
 class ProcessorArchitecture:
     WORD_SIZE = 8
     INSTRUCTION_SET = []
+    # Pre-tokenized signatures ({instruction: {'name': ..., 'args': [...]}}) and the lookup index built from them.
+    # See InstructionSetParser._build_signature_index.
+    SIGNATURES = {}
+    SIGNATURE_INDEX = {}
+    # The instructions of INSTRUCTION_SET by opcode ({opcode: instruction})
+    OPCODES = {}
+    # The mnemonics of the instructions that stop the program, jump somewhere and copy a register into another one, as
+    # declared by TERMINATORS(...), JUMPS(...) and MOVES(...). See the 'optimizer' module.
+    TERMINATORS = ()
+    JUMPS = ()
+    MOVES = ()
+    # The warnings found while parsing, as (line number, context) pairs of PARSER_WARN_AMBIGUOUS_SIGNATURE, so that
+    # they can be shown again when the architecture is loaded from a cache (see InstructionSetParser.print_warnings)
+    WARNINGS = []
 
     def __init__(self):
         self.WORD_SIZE = 8
         self.INSTRUCTION_SET = []
+        self.SIGNATURES = {}
+        self.SIGNATURE_INDEX = {}
+        self.OPCODES = {}
+        self.TERMINATORS = ()
+        self.JUMPS = ()
+        self.MOVES = ()
+        self.WARNINGS = []
 
 
 class ParserError(Exception):
@@ -42,6 +68,8 @@ PARSER_ERR_INVALID_FILE = ParserError(1, 'Could not read the input file.')
 PARSER_ERR_INVALID_SYNTAX = ParserError(2, 'Invalid syntax. (Bad keyword or argument misuse?)')
 PARSER_ERR_DUPLICATE_OPCODE = ParserError(3, 'Duplicate opcode; an instruction with the same opcode is already defined.')
 PARSER_ERR_UNPARSABLE_INSTRUCTION = ParserError(4, 'The instruction\'s opcode is too large to fit in WORD_SIZE bits.')
+PARSER_WARN_AMBIGUOUS_SIGNATURE = ParserError(5, 'Ambiguous signature; an instruction that matches the same lines is '
+                                                 'already defined, so this one will never be used.')
 
 
 class InstructionSetParser:
@@ -56,116 +84,192 @@ class InstructionSetParser:
 
     @classmethod
     def _keyword_INSTRUCTION(cls, pa, args, ln, line):
-        # INSTRUCTION(opcode, size, syntax)
-        assert(len(args) == 3)
+        # INSTRUCTION(opcode, size, syntax[, cycles[, worst case cycles]])
+        assert(len(args) == 5)
 
         opcode = int(args[0])
         size = int(args[1])
         syntax = args[2]
+        cycles = None
+        if args[3] is not None:
+            # Instructions that always take the same number of cycles only need one
+            cycles = (int(args[3]), int(args[4] if args[4] is not None else args[3]))
+            if cycles[1] < cycles[0]:
+                PARSER_ERR_INVALID_SYNTAX.print_exit(ln, line)
 
         # Make sure that the opcode can be encoded in WORD_SIZE bits
         if opcode.bit_length() > pa.WORD_SIZE:
             PARSER_ERR_UNPARSABLE_INSTRUCTION.print_exit(ln, line)
 
         # Check that an instruction with the same opcode wasn't added
-        for instr in pa.INSTRUCTION_SET:
-            if instr.opcode == opcode:
-                PARSER_ERR_DUPLICATE_OPCODE.print_exit(ln, line)
+        if opcode in pa.OPCODES:
+            PARSER_ERR_DUPLICATE_OPCODE.print_exit(ln, line)
 
         # Create an Instruction and add it to the Instruction Set of our PA
-        pa.INSTRUCTION_SET.append(Instruction(opcode, size, syntax))
+        instr = Instruction(opcode, size, syntax, cycles)
+        pa.INSTRUCTION_SET.append(instr)
+        pa.OPCODES[opcode] = instr
+
+    @classmethod
+    def _keyword_FLOW(cls, pa, args, ln, line):
+        # TERMINATORS('HALT', 'RET'), JUMPS('JP') or MOVES('LD')
+        assert(len(args) == 1)
+
+        # (The keyword is also the name of the attribute, and mnemonics are matched regardless of their case)
+        keyword = line.split('(', 1)[0].strip().upper()
+        mnemonics = tuple(name.strip()[1:-1].upper() for name in args[0].split(','))
+        setattr(pa, keyword, getattr(pa, keyword) + mnemonics)
 
     KEYWORD_REGEXPS = [
         # WORD_SIZE(8)
         r'^\s*(WORD_SIZE)\s*\(\s*(\d+)\s*\)\s*$',
-        # INSTRUCTION(0, 1, 'FOO')
-        r'^\s*(INSTRUCTION)\s*\(\s*(\d+)\s*,\s*(\d+)\s*,\s*\'(.+)\'\s*\)\s*$'
+        # INSTRUCTION(0, 1, 'FOO') or INSTRUCTION(0, 1, 'FOO', 4) or INSTRUCTION(0, 1, 'FOO', 4, 6)
+        r'^\s*(INSTRUCTION)\s*\(\s*(\d+)\s*,\s*(\d+)\s*,\s*\'(.+)\'(?:\s*,\s*(\d+)(?:\s*,\s*(\d+))?)?\s*\)\s*$',
+        # JUMPS('JP', 'JR'), and the same for TERMINATORS and MOVES
+        r'^\s*(TERMINATORS|JUMPS|MOVES)\s*\(\s*(\'\w+\'(?:\s*,\s*\'\w+\')*)\s*\)\s*$'
     ]
 
+    # The regexps above, compiled once and looked up by keyword, so that each line is only matched against one of them
+    KEYWORD_PATTERNS = {
+        'WORD_SIZE': re.compile(KEYWORD_REGEXPS[0], re.IGNORECASE),
+        'INSTRUCTION': re.compile(KEYWORD_REGEXPS[1], re.IGNORECASE),
+        'TERMINATORS': re.compile(KEYWORD_REGEXPS[2], re.IGNORECASE),
+        'JUMPS': re.compile(KEYWORD_REGEXPS[2], re.IGNORECASE),
+        'MOVES': re.compile(KEYWORD_REGEXPS[2], re.IGNORECASE)
+    }
+
     KEYWORD_BEHAVIOR = {
         'WORD_SIZE': _keyword_WORD_SIZE,
-        'INSTRUCTION': _keyword_INSTRUCTION
+        'INSTRUCTION': _keyword_INSTRUCTION,
+        'TERMINATORS': _keyword_FLOW,
+        'JUMPS': _keyword_FLOW,
+        'MOVES': _keyword_FLOW
     }
 
     @classmethod
     def _replace_numerals(cls, line):
         """Replaces any hexadecimal or binary numeral to decimal"""
+        return lexer.Lexer.replace_numerals(line)
 
-        # Find and convert any numeral to decimal
-        hex_numerals = [m.span() for m in re.finditer(r'(0[xX][0-9a-fA-F]+)', line)]
-        bin_numerals = [m.span() for m in re.finditer(r'(0[bB][0-1]+)', line)]
+    @classmethod
+    def _tokenize_signature(cls, syntax):
+        """Splits an instruction's syntax ('LD A,_$literal') into its name and arguments, or returns None"""
+        try:
+            tokens = lexer.Lexer.tokenize_signature(syntax)
+        except lexer.LexerError:
+            return None
+        return {'name': tokens[0].text, 'args': [token.text for token in tokens[1:]]}
+
+    @classmethod
+    def operand_kind(cls, arg):
+        """Returns what an argument is matched against once it's left out of a pattern: lexer.MEMORY for memory
+        operands ('(B)', '(5)', '($literal)'), None for any other argument"""
+        # (The lexer only puts parentheses around the text of MEMORY tokens)
+        return lexer.MEMORY if arg[:1] == '(' else None
 
-        i = 0
-        offset = 0
-        for span in (hex_numerals + bin_numerals):
-            # Remove the matched numeral and replace it with its decimal representation
-            # (Also, since 'line' is modified in-place, add the offset produced by the conversions to the span)
-            span = (span[0] + offset, span[1] + offset)
+    @classmethod
+    def _signature_patterns(cls, args):
+        """Yields every (mask, pattern) pair for the given arguments, where the pattern only keeps the arguments
+        selected by the mask's bits and replaces the others with their kind (see operand_kind)"""
+        kinds = [cls.operand_kind(arg) for arg in args]
+        for mask in range(1 << len(args)):
+            yield mask, tuple(arg if mask & (1 << i) else kinds[i] for i, arg in enumerate(args))
 
-            numeral = line[span[0]:span[1]]
-            numeral = int(numeral, 16 if i < len(hex_numerals) else 2)
+    @classmethod
+    def _build_signature_index(cls, pa):
+        """Tokenizes every instruction of the ProcessorArchitecture once and indexes it for the compiler.
 
-            # Offset = old_len - new_len, so Offset = -new_len + old_len
-            offset = len(line)
-            line = line[:span[0]] + str(numeral) + line[span[1]:]
-            offset = -offset + len(line)
+        A source line matches the signature that shares the most arguments with it (the first one defined wins ties).
+        Each signature is stored under (name, argument count, pattern) for every subset of its arguments, keeping only
+        the earliest instruction per key, so the best match is found by probing at most 2^args keys per line.
 
-            i += 1
-        return line
+        Arguments left out of a pattern still keep their kind, so that memory operands ('(5)') only ever match memory
+        arguments ('($literal)', '(B)') and other operands only match other arguments.
+
+        Returns the ambiguous signatures as (position, position of the instruction it's shadowed by) pairs: since
+        placeholders ($literal, $address, ($literal)) match any argument of their kind, two signatures that only
+        differ by their placeholders match the same lines, and the one defined last is never used.
+        """
+        pa.SIGNATURES = {}
+        pa.SIGNATURE_INDEX = {}
+        pa.OPCODES = {instr.opcode: instr for instr in pa.INSTRUCTION_SET}
+
+        ambiguous = []
+        shapes = {}
+        for position, instr in enumerate(pa.INSTRUCTION_SET):
+            tokens = cls._tokenize_signature(instr.name)
+            pa.SIGNATURES[instr] = tokens
+            # Signatures that can't be tokenized can't be matched either
+            if tokens is None:
+                continue
+
+            args = tokens['args']
+            shape = (tokens['name'], len(args), tuple(cls.operand_kind(arg) if '$' in arg else arg for arg in args))
+            shadowed_by = shapes.setdefault(shape, position)
+            if shadowed_by != position:
+                ambiguous.append((position, shadowed_by))
+
+            for mask, pattern in cls._signature_patterns(args):
+                pa.SIGNATURE_INDEX.setdefault((tokens['name'], len(pattern), pattern), (position, instr))
+        return ambiguous
 
     @classmethod
     def _parse_line(cls, ln, line, pa):
         """Parses a single line and modifies the ProcessorArchitecture or raises an InvalidSyntax error"""
-        keyword_found = False
-        for regexp in cls.KEYWORD_REGEXPS:
-            match = re.match(regexp, line, re.IGNORECASE)
-            if match is None:
-                continue
-            # If at least one keyword (with correct usage) was matched, set the keyword_found flag
-            keyword_found = True
-            # We can then use it to index the KEYWORD_BEHAVIOR dictionary and call the required code
-            keyword = match.group(1).upper()
-            cls.KEYWORD_BEHAVIOR[keyword].__func__(cls, pa, match.groups()[1:], ln, line)
-            # And finally we can safely break out of the loop since only one keyword is allowed per line
-            break
-
-        # If this flag is not set, no keyword was matched and this line is thus invalid
-        if not keyword_found:
+        # Only one keyword is allowed per line, and it's whatever comes before the first parenthesis
+        keyword = line.split('(', 1)[0].strip().upper()
+        pattern = cls.KEYWORD_PATTERNS.get(keyword)
+        match = pattern.match(line) if pattern is not None else None
+        if profiler.Profiler.enabled and pattern is not None:
+            profiler.Profiler.count('regex_evaluations')
+
+        # If no keyword (with correct usage) was matched, this line is invalid
+        if match is None:
             PARSER_ERR_INVALID_SYNTAX.print_exit(ln, line)
 
+        # Otherwise we can use it to index the KEYWORD_BEHAVIOR dictionary and call the required code
+        cls.KEYWORD_BEHAVIOR[keyword].__func__(cls, pa, match.groups()[1:], ln, line)
+
     @classmethod
     def parse_file(cls, file):
         """Parses an Instruction Set file and returns a ProcessorArchitecture instance
         :param file: The file to parse.
         """
 
-        lines = []
-
-        # If something that can be read has been passed, use it
-        if hasattr(file, 'read'):
-                lines = file.read().split('\n')
-        # Otherwise assume that file is a filename
-        else:
-            try:
-                with open(file, 'r') as fin:
-                    lines = fin.read().split('\n')
-            except FileNotFoundError:
-                PARSER_ERR_INVALID_FILE.print_exit(-1, '')
-
-        # Remove empty lines
-        lines = [line for line in lines if len(line.strip()) > 0]
+        # Read the non-empty lines, one at a time
+        try:
+            lines = reader.LineReader.lines(file)
+        except FileNotFoundError:
+            PARSER_ERR_INVALID_FILE.print_exit(-1, '')
 
         # Create a ProcessorArchitecture structure, which is what this parser ultimately outputs
         pa = ProcessorArchitecture()
 
         # Begin the parsing process
         ln = 0  # Line number
+        # The line that defines each instruction, to point at them in warnings
+        instruction_lines = []
         for cur_line in lines:
             # Convert any non-decimal literal (0xFF -> 255, 0b10 -> 2)
             cur_line = cls._replace_numerals(cur_line)
             # Parse the current line
+            count = len(pa.INSTRUCTION_SET)
             cls._parse_line(ln, cur_line, pa)
+            if len(pa.INSTRUCTION_SET) > count:
+                instruction_lines.append((ln, cur_line))
             ln += 1
 
+        # Tokenize every signature once, so that the compiler doesn't have to do it for every line of source code
+        for position, shadowed_by in cls._build_signature_index(pa):
+            ln, line = instruction_lines[position]
+            pa.WARNINGS.append((ln, '{}  (see line {})'.format(line, instruction_lines[shadowed_by][0])))
+        cls.print_warnings(pa)
+
         # If everything went fine, return the ProcessorArchitecture object
         return pa
+
+    @classmethod
+    def print_warnings(cls, pa):
+        """Prints the warnings found while parsing a ProcessorArchitecture"""
+        for ln, context in pa.WARNINGS:
+            PARSER_WARN_AMBIGUOUS_SIGNATURE.print_warn(ln, context)
@@ -0,0 +1,166 @@
+from collections import namedtuple
+
+# A token of a line of code or of a signature.
+# text is what the token looks like once normalized (numerals in decimal, no whitespace in memory operands), value is
+# the number encoded by literals (and by memory operands that hold one) and column is where the token starts.
+Token = namedtuple('Token', ('kind', 'text', 'value', 'column'))
+
+MNEMONIC = 'mnemonic'
+REGISTER = 'register'
+LITERAL = 'literal'
+# A register or literal in parentheses: (B), (5), ($literal)
+MEMORY = 'memory'
+# A label used as an address: .end
+ADDRESS = 'address'
+# $literal or $address, only in signatures
+PLACEHOLDER = 'placeholder'
+
+PLACEHOLDERS = ('$literal', '$address')
+HEX_DIGITS = '0123456789abcdefABCDEF'
+BIN_DIGITS = '01'
+
+
+class LexerError(Exception):
+    """Specifies where a line couldn't be split in tokens, and whether it's because something was missing there"""
+
+    def __init__(self, column, missing=False):
+        self.column = column
+        self.missing = missing
+
+    def __str__(self):
+        return '{} on column {}'.format('Missing token' if self.missing else 'Invalid token', self.column)
+
+
+class Lexer:
+    """Splits lines of code and instruction signatures in typed tokens, in a single pass and without regexes.
+
+    The scanner leans on str methods (split, strip, isdecimal...), which run in C, rather than looking at one character
+    at a time, and only walks the characters of a token to find the column of an error.
+    """
+
+    @classmethod
+    def _is_word(cls, text):
+        # Same as \w+
+        return len(text) > 0 and (text.isalnum() or text.replace('_', 'a').isalnum())
+
+    @classmethod
+    def _first_invalid(cls, text, column):
+        """Returns the column of the first character of text that can't be part of a word"""
+        for i, char in enumerate(text):
+            if not (char.isalnum() or char == '_'):
+                return column + i
+        return column + len(text)
+
+    @classmethod
+    def parse_numeral(cls, text):
+        """Returns the value of a decimal (12), hexadecimal (0xC) or binary (0b1100) numeral, or None"""
+        if len(text) > 2 and text[0] == '0' and text[1] in 'xXbB':
+            digits = text[2:]
+            hexadecimal = text[1] in 'xX'
+            if len(digits.strip(HEX_DIGITS if hexadecimal else BIN_DIGITS)) > 0:
+                return None
+            return int(digits, 16 if hexadecimal else 2)
+        return int(text) if text.isdecimal() else None
+
+    @classmethod
+    def _argument(cls, text, column, signature=False):
+        """Returns the token of a single (already stripped) argument that starts on column"""
+        if len(text) == 0:
+            raise LexerError(column, missing=True)
+
+        first = text[0]
+        if first == '(':
+            if text[-1] != ')':
+                raise LexerError(column + len(text), missing=True)
+            inner = text[1:-1]
+            stripped = inner.lstrip()
+            token = cls._argument(stripped.rstrip(), column + 1 + len(inner) - len(stripped), signature)
+            if token.kind == MEMORY or token.kind == ADDRESS:
+                raise LexerError(token.column)
+            return Token(MEMORY, '(' + token.text + ')', token.value, column)
+
+        if signature:
+            if text in PLACEHOLDERS:
+                return Token(PLACEHOLDER, text, None, column)
+            # Registers only, since a literal would always be encoded as an argument
+            if not text.isalpha():
+                raise LexerError(column + next(i for i, char in enumerate(text) if not char.isalpha()))
+            return Token(REGISTER, text, None, column)
+
+        if first == '.':
+            if not cls._is_word(text[1:]):
+                raise LexerError(cls._first_invalid(text[1:], column + 1), missing=len(text) == 1)
+            return Token(ADDRESS, text, None, column)
+        if first.isdecimal():
+            value = cls.parse_numeral(text)
+            if value is None:
+                raise LexerError(column)
+            return Token(LITERAL, str(value), value, column)
+        if not cls._is_word(text):
+            raise LexerError(cls._first_invalid(text, column))
+        return Token(REGISTER, text, None, column)
+
+    @classmethod
+    def _tokenize(cls, line, signature):
+        stripped = line.lstrip()
+        column = len(line) - len(stripped)
+        parts = stripped.split(None, 1)
+        if len(parts) == 0:
+            raise LexerError(column, missing=True)
+
+        name = parts[0]
+        if not cls._is_word(name):
+            raise LexerError(cls._first_invalid(name, column))
+        tokens = [Token(MNEMONIC, name, None, column)]
+        if len(parts) == 1:
+            return tokens
+
+        # Whatever follows the mnemonic (and the whitespace after it) is a list of arguments
+        rest = parts[1]
+        column = len(line) - len(rest)
+        for part in rest.split(','):
+            if signature:
+                # An underscore may stand in for the optional space after a comma
+                part = part.replace('_', ' ')
+            stripped = part.lstrip()
+            tokens.append(cls._argument(stripped.rstrip(), column + len(part) - len(stripped), signature))
+            column += len(part) + 1
+        return tokens
+
+    @classmethod
+    def tokenize_line(cls, line):
+        """Splits a line of code ('LD A, 0x20') in tokens: a MNEMONIC followed by any number of REGISTER, LITERAL,
+        MEMORY or ADDRESS arguments, separated by commas. Raises a LexerError if the line can't be split."""
+        return cls._tokenize(line, False)
+
+    @classmethod
+    def tokenize_signature(cls, syntax):
+        """Splits an instruction's syntax ('LD A,_$literal') in tokens: a MNEMONIC followed by any number of REGISTER,
+        PLACEHOLDER or MEMORY arguments. Raises a LexerError if the syntax can't be split."""
+        return cls._tokenize(syntax, True)
+
+    @classmethod
+    def replace_numerals(cls, line):
+        """Replaces any hexadecimal or binary numeral in a line with its decimal representation, wherever it is"""
+        i = line.find('0')
+        if i < 0:
+            return line
+
+        out = []
+        start = 0
+        while i >= 0:
+            if i + 2 < len(line) and line[i + 1] in 'xXbB':
+                digits = HEX_DIGITS if line[i + 1] in 'xX' else BIN_DIGITS
+                end = i + 2
+                while end < len(line) and line[end] in digits:
+                    end += 1
+                if end > i + 2:
+                    out.append(line[start:i])
+                    out.append(str(int(line[i + 2:end], 16 if digits is HEX_DIGITS else 2)))
+                    start = end
+                    i = line.find('0', end)
+                    continue
+            i = line.find('0', i + 1)
+
+        out.append(line[start:])
+        return ''.join(out)
@@ -1,38 +1,255 @@
 from asm_compiler import compiler
+from asm_compiler import incremental
+from asm_compiler import batch
+from asm_compiler import costs
+from asm_compiler import relocatable
 from input_preprocessor import preprocessor
 from instruction_set_parser import is_parser
+from instruction_set_parser import arch_cache
+from compile_daemon import daemon
+from profiling import profiler
 import argparse
+import contextlib
+import os
 import time
+import sys
 
-if __name__ == '__main__':
+
+def main(argv=None, use_daemon=True):
+    """Runs the compiler as if argv had been passed on the command line, and returns the exit status.
+    :param argv: The command line arguments. Defaults to the ones this process was started with.
+    :param use_daemon: If false, never forward the compilation to a running compile daemon.
+    """
     arg_parser = argparse.ArgumentParser(
         description='Compile arbitrary assembly files with arbitrary instruction sets and arbitrary processor specs.')
 
-    arg_parser.add_argument('-i', '--input', help='The source file to compile.')
+    arg_parser.add_argument('-i', '--input', nargs='+',
+                            help='The source file to compile. If more than one is passed, each one is compiled to '
+                                 'a file with the same name (without extension), in the output directory if given.')
     arg_parser.add_argument('-a', '--processor_architecture', help='The processor architecture file to compile against')
     arg_parser.add_argument('-o', '--output', help='The name of the compiled file(s)')
     arg_parser.add_argument('-b', '--output_binary', action='store_true', help='If specified, output a binary file.')
     arg_parser.add_argument('-O', '--output_object', action='store_true', help='If specified, output an object file.')
+    arg_parser.add_argument('--output_hex', action='store_true', help='If specified, output an Intel HEX file.')
+    arg_parser.add_argument('--output_srec', action='store_true',
+                            help='If specified, output a Motorola S-record file.')
+    arg_parser.add_argument('--byteorder', choices=('big', 'little'), default='big',
+                            help='The byte order of the words in the binary file (for word sizes multiple of 8).')
+    arg_parser.add_argument('--bitorder', choices=('msb', 'lsb'), default='msb',
+                            help='Whether the first bit of each byte in the binary file is its most or least '
+                                 'significant one.')
+    arg_parser.add_argument('--no-arch-cache', action='store_true',
+                            help='If specified, always parse the processor architecture file instead of loading it '
+                                 'from the cache.')
+    arg_parser.add_argument('--clear-arch-cache', action='store_true',
+                            help='If specified, remove every cached processor architecture before compiling.')
+    arg_parser.add_argument('--incremental', action='store_true',
+                            help='If specified, remember how each line was compiled (in <output>.kcache) '
+                                 'and only compile the lines that changed since the last time.')
+    arg_parser.add_argument('-c', '--relocatable', action='store_true',
+                            help='If specified, compile each source file to a relocatable object (<output>.krel) '
+                                 'instead of an image, to be linked with others by kasml.py. Labels declared GLOBAL '
+                                 'are exported, and labels declared EXTERN are imported from the other objects. '
+                                 'Ignores the output formats, --optimize and --cost-report, and can\'t be used '
+                                 'with -s.')
+    arg_parser.add_argument('--optimize', action='store_true',
+                            help='If specified, remove unreachable code, jumps to jumps or to the next line and moves '
+                                 'that undo the previous one. Ignored with -s.')
+    arg_parser.add_argument('--cost-report', metavar='FILE',
+                            help='Write how many words and cycles (best and worst case) the program and each block '
+                                 'of it (from a label to the next one) take, as JSON to FILE (or to the standard '
+                                 'output, if FILE is -). Ignored with -s or with more than one source file.')
+    arg_parser.add_argument('--depfile', metavar='FILE',
+                            help='Write a Makefile rule to FILE saying that the output files depend on the source '
+                                 'file, the processor architecture file and every file included by the source file. '
+                                 'Ignored with more than one source file.')
+    arg_parser.add_argument('-m', '--manifest',
+                            help='A file listing the source files to compile, one per line, each optionally followed '
+                                 'by the name of its compiled file(s).')
+    arg_parser.add_argument('-w', '--workers', type=int,
+                            help='How many processes compile multiple source files. Defaults to the number of CPUs.')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='How many processes compile the lines of a single source file.')
+    arg_parser.add_argument('-s', '--stream', action='store_true',
+                            help='If specified, preprocess and compile the source file one line at a time '
+                                 'instead of loading it in memory.')
+    arg_parser.add_argument('--serve', nargs='?', const='', metavar='SOCKET',
+                            help='Run as a compile daemon, serving the same options as this command line from a Unix '
+                                 'socket (or from the standard input, if SOCKET is -).')
+    arg_parser.add_argument('--stop-daemon', action='store_true', help='Stop the running compile daemon.')
+    arg_parser.add_argument('--no-daemon', action='store_true',
+                            help='If specified, compile in this process even if a compile daemon is running.')
+    arg_parser.add_argument('--profile', metavar='FILE',
+                            help='Write how long each stage and each function took, along with counters such as lines '
+                                 'per second, as JSON to FILE (or to the standard output, if FILE is -).')
+    arg_parser.add_argument('--profile-stats', metavar='FILE',
+                            help='Run cProfile while compiling and write its statistics to FILE, to be read with '
+                                 'pstats.')
+
+    args = arg_parser.parse_args(argv)
+
+    if args.serve is not None:
+        daemon.CompileDaemon.serve(args.serve or daemon.CompileDaemon.default_socket(), main)
+        return 0
+
+    if args.stop_daemon:
+        stopped = daemon.DaemonClient.request(daemon.CompileDaemon.default_socket(), {'shutdown': True})
+        print('Stopped the compile daemon.' if stopped is not None else 'No compile daemon is running.')
+        return 0
 
-    args = arg_parser.parse_args()
+    # Let the daemon do the work if there's one running
+    if use_daemon and not args.no_daemon:
+        status = daemon.DaemonClient.compile(daemon.CompileDaemon.default_socket(),
+                                             list(sys.argv[1:] if argv is None else argv))
+        if status is not None:
+            return status
 
-    if args.processor_architecture is None or args.input is None:
+    if args.clear_arch_cache:
+        removed = arch_cache.ArchitectureCache.clear()
+        print('Removed {} cached processor architecture(s).'.format(removed))
+        if args.processor_architecture is None and args.input is None and args.manifest is None:
+            return 0
+
+    if args.processor_architecture is None or (args.input is None and args.manifest is None):
         print('A source file and a processor architecture file must be passed.')
-        exit(1)
+        return 1
+
+    if args.relocatable and args.stream:
+        print('Relocatable objects can\'t be compiled with -s.')
+        return 1
+
+    # A report written to the standard output (- instead of a file) must be the only thing written there, so that it
+    # can be parsed: everything else is written to the standard error instead
+    if '-' in (args.profile, args.cost_report):
+        report_stream = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            return compile_and_report(args, report_stream)
+    return compile_and_report(args)
+
+
+def compile_and_report(args, report_stream=None):
+    """Compiles the source file(s), profiling the compilation if told to, and returns the exit status.
+    :param report_stream: Where reports written to - go. Defaults to the standard output.
+    """
+    if args.profile is None and args.profile_stats is None:
+        return compile_sources(args, report_stream)
 
+    # (Timing every function would only get in cProfile's way)
+    profiler.Profiler.start(functions=args.profile is not None, stats=args.profile_stats is not None)
+    try:
+        status = compile_sources(args, report_stream)
+    finally:
+        profiler.Profiler.stop()
+    if args.profile is not None:
+        profiler.Profiler.write_report(args.profile, report_stream, kasmc_version=arch_cache.KASMC_VERSION,
+                                       architecture=args.processor_architecture, input=args.input,
+                                       output=args.output, jobs=args.jobs)
+    if args.profile_stats is not None:
+        profiler.Profiler.dump_stats(args.profile_stats)
+    return status
+
+
+def compile_sources(args, report_stream=None):
+    """Compiles the source file(s) as told by the parsed command line arguments, and returns the exit status.
+    :param report_stream: Where reports written to - go. Defaults to the standard output.
+    """
     # Parse the ProcessorArchitecture object
-    parse_start = time.time()
-    processor_architecture = is_parser.InstructionSetParser.parse_file(args.processor_architecture)
-    parse_end = time.time()
+    parse_start = time.perf_counter()
+    if args.no_arch_cache:
+        processor_architecture = is_parser.InstructionSetParser.parse_file(args.processor_architecture)
+    else:
+        processor_architecture = arch_cache.ArchitectureCache.load(args.processor_architecture)
+    parse_end = time.perf_counter()
+    profiler.Profiler.add_stage('parse_architecture', parse_end - parse_start)
     print('Done parsing the processor architecture file. ({0:.3f}s)'.format(parse_end - parse_start))
-    # Preprocess the source file
-    preprocess_start = time.time()
-    source = preprocessor.InputPreprocessor.parse_file(args.input)
-    preprocess_end = time.time()
-    print('Done preprocessing the source file. ({0:.3f}s)'.format(preprocess_end - preprocess_start))
-    # Compile it!
-    compile_start = time.time()
-    compiler.Compiler.parse_file(source, args.output, processor_architecture, args.output_binary, args.output_object)
-    compile_end = time.time()
-    print('Done compiling. ({0:.3f}s)'.format(compile_end - compile_start))
+
+    if args.manifest is not None or len(args.input) > 1:
+        # Compile many source files at once
+        jobs = batch.BatchCompiler.read_manifest(args.manifest) if args.manifest is not None else []
+        jobs += [(source, batch.BatchCompiler.default_output(source, args.output)) for source in args.input or []]
+        options = {'output_binary': args.output_binary, 'output_object': args.output_object,
+                   'byteorder': args.byteorder, 'bitorder': args.bitorder,
+                   'stream': args.stream, 'incremental': args.incremental, 'optimize': args.optimize,
+                   'output_hex': args.output_hex, 'output_srec': args.output_srec,
+                   'relocatable': args.relocatable}
+        results = batch.BatchCompiler.compile_batch(jobs, processor_architecture, options, args.workers)
+        profiler.Profiler.add_stage('compile', time.perf_counter() - parse_end)
+        failed = batch.BatchCompiler.print_summary(results, time.perf_counter() - parse_end)
+        print('\nALL DONE. Program execution took {0:.3f} seconds.'.format(time.perf_counter() - parse_start))
+        return 1 if failed > 0 else 0
+
+    args.input = args.input[0]
+    # Every file included by the source file (see the --depfile option)
+    included = set()
+    if args.stream:
+        # Preprocess and compile the source file at the same time
+        compile_start = time.perf_counter()
+        source = preprocessor.InputPreprocessor.iter_file(args.input, included)
+        compiler.Compiler.parse_stream(source, args.output, processor_architecture,
+                                       args.output_binary, args.output_object, args.byteorder, args.bitorder,
+                                       args.output_hex, args.output_srec,
+                                       lambda: preprocessor.InputPreprocessor.iter_file(args.input))
+        compile_end = time.perf_counter()
+        profiler.Profiler.add_stage('compile', compile_end - compile_start)
+        print('Done preprocessing and compiling. ({0:.3f}s)'.format(compile_end - compile_start))
+    else:
+        # Preprocess the source file
+        preprocess_start = time.perf_counter()
+        cost_report = costs.CostReport() if args.cost_report is not None and not args.relocatable else None
+        labels = cost_report.labels if cost_report is not None else {}
+        symbols = {}
+        # Lines are cached as they were written, so labels are left for the compiler to resolve (see parse_file). So
+        # are they when optimizing, so that the labels passed as literals are renumbered along with the lines.
+        incremental_build = args.incremental and bool(args.output)
+        compiler_labels = incremental_build or args.optimize
+        source = preprocessor.InputPreprocessor.parse_file(args.input, included, labels, symbols,
+                                                           replace_labels=not compiler_labels)
+        preprocess_end = time.perf_counter()
+        profiler.Profiler.add_stage('preprocess', preprocess_end - preprocess_start)
+        print('Done preprocessing the source file. ({0:.3f}s)'.format(preprocess_end - preprocess_start))
+        # Compile it!
+        compile_start = time.perf_counter()
+        cache = None
+        if incremental_build:
+            cache = incremental.EncodingCache.load(incremental.EncodingCache.path(args.output), processor_architecture)
+        if args.relocatable:
+            compiler.Compiler.parse_relocatable(source, args.output, processor_architecture, labels, symbols, cache,
+                                                args.jobs)
+        else:
+            compiler.Compiler.parse_file(source, args.output, processor_architecture,
+                                         args.output_binary, args.output_object, args.byteorder, args.bitorder, cache,
+                                         args.jobs, args.optimize, cost_report, args.output_hex, args.output_srec,
+                                         labels if compiler_labels else None)
+        if cache is not None:
+            cache.save(incremental.EncodingCache.path(args.output))
+            print('Reused {} compiled line(s), compiled {}.'.format(cache.hits, cache.misses))
+        if cost_report is not None and cost_report.program is not None:
+            cost_report.write_report(args.cost_report, report_stream, architecture=args.processor_architecture,
+                                     input=args.input)
+        compile_end = time.perf_counter()
+        profiler.Profiler.add_stage('compile', compile_end - compile_start)
+        print('Done compiling. ({0:.3f}s)'.format(compile_end - compile_start))
+    if args.depfile is not None and args.output:
+        write_depfile(args, included)
     print('\nALL DONE. Program execution took {0:.3f} seconds.'.format(compile_end - parse_start))
+    return 0
+
+
+def write_depfile(args, included):
+    """Writes the depfile of a compiled source file (see the --depfile option)"""
+    targets = [args.output + extension for extension, flag in (('.kasm', args.output_binary),
+                                                               ('.kobj', args.output_object),
+                                                               ('.hex', args.output_hex),
+                                                               ('.srec', args.output_srec)) if flag]
+    if args.relocatable:
+        targets = [relocatable.RelocatableObject.path(args.output)]
+    if len(targets) == 0:
+        return
+    # (The source file itself is among the included ones)
+    included = sorted(included - {os.path.realpath(args.input)})
+    compiler.Compiler.write_depfile(args.depfile, targets, [args.input, args.processor_architecture] + included,
+                                    phony=included)
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,57 @@
+from asm_compiler import disassembler
+from instruction_set_parser import is_parser
+from instruction_set_parser import arch_cache
+import argparse
+import time
+import sys
+
+
+def main(argv=None):
+    """Runs the disassembler as if argv had been passed on the command line, and returns the exit status"""
+    arg_parser = argparse.ArgumentParser(
+        description='Turn images compiled by kasmc.py (.kasm or .kobj files) back into source.')
+
+    arg_parser.add_argument('-i', '--input', required=True, help='The image to disassemble (.kobj files are read as '
+                                                                 'object files, anything else as a binary file).')
+    arg_parser.add_argument('-a', '--processor_architecture', required=True,
+                            help='The processor architecture file the image was compiled against')
+    arg_parser.add_argument('-o', '--output', help='Where to write the source. Defaults to the standard output.')
+    arg_parser.add_argument('--byteorder', choices=('big', 'little'), default='big',
+                            help='The byte order of the words in the binary file (for word sizes multiple of 8).')
+    arg_parser.add_argument('--bitorder', choices=('msb', 'lsb'), default='msb',
+                            help='Whether the first bit of each byte in the binary file is its most or least '
+                                 'significant one.')
+    arg_parser.add_argument('--verify', action='store_true',
+                            help='Instead of writing the source, check that compiling it gives the same image back. '
+                                 'Exits with 1 if it doesn\'t.')
+    arg_parser.add_argument('--no-arch-cache', action='store_true',
+                            help='If specified, always parse the processor architecture file instead of loading it '
+                                 'from the cache.')
+
+    args = arg_parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.no_arch_cache:
+        pa = is_parser.InstructionSetParser.parse_file(args.processor_architecture)
+    else:
+        pa = arch_cache.ArchitectureCache.load(args.processor_architecture)
+    words = disassembler.Disassembler.read_image(args.input, pa.WORD_SIZE, args.byteorder, args.bitorder)
+
+    if args.verify:
+        position = disassembler.Disassembler.verify(words, pa)
+        if position is not None:
+            print('{}: the image differs from its source from word {} on.'.format(args.input, position))
+            return 1
+        print('{}: {} words verified. ({:.3f}s)'.format(args.input, len(words), time.perf_counter() - start))
+        return 0
+
+    if args.output is None:
+        disassembler.Disassembler.disassemble(words, pa, sys.stdout)
+    else:
+        with open(args.output, 'w') as fout:
+            disassembler.Disassembler.disassemble(words, pa, fout)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,48 @@
+from asm_compiler import compiler
+from instruction_set_parser import is_parser
+from linker import linker
+import argparse
+import time
+
+
+def main(argv=None):
+    """Runs the linker as if argv had been passed on the command line, and returns the exit status"""
+    arg_parser = argparse.ArgumentParser(
+        description='Link relocatable objects compiled by kasmc.py -c (.krel files) into a single image.')
+
+    arg_parser.add_argument('-i', '--input', nargs='+', required=True,
+                            help='The objects to link, in the order they\'re laid out (the first one holds the entry '
+                                 'point).')
+    arg_parser.add_argument('-o', '--output', required=True, help='The name of the linked file(s)')
+    arg_parser.add_argument('-b', '--output_binary', action='store_true', help='If specified, output a binary file.')
+    arg_parser.add_argument('-O', '--output_object', action='store_true', help='If specified, output an object file.')
+    arg_parser.add_argument('--output_hex', action='store_true', help='If specified, output an Intel HEX file.')
+    arg_parser.add_argument('--output_srec', action='store_true',
+                            help='If specified, output a Motorola S-record file.')
+    arg_parser.add_argument('--byteorder', choices=('big', 'little'), default='big',
+                            help='The byte order of the words in the binary file (for word sizes multiple of 8).')
+    arg_parser.add_argument('--bitorder', choices=('msb', 'lsb'), default='msb',
+                            help='Whether the first bit of each byte in the binary file is its most or least '
+                                 'significant one.')
+
+    args = arg_parser.parse_args(argv)
+
+    if not (args.output_binary or args.output_object or args.output_hex or args.output_srec):
+        compiler.COMPILER_WARN_NO_OUTPUT.print_warn(-1, '')
+        return 0
+
+    start = time.perf_counter()
+    objects = [linker.Linker.read_object(path) for path in args.input]
+    words = linker.Linker.link(objects, args.input)
+
+    # Only the word size of the architecture is needed to write the image
+    pa = is_parser.ProcessorArchitecture()
+    pa.WORD_SIZE = objects[0].word_size
+    compiler.Compiler._write_output(words, args.output, pa, args.output_binary, args.output_object, args.byteorder,
+                                    args.bitorder, args.output_hex, args.output_srec)
+    print('Linked {} object(s), {} words. ({:.3f}s)'.format(len(objects), len(words), time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
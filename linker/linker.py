@@ -0,0 +1,100 @@
+from asm_compiler import compiler
+from asm_compiler import relocatable
+
+
+class LinkerError(Exception):
+    """Specifies an error that occurred while linking relocatable objects"""
+
+    error_id = 0
+    error_msg = 'An error occurred during the linking process.'
+
+    def __init__(self, error_id, error_msg):
+        self.error_id = error_id
+        self.error_msg = error_msg
+
+    def __str__(self):
+        return self.error_msg
+
+    def print_err(self, ctx):
+        print('LINKER ERROR {}: {}\n\t--> {}'.format(self.error_id, self.error_msg, ctx))
+
+    def print_exit(self, ctx):
+        self.print_err(ctx)
+        exit(self.error_id)
+
+LINKER_ERR_INVALID_FILE = LinkerError(1, 'Could not read the object file.')
+LINKER_ERR_INVALID_OBJECT = LinkerError(2, 'Not a relocatable object, or one written by another version of kasmc.')
+LINKER_ERR_ARCHITECTURE_MISMATCH = LinkerError(3, 'The object was compiled against another processor architecture.')
+LINKER_ERR_DUPLICATE_SYMBOL = LinkerError(4, 'Duplicate symbol; a label with the same name is already exported.')
+LINKER_ERR_UNDEFINED_SYMBOL = LinkerError(5, 'Undefined symbol; no object exports this label.')
+LINKER_ERR_ADDRESS_OVERFLOW = LinkerError(6, 'The address of a label is too large to fit in WORD_SIZE bits.')
+
+
+class Linker:
+    """Links relocatable objects (see the 'relocatable' module) into a single image, which is the same one that
+    compiling their sources as a single file would give. Objects are laid out one after the other, in the order they're
+    given (so the first one holds the entry point), then the addresses of each one are moved to where it starts and the
+    labels it imports are patched with the address they're exported at. Nothing is compiled again."""
+
+    @classmethod
+    def read_object(cls, path):
+        """Reads a relocatable object file"""
+        try:
+            return relocatable.RelocatableObject.load(path)
+        except OSError:
+            LINKER_ERR_INVALID_FILE.print_exit(path)
+        except ValueError:
+            LINKER_ERR_INVALID_OBJECT.print_exit(path)
+
+    @classmethod
+    def symbol_table(cls, objects, names):
+        """Returns the address of every exported label in the linked image ({label: address}), and where each object
+        starts in it"""
+        symbols = {}
+        # Who exports each label, to point at it when it's exported twice
+        exported_by = {}
+        bases = []
+        base = 0
+        for obj, name in zip(objects, names):
+            if obj.digest != objects[0].digest:
+                LINKER_ERR_ARCHITECTURE_MISMATCH.print_exit('{}  (see {})'.format(name, names[0]))
+            for label, address in obj.exports.items():
+                if label in symbols:
+                    LINKER_ERR_DUPLICATE_SYMBOL.print_exit('{} in {}  (see {})'.format(label, name, exported_by[label]))
+                symbols[label] = base + address
+                exported_by[label] = name
+            bases.append(base)
+            base += len(obj.words)
+        return symbols, bases
+
+    @classmethod
+    def link(cls, objects, names=None):
+        """Returns the words of the image made by linking the objects together.
+        :param objects: The RelocatableObjects to link, in the order they're laid out.
+        :param names: What to call each object in errors (i.e. its file name). Defaults to its position.
+        """
+        names = list(names) if names is not None else ['object {}'.format(i) for i in range(len(objects))]
+        if len(objects) == 0:
+            return compiler.Compiler._new_object(8)
+
+        word_size = objects[0].word_size
+        symbols, bases = cls.symbol_table(objects, names)
+
+        words = compiler.Compiler._new_object(word_size)
+        for obj, name, base in zip(objects, names, bases):
+            start = len(words)
+            words.extend(obj.words)
+            if base > 0:
+                for position in obj.relocations:
+                    address = words[start + position] + base
+                    if address.bit_length() > word_size:
+                        LINKER_ERR_ADDRESS_OVERFLOW.print_exit('{}, word {}'.format(name, position))
+                    words[start + position] = address
+            for position, label in obj.externals:
+                address = symbols.get(label)
+                if address is None:
+                    LINKER_ERR_UNDEFINED_SYMBOL.print_exit('{} in {}'.format(label, name))
+                if address.bit_length() > word_size:
+                    LINKER_ERR_ADDRESS_OVERFLOW.print_exit('{} in {}'.format(label, name))
+                words[start + position] = address
+        return words
@@ -0,0 +1,142 @@
+import sys
+import json
+import time
+import cProfile
+import importlib
+from collections import OrderedDict
+
+# The functions timed by the Profiler, by module and class. They're only wrapped while profiling, so that they don't
+# cost anything otherwise.
+FUNCTIONS = [
+    ('instruction_set_parser.is_parser', 'InstructionSetParser',
+     ['parse_file', '_parse_line', '_replace_numerals', '_build_signature_index']),
+    ('instruction_set_parser.arch_cache', 'ArchitectureCache', ['load']),
+    ('input_preprocessor.preprocessor', 'InputPreprocessor', ['parse_file', '_replace_label_usage']),
+    ('asm_compiler.compiler', 'Compiler',
+     ['compile_program', 'compile_relocatable', '_compile_lines', '_compile_line', '_match_line',
+      '_find_matching_instruction', '_encode_instruction', '_write_output', '_write_binary', '_pack_words',
+      '_write_ascii']),
+    ('asm_compiler.optimizer', 'Optimizer', ['optimize'])
+]
+
+
+class Profiler:
+    """Collects how long each stage of a compilation takes, how long the functions in FUNCTIONS take, and counters
+    updated by the hot paths of the compiler, and reports them as JSON.
+
+    Counters are only updated while profiling, and whoever updates one should check Profiler.enabled first:
+        if profiler.Profiler.enabled:
+            profiler.Profiler.count('labels_substituted')
+    Only the work done by this process is counted, not the one done by worker processes (see the -j and -w options).
+    """
+
+    enabled = False
+    stages = OrderedDict()
+    counters = {}
+    # Calls and total time (including the functions it calls) of each function, by name
+    functions = {}
+    # The original functions that were wrapped by instrument(), as (class, name, function)
+    _originals = []
+    _stats = None
+
+    @classmethod
+    def start(cls, functions=True, stats=False):
+        """Resets every stage, counter and timing, and starts profiling.
+        :param functions: If true, time the functions in FUNCTIONS.
+        :param stats: If true, run cProfile too (see dump_stats).
+        """
+        cls.stages = OrderedDict()
+        cls.counters = {}
+        cls.functions = {}
+        cls.enabled = True
+        if functions:
+            cls.instrument()
+        if stats:
+            cls._stats = cProfile.Profile()
+            cls._stats.enable()
+
+    @classmethod
+    def stop(cls):
+        cls.enabled = False
+        if cls._stats is not None:
+            cls._stats.disable()
+        cls.uninstrument()
+
+    @classmethod
+    def count(cls, name, amount=1):
+        cls.counters[name] = cls.counters.get(name, 0) + amount
+
+    @classmethod
+    def add_stage(cls, name, seconds):
+        if cls.enabled:
+            cls.stages[name] = cls.stages.get(name, 0.0) + seconds
+
+    @classmethod
+    def _timed(cls, name, function):
+        def wrapper(owner, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(owner, *args, **kwargs)
+            finally:
+                timing = cls.functions.get(name)
+                if timing is None:
+                    timing = cls.functions[name] = [0, 0.0]
+                timing[0] += 1
+                timing[1] += time.perf_counter() - start
+        return wrapper
+
+    @classmethod
+    def instrument(cls, functions=None):
+        """Wraps the (class) methods listed in functions (see FUNCTIONS) so that each call is timed"""
+        if len(cls._originals) > 0:
+            return
+        for module, class_name, names in functions or FUNCTIONS:
+            owner = getattr(importlib.import_module(module), class_name)
+            for name in names:
+                original = owner.__dict__[name]
+                qualified_name = '{}.{}'.format(class_name, name)
+                setattr(owner, name, classmethod(cls._timed(qualified_name, original.__func__)))
+                cls._originals.append((owner, name, original))
+
+    @classmethod
+    def uninstrument(cls):
+        for owner, name, original in reversed(cls._originals):
+            setattr(owner, name, original)
+        cls._originals = []
+
+    @classmethod
+    def report(cls, **info):
+        """Returns everything that was collected, along with any other info about the compilation, as a dictionary"""
+        report = OrderedDict(info)
+        report['stages'] = cls.stages
+        report['total'] = sum(cls.stages.values())
+        report['functions'] = OrderedDict(
+            (name, {'calls': calls, 'seconds': seconds})
+            for name, (calls, seconds) in sorted(cls.functions.items(), key=lambda item: -item[1][1]))
+
+        counters = OrderedDict(sorted(cls.counters.items()))
+        # Derived counters
+        compile_time = cls.stages.get('compile', 0.0)
+        if counters.get('lines') and compile_time > 0:
+            counters['lines_per_second'] = counters['lines'] / compile_time
+        if counters.get('signature_lookups'):
+            counters['signatures_probed_per_lookup'] = counters['signatures_probed'] / counters['signature_lookups']
+        report['counters'] = counters
+        return report
+
+    @classmethod
+    def write_report(cls, path, stream=None, **info):
+        """Writes the report as JSON to path (or to stream, the standard output by default, if path is '-')"""
+        text = json.dumps(cls.report(**info), indent=2)
+        if path == '-':
+            print(text, file=stream if stream is not None else sys.stdout)
+        else:
+            with open(path, 'w') as fout:
+                fout.write(text + '\n')
+
+    @classmethod
+    def dump_stats(cls, path):
+        """Writes what cProfile collected to path, to be read with pstats"""
+        if cls._stats is not None:
+            cls._stats.dump_stats(path)
+            cls._stats = None
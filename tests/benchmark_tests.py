@@ -0,0 +1,69 @@
+from io import StringIO
+from benchmarks import compare
+from benchmarks import generators
+from benchmarks import run_benchmarks
+from asm_compiler import compiler
+from input_preprocessor import preprocessor
+from instruction_set_parser import is_parser
+import unittest
+
+AG = generators.ArchitectureGenerator
+SG = generators.SourceGenerator
+
+
+class GeneratorsTestCase(unittest.TestCase):
+    """Tests for the architecture and source generators of the benchmarks"""
+
+    def test_architecture_size(self):
+        for count in (2, 16, 300):
+            pa = is_parser.InstructionSetParser.parse_file(StringIO(AG.generate(count)))
+            self.assertEquals(count, len(pa.INSTRUCTION_SET))
+            self.assertEquals(count, len(set(instr.opcode for instr in pa.INSTRUCTION_SET)))
+
+    def test_word_size(self):
+        self.assertEquals(8, AG.word_size(16))
+        self.assertEquals(16, AG.word_size(65536))
+        self.assertEquals(11, AG.word_size(16, 2000))
+
+    def test_sources_compile(self):
+        word_size = AG.word_size(100, 2 * 200 + 2)
+        pa = is_parser.InstructionSetParser.parse_file(StringIO(AG.generate(100, word_size)))
+        for mix in sorted(SG.MIXES):
+            source = preprocessor.InputPreprocessor.parse_file(StringIO(SG.generate(pa.INSTRUCTION_SET, 200, mix,
+                                                                                   word_size)))
+            self.assertEquals(200, len(source))
+            obj = compiler.Compiler.compile_program(source, pa)
+            self.assertTrue(200 <= len(obj) <= 400)
+
+    def test_same_seed_same_source(self):
+        pa = is_parser.InstructionSetParser.parse_file(StringIO(AG.generate(16)))
+        self.assertEquals(SG.generate(pa.INSTRUCTION_SET, 50, 'jumps'), SG.generate(pa.INSTRUCTION_SET, 50, 'jumps'))
+
+
+class CompareTestCase(unittest.TestCase):
+    """Tests for the comparison of benchmark reports"""
+
+    @staticmethod
+    def _report(**times):
+        stages = {stage: 1.0 for stage in run_benchmarks.Benchmark.STAGES}
+        stages.update(times)
+        return {'results': [{'name': 'case', 'stages': stages}]}
+
+    def test_regressions(self):
+        rows = compare.Comparison.compare(self._report(), self._report(compile=1.05, preprocess=1.5))
+        regressions = [row[1] for row in rows if row[4]]
+        self.assertEquals(['preprocess'], regressions)
+
+    def test_ignores_short_stages(self):
+        rows = compare.Comparison.compare(self._report(compile=0.0001), self._report(compile=0.0005))
+        self.assertFalse(any(row[4] for row in rows))
+
+    def test_run_case(self):
+        result = run_benchmarks.Benchmark.run_case(16, 100, 'labels', repeat=1)
+        self.assertEquals(run_benchmarks.Benchmark.case_name(16, 100, 'labels'), result['name'])
+        self.assertEquals(set(run_benchmarks.Benchmark.STAGES), set(result['stages']))
+
+
+def suite():
+    return unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(GeneratorsTestCase),
+                               unittest.TestLoader().loadTestsFromTestCase(CompareTestCase)])
@@ -1,4 +1,14 @@
+import os
+import sys
+import tempfile
+from array import array
+from contextlib import redirect_stdout
+from io import BytesIO, StringIO
 from asm_compiler import compiler
+from asm_compiler import program
+from asm_compiler import costs
+from asm_compiler import records
+from input_preprocessor import preprocessor
 from instruction_set_parser import is_parser
 import unittest
 
@@ -110,6 +120,37 @@ class FindMatchingInstructionTestCase(unittest.TestCase):
         self.assertEquals(self.PA.INSTRUCTION_SET[5],
                           C._find_matching_instruction(self.PA, {'name': 'JP', 'args': ['M', '$address']}))
 
+    def test_find_first_of_equally_good_matches(self):
+        self.assertEquals(self.PA.INSTRUCTION_SET[1],
+                          C._find_matching_instruction(self.PA, {'name': 'LD', 'args': ['A', '5']}))
+
+    def test_find_undefined_instruction(self):
+        self.assertEquals(None, C._find_matching_instruction(self.PA, {'name': 'LD', 'args': ['A']}))
+
+    def test_find_memory_operand(self):
+        pa = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        self.assertEquals(0b00010010, C._find_matching_instruction(pa, {'name': 'LD', 'args': ['A', '(5)']}).opcode)
+        self.assertEquals(0b00000001, C._find_matching_instruction(pa, {'name': 'LD', 'args': ['A', '5']}).opcode)
+        # Memory operands aren't literals, and the other way around
+        self.assertEquals(None, C._find_matching_instruction(self.PA, {'name': 'LD', 'args': ['A', '(5)']}))
+
+    def test_find_same_as_linear_scan(self):
+        pa = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        lines = [{'name': 'LD', 'args': [a, b]} for a in ('A', 'B', '(B)', '(5)', '7') for b in ('A', 'E', '(C)', '9')]
+        lines += [{'name': 'JP', 'args': args} for args in (['3'], ['Z', '3'], ['Q', '3'], ['P', 'Z'])]
+        for tokens in lines:
+            # The best match is the first signature with the most arguments in common with the line, among those
+            # whose memory operands are where the line's are
+            best, best_score = None, -1
+            for instr in pa.INSTRUCTION_SET:
+                instr_tokens = C._tokenize_instruction(instr)
+                if instr_tokens['name'] == tokens['name'] and len(instr_tokens['args']) == len(tokens['args']) and \
+                        all((a[0] == '(') == (b[0] == '(') for a, b in zip(instr_tokens['args'], tokens['args'])):
+                    score = sum(1 for a, b in zip(instr_tokens['args'], tokens['args']) if a == b)
+                    if score > best_score:
+                        best, best_score = instr, score
+            self.assertEquals(best, C._find_matching_instruction(pa, tokens))
+
 
 class BinaryToASCIITestCase(unittest.TestCase):
     """Tests for the _binary_to_ASCII function of the compiler"""
@@ -120,11 +161,346 @@ class BinaryToASCIITestCase(unittest.TestCase):
     def test_encoding_large_object(self):
         self.assertEquals('00000010\n00000011\n11111111\n00000111\n', C._binary_to_ascii([2, 3, 255, 7], 8))
 
+    def test_encoding_wide_words(self):
+        for word_size in (17, 24, 32, 40, 64):
+            words = [0, 1, (1 << word_size) - 1, 0b101 << (word_size - 3)]
+            expected = ''.join('{0:b}'.format(word).zfill(word_size) + '\n' for word in words)
+            obj = C._new_object(word_size)
+            obj.extend(words)
+            self.assertEquals(expected, C._binary_to_ascii(obj, word_size))
+
+    def test_writing_in_blocks(self):
+        fout = StringIO()
+        block_size, C._WRITE_BLOCK_SIZE = C._WRITE_BLOCK_SIZE, 2
+        try:
+            C._write_ascii(array('B', [1, 2, 3, 4, 5]), 3, fout)
+        finally:
+            C._WRITE_BLOCK_SIZE = block_size
+        self.assertEquals('001\n010\n011\n100\n101\n', fout.getvalue())
+
+
+class PackWordsTestCase(unittest.TestCase):
+    """Tests for the _pack_words function of the compiler"""
+
+    def test_packing_bytes(self):
+        self.assertEquals(b'\x02\xff', C._pack_words(C._new_object(8) + array('B', [2, 255]), 8))
+
+    def test_packing_nibbles(self):
+        self.assertEquals(b'\x12\x30', C._pack_words([1, 2, 3], 4))
+
+    def test_packing_unaligned_words(self):
+        self.assertEquals(b'\xab\xcd\xef', C._pack_words([0xabc, 0xdef], 12))
+
+    def test_packing_large_words(self):
+        self.assertEquals(b'\x12\x34\xff\x00', C._pack_words(array('H', [0x1234, 0xff00]), 16))
+        self.assertEquals(b'\x34\x12\x00\xff', C._pack_words([0x1234, 0xff00], 16, byteorder='little'))
+        self.assertEquals(b'\x03\x02\x01', C._pack_words([0x010203], 24, byteorder='little'))
+
+    def test_packing_lsb_first(self):
+        self.assertEquals(b'\x80\x01', C._pack_words([1, 128], 8, bitorder='lsb'))
+        self.assertEquals(b'\x48\x0c', C._pack_words([1, 2, 3], 4, bitorder='lsb'))
+
+    def test_packing_nothing(self):
+        self.assertEquals(b'', C._pack_words([], 4))
+
+    def test_object_fits_words(self):
+        self.assertEquals('B', C._new_object(4).typecode)
+        self.assertEquals(2, C._new_object(12).itemsize)
+        self.assertEquals([], C._new_object(128))
+
+    def test_packing_in_blocks(self):
+        words = [(i * 37) % 4096 for i in range(50)]
+        expected = C._pack_words(words, 12, bitorder='lsb')
+        block_size = C._PACK_BLOCK_SIZE
+        try:
+            C._PACK_BLOCK_SIZE = 3
+            self.assertEquals(expected, C._pack_words(words, 12, bitorder='lsb'))
+        finally:
+            C._PACK_BLOCK_SIZE = block_size
+
+    def test_packed_blocks(self):
+        block_size = C._WRITE_BLOCK_SIZE
+        try:
+            C._WRITE_BLOCK_SIZE = 4
+            for words, word_size in (([1, 2, 3], 4), ([0xabc] * 11, 12), ([0x1234] * 7, 16), ([1] * 9, 3), ([], 8)):
+                blocks = list(C._packed_blocks(words, word_size, 'little', 'lsb'))
+                self.assertEquals(C._pack_words(words, word_size, 'little', 'lsb'), b''.join(blocks))
+                self.assertTrue(all(len(block) <= 4 for block in blocks))
+        finally:
+            C._WRITE_BLOCK_SIZE = block_size
+
+    def test_packing_keeps_words(self):
+        obj = array('H', [0x1234, 0xff00])
+        C._pack_words(obj, 16, byteorder='little' if sys.byteorder == 'big' else 'big')
+        self.assertEquals(array('H', [0x1234, 0xff00]), obj)
+
+    def test_write_binary(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'out.kasm')
+            for words, word_size, byteorder in (([1, 2, 3], 4, 'big'), ([0x1234, 0xff00], 16, 'little'),
+                                                ([0xabc, 0xdef], 12, 'big'), ([], 8, 'big')):
+                C._write_binary(words, word_size, path, byteorder, 'lsb')
+                with open(path, 'rb') as fin:
+                    self.assertEquals(C._pack_words(words, word_size, byteorder, 'lsb'), fin.read())
+
+
+class WriteOutputTestCase(unittest.TestCase):
+    """Tests for the _write_output and write_depfile functions of the compiler"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'out')
+        self.pa = is_parser.ProcessorArchitecture()
+        self.pa.WORD_SIZE = 12
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, words):
+        C._write_output(C._new_object(12) + array('H', words), self.output, self.pa, True, True)
+        # Mark the files, to see whether they're written again
+        for extension in ('.kasm', '.kobj'):
+            os.utime(self.output + extension, ns=(0, 0))
+
+    def test_unchanged_outputs(self):
+        self.write([0xabc, 0x123])
+        self.write([0xabc, 0x123])
+        self.assertEquals(0, os.stat(self.output + '.kasm').st_mtime_ns)
+        self.assertEquals(0, os.stat(self.output + '.kobj').st_mtime_ns)
+        with open(self.output + '.kobj') as fin:
+            self.assertEquals('101010111100\n000100100011\n', fin.read())
+
+    def test_changed_outputs(self):
+        self.write([0xabc, 0x123])
+        for words in ([0xabc, 0x124], [0xabc]):
+            C._write_output(C._new_object(12) + array('H', words), self.output, self.pa, True, True)
+            self.assertNotEquals(0, os.stat(self.output + '.kasm').st_mtime_ns)
+            self.assertNotEquals(0, os.stat(self.output + '.kobj').st_mtime_ns)
+            with open(self.output + '.kasm', 'rb') as fin:
+                self.assertEquals(C._pack_words(words, 12), fin.read())
+
+    def test_record_outputs(self):
+        words = C._new_object(12) + array('H', [0xabc, 0x123])
+        C._write_output(words, self.output, self.pa, False, False, output_hex=True, output_srec=True)
+        with open(self.output + '.hex') as fin:
+            self.assertEquals(':03000000ABC1236E\n:00000001FF\n', fin.read())
+        with open(self.output + '.srec') as fin:
+            self.assertEquals('S0030000FC\nS1060000ABC1236A\nS5030001FB\nS9030000FC\n', fin.read())
+
+    def test_stream_outputs(self):
+        words = C._new_object(12) + array('H', [0xabc, 0x123])
+        output = BytesIO()
+        C._write_output(words, output, self.pa, True, False)
+        self.assertEquals(b'\xab\xc1\x23', output.getvalue())
+        output = StringIO()
+        C._write_output(words, output, self.pa, False, False, output_hex=True)
+        self.assertEquals(':03000000ABC1236E\n:00000001FF\n', output.getvalue())
+
+    def test_binary_on_text_stream(self):
+        words = C._new_object(12) + array('H', [0xabc, 0x123])
+        with redirect_stdout(StringIO()), self.assertRaises(SystemExit) as context:
+            C._write_output(words, StringIO(), self.pa, True, False)
+        self.assertEquals(compiler.COMPILER_ERR_TEXT_STREAM.error_id, context.exception.code)
+
+    def test_depfile(self):
+        path = self.output + '.d'
+        C.write_depfile(path, ['out.kasm', 'out.kobj'], ['main.asm', 'my arch.txt', 'lib/$x.asm'],
+                        phony=['lib/$x.asm'])
+        with open(path) as fin:
+            self.assertEquals('out.kasm out.kobj: main.asm \\\n  my\\ arch.txt \\\n  lib/$$x.asm\n\nlib/$$x.asm:\n',
+                              fin.read())
+
 
 class AdjustAddressesTestCase(unittest.TestCase):
-    """Tests for the _adjust_addresses function of the compiler"""
-    # Todo: Implement some unit tests. Right now there's a few integration tests about this.
-    pass
+    """Tests for the _compile_line function of the compiler, and for the layout and relocation of a Program"""
+
+    PA = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.PA = is_parser.ProcessorArchitecture()
+        cls.PA.INSTRUCTION_SET.append(is_parser.Instruction(0, 1, 'HALT'))
+        cls.PA.INSTRUCTION_SET.append(is_parser.Instruction(1, 2, 'LD A,_$literal'))
+        cls.PA.INSTRUCTION_SET.append(is_parser.Instruction(2, 2, 'JP M,_$address'))
+        cls.PA.INSTRUCTION_SET.append(is_parser.Instruction(3, 3, 'CPLX ($literal),_$address'))
+        is_parser.InstructionSetParser._build_signature_index(cls.PA)
+
+    def _program(self, lines=('LD A, 3', 'JP M, 3', 'HALT', 'JP M, 0')):
+        return C._compile_lines(self.PA, list(lines))
+
+    def test_compile_line(self):
+        self.assertEquals(program.CompiledLine(self.PA.INSTRUCTION_SET[2], (2, 3), (1,)),
+                          C._compile_line(self.PA, 0, 'JP M, 3'))
+        self.assertEquals(program.CompiledLine(self.PA.INSTRUCTION_SET[3], (3, 5, 1), (2,)),
+                          C._compile_line(self.PA, 0, 'CPLX (5), 1'))
+
+    def test_program_columns(self):
+        prog = self._program()
+        self.assertEquals(4, len(prog))
+        self.assertEquals([1, 2, 0, 2], list(prog.instructions))
+        self.assertEquals([1, 3, 2, 3, 0, 2, 0], list(prog.words))
+        self.assertEquals([3, 6], list(prog.relocations))
+        self.assertEquals(self.PA.INSTRUCTION_SET[0], prog.instruction(2))
+
+    def test_program_extend(self):
+        prog = self._program(['HALT', 'JP M, 0'])
+        prog.extend(self._program().columns())
+        self.assertEquals([0, 2, 1, 2, 0, 2], list(prog.instructions))
+        self.assertEquals([0, 2, 0, 1, 3, 2, 3, 0, 2, 0], list(prog.words))
+        self.assertEquals([2, 6, 9], list(prog.relocations))
+        layout = prog.layout()
+        self.assertEquals(C._compile_line(self.PA, 0, 'JP M, 3'), prog.compiled_line(3, layout))
+        self.assertEquals(C._compile_line(self.PA, 0, 'LD A, 3'), prog.compiled_line(2, layout))
+
+    def test_layout(self):
+        self.assertEquals([0, 2, 4, 5, 7], list(self._program().layout()))
+
+    def test_layout_empty_program(self):
+        self.assertEquals([0], list(self._program([]).layout()))
+
+    def test_relocate(self):
+        prog = self._program()
+        self.assertEquals(None, prog.relocate(prog.layout(), 8))
+        # The forward address points to HALT, the backward one to the start, and literals are left alone
+        self.assertEquals([1, 3, 2, 5, 0, 2, 0], list(prog.words))
+
+    def test_address_too_large(self):
+        prog = self._program()
+        layout = prog.layout()
+        position = prog.relocate(layout, 2)
+        self.assertEquals(3, position)
+        self.assertEquals(1, prog.line_at(position, layout))
+
+    def test_address_outside_of_program(self):
+        prog = self._program(['JP M, 9', 'HALT'])
+        self.assertEquals(1, prog.relocate(prog.layout(), 8))
+
+
+class OptimizerTestCase(unittest.TestCase):
+    """Tests for the optimizer, through the compile_program function of the compiler"""
+
+    PA = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.PA = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+
+    def assertOptimizes(self, expected, source):
+        compile_source = lambda text, optimize: list(C.compile_program(
+            preprocessor.InputPreprocessor.parse_file(StringIO(text)), self.PA, optimize=optimize))
+        self.assertEquals(compile_source(expected, False), compile_source(source, True))
+
+    def test_nothing_to_optimize(self):
+        with open('test_source.txt') as fin:
+            source = fin.read()
+        self.assertOptimizes(source, source)
+
+    def test_unreachable_code(self):
+        self.assertOptimizes('loop:\nINC A\nJP Z, end\nJP loop\nend:\nHALT\n',
+                             'loop:\nINC A\nJP Z, end\nJP loop\nINC B\nDEC B\nend:\nHALT\nINC A\n')
+
+    def test_jump_threading(self):
+        self.assertOptimizes('start:\nJP Z, end\nINC A\nJP start\nend:\nHALT\n',
+                             'start:\nJP Z, hop\nINC A\nJP start\nhop:\nJP skip\nskip:\nJP end\nend:\nHALT\n')
+
+    def test_jump_to_next_line(self):
+        self.assertOptimizes('INC A\nHALT\n', 'INC A\nJP next\nnext:\nHALT\n')
+
+    def test_jump_loop(self):
+        self.assertOptimizes('INC A\nforever:\nJP forever\n', 'INC A\nforever:\nJP forever\nHALT\n')
+
+    def test_moves(self):
+        self.assertOptimizes('LD A, B\nINC A\nHALT\n', 'LD A, B\nLD B, A\nINC A\nHALT\n')
+        # Something else could jump to the second move
+        source = 'LD A, B\nback:\nLD B, A\nJP NZ, back\nHALT\n'
+        self.assertOptimizes(source, source)
+
+    def test_labels_are_renumbered(self):
+        labels = {}
+        lines = preprocessor.InputPreprocessor.parse_file(
+            StringIO('JP start\nHALT\nstart:\nINC A\nend:\n'), labels=labels)
+        C.compile_program(lines, self.PA, optimize=True, cost_report=costs.CostReport(labels))
+        self.assertEquals({'start': 0, 'end': 1}, labels)
+
+    def test_indirect_jumps(self):
+        pa = is_parser.InstructionSetParser.parse_file(StringIO(
+            'WORD_SIZE(8)\nINSTRUCTION(0, 1, \'HALT\')\nINSTRUCTION(1, 2, \'JP $address\')\n'
+            'INSTRUCTION(2, 1, \'JP (A)\')\nTERMINATORS(\'HALT\')\nJUMPS(\'JP\')\n'))
+        lines = ['JP (A)', 'HALT', 'JP 1', 'HALT']
+        self.assertEquals(list(C.compile_program(lines, pa)), list(C.compile_program(lines, pa, optimize=True)))
+
+    def test_undeclared_jumps(self):
+        # Nothing is assumed about instructions that the instruction set doesn't declare
+        pa = is_parser.InstructionSetParser.parse_file(StringIO(
+            'WORD_SIZE(8)\nINSTRUCTION(0, 1, \'HALT\')\nINSTRUCTION(1, 2, \'BR $address\')\n'
+            'INSTRUCTION(2, 1, \'MV A,_B\')\nTERMINATORS(\'HALT\')\n'))
+        lines = ['BR 2', 'HALT', 'MV A, B', 'HALT']
+        self.assertEquals(list(C.compile_program(lines, pa)), list(C.compile_program(lines, pa, optimize=True)))
+
+    def test_labels_as_literals_are_renumbered(self):
+        compile_source = lambda text, optimize: list(C.compile_program(
+            preprocessor.InputPreprocessor.parse_file(StringIO(text), labels=labels, replace_labels=False), self.PA,
+            optimize=optimize, labels=labels))
+        labels = {}
+        optimized = compile_source('JP start\nHALT\nHALT\nstart:\nLD A, end\nJP end\nend:\nHALT\n', True)
+        labels = {}
+        self.assertEquals(compile_source('LD A, end\nend:\nHALT\n', False), optimized)
+        self.assertEquals([0b00000001, 1, 0b00000000], optimized)
+
+
+class CostReportTestCase(unittest.TestCase):
+    """Tests for the CostReport class, through the compile_program function of the compiler"""
+
+    PA = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.PA = is_parser.InstructionSetParser.parse_file(StringIO(
+            'WORD_SIZE(8)\nINSTRUCTION(0, 1, \'HALT\', 1)\nINSTRUCTION(1, 2, \'LD A,_$literal\', 2)\n'
+            'INSTRUCTION(2, 2, \'JP NZ,_$address\', 2, 4)\nINSTRUCTION(3, 1, \'OUT A\')\n'))
+
+    def measure(self, source):
+        labels = {}
+        report = costs.CostReport(labels)
+        C.compile_program(preprocessor.InputPreprocessor.parse_file(StringIO(source), labels=labels), self.PA,
+                          cost_report=report)
+        return report
+
+    def test_blocks(self):
+        report = self.measure('LD A, 1\nloop:\nagain:\nJP NZ, loop\nLD A, 2\nend:\nHALT\n')
+        self.assertEquals([([], 0, 0, 2, 2, 2), (['again', 'loop'], 1, 2, 4, 4, 6), (['end'], 3, 6, 1, 1, 1)],
+                          [(block['labels'], block['line'], block['address'], block['words'], block['best_cycles'],
+                            block['worst_cycles']) for block in report.blocks])
+        self.assertEquals({'words': 7, 'best_cycles': 7, 'worst_cycles': 9}, dict(report.program))
+
+    def test_unknown_cycles(self):
+        report = self.measure('start:\nOUT A\nHALT\n')
+        self.assertEquals(['start'], report.blocks[0]['labels'])
+        self.assertEquals({'words': 2, 'best_cycles': None, 'worst_cycles': None}, dict(report.program))
+
+
+class RecordWriterTestCase(unittest.TestCase):
+    """Tests for the RecordWriter class"""
+
+    def test_intel_hex(self):
+        self.assertEquals([':10000000000102030405060708090A0B0C0D0E0F78\n', ':0400100010111213A6\n', ':00000001FF\n'],
+                          list(records.RecordWriter.intel_hex(bytes(range(20)))))
+
+    def test_intel_hex_extended_address(self):
+        lines = list(records.RecordWriter.intel_hex(bytes(0x10010)))
+        self.assertEquals(':020000040001F9\n', lines[0x1000])
+        self.assertEquals(':1000000000000000000000000000000000000000F0\n', lines[0x1001])
+
+    def test_srec(self):
+        self.assertEquals(['S0030000FC\n', 'S1130000000102030405060708090A0B0C0D0E0F74\n', 'S107001010111213A2\n',
+                           'S5030002FA\n', 'S9030000FC\n'], list(records.RecordWriter.srec(bytes(range(20)))))
+
+    def test_srec_address_size(self):
+        lines = list(records.RecordWriter.srec(bytes(0x10001), header=b'hi'))
+        self.assertEquals('S0050000686929\n', lines[0])
+        self.assertEquals('S20501000000F9\n', lines[-3])
+        self.assertEquals('S804000000FB\n', lines[-1])
+
 
 def suite():
     tokenize_line_suite = unittest.TestLoader().loadTestsFromTestCase(TokenizeLineTestCase)
@@ -132,8 +508,14 @@ def suite():
     instruction_encoder_suite = unittest.TestLoader().loadTestsFromTestCase(InstructionEncoderTestCase)
     findmatching_suite = unittest.TestLoader().loadTestsFromTestCase(FindMatchingInstructionTestCase)
     btascii_suite = unittest.TestLoader().loadTestsFromTestCase(BinaryToASCIITestCase)
+    pack_words_suite = unittest.TestLoader().loadTestsFromTestCase(PackWordsTestCase)
     adjustaddress_suite = unittest.TestLoader().loadTestsFromTestCase(AdjustAddressesTestCase)
+    optimizer_suite = unittest.TestLoader().loadTestsFromTestCase(OptimizerTestCase)
+    cost_report_suite = unittest.TestLoader().loadTestsFromTestCase(CostReportTestCase)
+    write_output_suite = unittest.TestLoader().loadTestsFromTestCase(WriteOutputTestCase)
+    record_writer_suite = unittest.TestLoader().loadTestsFromTestCase(RecordWriterTestCase)
 
     return unittest.TestSuite([tokenize_line_suite, tokenize_instr_suite, instruction_encoder_suite,
-                               findmatching_suite, btascii_suite, adjustaddress_suite])
+                               findmatching_suite, btascii_suite, pack_words_suite, adjustaddress_suite,
+                               optimizer_suite, cost_report_suite, write_output_suite, record_writer_suite])
 
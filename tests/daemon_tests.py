@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import tempfile
+import threading
+from io import StringIO
+from compile_daemon import daemon
+import unittest
+
+CD = daemon.CompileDaemon
+
+
+def fake_main(argv, use_daemon=True):
+    print('compiling {} in {}'.format(' '.join(argv), os.getcwd()))
+    if 'fail' in argv:
+        exit(3)
+    return 0
+
+
+class HandleRequestTestCase(unittest.TestCase):
+    """Tests for the handle_request and serve_lines functions of the compile daemon"""
+
+    def test_request_runs_in_client_directory(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            response = CD.handle_request({'argv': ['-i', 'a.txt'], 'cwd': directory}, fake_main)
+            expected_output = 'compiling -i a.txt in {}\n'.format(os.path.realpath(directory))
+            self.assertEquals({'status': 0, 'output': expected_output}, response)
+        self.assertEquals(cwd, os.getcwd())
+
+    def test_request_keeps_standard_error_apart(self):
+        def noisy_main(argv, use_daemon=True):
+            print('{"report": true}')
+            print('progress', file=sys.stderr)
+            return 0
+        response = CD.handle_request({'argv': []}, noisy_main)
+        self.assertEquals({'status': 0, 'output': '{"report": true}\n', 'errors': 'progress\n'}, response)
+
+    def test_request_exit_status(self):
+        self.assertEquals(3, CD.handle_request({'argv': ['fail']}, fake_main)['status'])
+
+    def test_serve_lines(self):
+        fout = StringIO()
+        requests = [{'argv': ['one']}, {'argv': ['fail']}, {'shutdown': True}, {'argv': ['never']}]
+        self.assertTrue(CD.serve_lines(StringIO(''.join(json.dumps(r) + '\n' for r in requests)), fout, fake_main))
+        responses = [json.loads(line) for line in fout.getvalue().splitlines()]
+        self.assertEquals([0, 3, 0], [response['status'] for response in responses])
+
+
+@unittest.skipUnless(hasattr(daemon.socket, 'AF_UNIX'), 'Unix sockets are not supported')
+class SocketTestCase(unittest.TestCase):
+    """Tests for the Unix socket server and client of the compile daemon"""
+
+    def test_compile_through_socket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'kasmd.sock')
+            self.assertEquals(None, daemon.DaemonClient.compile(path, ['one']))
+
+            server = threading.Thread(target=CD.serve, args=(path, fake_main))
+            server.start()
+            try:
+                while not daemon.DaemonClient.is_running(path):
+                    pass
+                response = daemon.DaemonClient.request(path, {'argv': ['fail'], 'cwd': directory})
+                self.assertEquals(3, response['status'])
+            finally:
+                daemon.DaemonClient.request(path, {'shutdown': True})
+                server.join()
+            self.assertFalse(os.path.exists(path))
+
+
+def suite():
+    handle_request_suite = unittest.TestLoader().loadTestsFromTestCase(HandleRequestTestCase)
+    socket_suite = unittest.TestLoader().loadTestsFromTestCase(SocketTestCase)
+
+    return unittest.TestSuite([handle_request_suite, socket_suite])
@@ -0,0 +1,94 @@
+import os
+import tempfile
+from io import StringIO
+from asm_compiler import compiler
+from asm_compiler import disassembler
+from input_preprocessor import preprocessor
+from instruction_set_parser import is_parser
+import unittest
+
+C = compiler.Compiler
+D = disassembler.Disassembler
+
+
+class DisassemblerTestCase(unittest.TestCase):
+    """Tests for the Disassembler, against the test architecture"""
+
+    def setUp(self):
+        self.pa = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        self.words = C.compile_program(preprocessor.InputPreprocessor.parse_file('test_source.txt'), self.pa)
+
+    def test_round_trip(self):
+        self.assertIsNone(D.verify(self.words, self.pa))
+
+    def test_labels(self):
+        source = list(D.iter_source(self.words, self.pa))
+        self.assertIn('label_4:', source)
+        self.assertIn('\tJP label_4', source)
+        self.assertEquals('\tHALT', source[-1])
+
+    def test_unknown_words(self):
+        words = C._new_object(self.pa.WORD_SIZE)
+        words.extend([0x90, 0x10, 0x05])
+        source = list(D.iter_source(words, self.pa))
+        self.assertEquals('\t; 0x0: unknown word 0x90', source[0])
+        self.assertEquals(0, D.verify(words, self.pa))
+
+    def test_trailing_zero_opcode(self):
+        pa = is_parser.InstructionSetParser.parse_file(StringIO(
+            'WORD_SIZE(4)\nINSTRUCTION(0, 1, \'HALT\')\nINSTRUCTION(1, 1, \'INC A\')\n'))
+        words = C.compile_program(['INC A', 'INC A', 'INC A', 'HALT'], pa)
+        image = D._unpack_words(C._pack_words(words, pa.WORD_SIZE), pa.WORD_SIZE)
+        self.assertEquals(['\tINC A'] * 3 + ['\tHALT'], list(D.iter_source(image, pa)))
+        self.assertIsNone(D.verify(image, pa))
+        # The padding of an odd number of words disassembles to an extra word, which still packs to the same image
+        self.assertIsNone(D.verify(D._unpack_words(C._pack_words(words[:3], pa.WORD_SIZE), pa.WORD_SIZE), pa))
+
+    def test_dictionary_table(self):
+        table = D.decode_table(self.pa)
+        entries = {opcode: entry for opcode, entry in enumerate(table) if entry is not None}
+        self.assertEquals(list(D.iter_source(self.words, self.pa)),
+                          list(D.iter_source(self.words, self.pa, table=entries)))
+
+    def test_read_image(self):
+        fd, path = tempfile.mkstemp(suffix='.kobj')
+        try:
+            with os.fdopen(fd, 'w') as fout:
+                C._write_ascii(self.words, self.pa.WORD_SIZE, fout)
+            self.assertEquals(list(self.words), list(D.read_image(path, self.pa.WORD_SIZE)))
+            with open(path, 'wb') as fout:
+                fout.write(C._pack_words(self.words, self.pa.WORD_SIZE))
+            os.rename(path, path[:-len('.kobj')] + '.kasm')
+            path = path[:-len('.kobj')] + '.kasm'
+            self.assertEquals(list(self.words), list(D.read_image(path, self.pa.WORD_SIZE)))
+        finally:
+            os.remove(path)
+
+
+class UnpackWordsTestCase(unittest.TestCase):
+    """Tests for the _unpack_words function of the disassembler, which should undo Compiler._pack_words"""
+
+    def assertUnpacks(self, words, word_size, byteorder='big', bitorder='msb', padding=0):
+        data = bytes(C._pack_words(words, word_size, byteorder, bitorder))
+        self.assertEquals(list(words) + [0] * padding, list(D._unpack_words(data, word_size, byteorder, bitorder)))
+
+    def test_nibbles(self):
+        self.assertUnpacks([1, 2, 3], 4, padding=1)
+        self.assertUnpacks([1, 2, 3, 0], 4)
+        self.assertUnpacks([1, 2, 3], 4, bitorder='lsb', padding=1)
+        self.assertUnpacks([1, 2, 3], 3, padding=2)
+
+    def test_unaligned(self):
+        self.assertUnpacks([0xabc, 0x123, 0xfff], 12)
+        self.assertUnpacks([0x123456, 0xabcdef], 24, byteorder='little')
+
+    def test_aligned(self):
+        self.assertUnpacks([0x1234, 0xfedc], 16)
+        self.assertUnpacks([0x1234, 0xfedc], 16, byteorder='little', bitorder='lsb')
+
+
+def suite():
+    disassembler_suite = unittest.TestLoader().loadTestsFromTestCase(DisassemblerTestCase)
+    unpack_words_suite = unittest.TestLoader().loadTestsFromTestCase(UnpackWordsTestCase)
+
+    return unittest.TestSuite([disassembler_suite, unpack_words_suite])
@@ -1,5 +1,10 @@
+import os
+import tempfile
 from io import StringIO
+from contextlib import redirect_stdout
 from asm_compiler import compiler
+from asm_compiler import incremental
+from asm_compiler import batch
 from input_preprocessor import preprocessor
 from instruction_set_parser import is_parser
 import unittest
@@ -37,8 +42,255 @@ class IntegrationTestCase(unittest.TestCase):
         with open('test_expected_output.kobj', 'r') as expected_output:
             self.assertEquals(expected_output.read(), output.read())
 
+    def test_binary_on_text_stream(self):
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        with redirect_stdout(StringIO()) as messages, self.assertRaises(SystemExit) as context:
+            compiler.Compiler.parse_file(['HALT'], StringIO(), processor_architecture)
+        self.assertEquals(compiler.COMPILER_ERR_TEXT_STREAM.error_id, context.exception.code)
+        self.assertIn('StringIO', messages.getvalue())
+
+    def test_complex_file_binary(self):
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        lines = preprocessor.InputPreprocessor.parse_file('test_source.txt')
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            output = os.path.join(output_dir, 'output')
+            compiler.Compiler.parse_file(lines, output, processor_architecture, True, False)
+            with open(output + '.kasm', 'rb') as binary_output:
+                binary = binary_output.read()
+
+        with open('test_expected_output.kobj', 'r') as expected_output:
+            expected = bytes(int(word, 2) for word in expected_output.read().split())
+        self.assertEquals(expected, binary)
+
+    def test_wide_words_binary(self):
+        architecture = StringIO('WORD_SIZE(12)\nINSTRUCTION(0xABC, 2, \'LD A,_$literal\')\nINSTRUCTION(0, 1, \'HALT\')')
+        source = StringIO('LD A, 0xDEF\nHALT')
+
+        processor_architecture = is_parser.InstructionSetParser.parse_file(architecture)
+        lines = preprocessor.InputPreprocessor.parse_file(source)
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            output = os.path.join(output_dir, 'output')
+            compiler.Compiler.parse_file(lines, output, processor_architecture, True, False)
+            with open(output + '.kasm', 'rb') as binary_output:
+                self.assertEquals(b'\xab\xcd\xef\x00\x00', binary_output.read())
+
+    def test_parallel_compilation(self):
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        lines = preprocessor.InputPreprocessor.parse_file('test_source.txt') * 3
+
+        output = StringIO()
+        compiler.Compiler.parse_file(lines, output, processor_architecture, False, True, jobs=3)
+
+        expected = StringIO()
+        compiler.Compiler.parse_file(lines, expected, processor_architecture, False, True)
+        self.assertEquals(expected.getvalue(), output.getvalue())
+
+        # Lines compiled by worker processes are cached one by one
+        cache = incremental.EncodingCache(processor_architecture)
+        output = StringIO()
+        compiler.Compiler.parse_file(lines, output, processor_architecture, False, True, encoding_cache=cache, jobs=3)
+        self.assertEquals(expected.getvalue(), output.getvalue())
+        for line in set(lines):
+            self.assertEquals(compiler.Compiler._compile_line(processor_architecture, 0, line), cache.lines[line])
+
+    def test_parallel_compilation_error(self):
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        with self.assertRaises(SystemExit) as context:
+            compiler.Compiler.parse_file(['HALT', 'BOGUS', 'HALT'], StringIO(), processor_architecture, False, True,
+                                         jobs=2)
+        self.assertEquals(compiler.COMPILER_ERR_UNDEFINED_INSTRUCTION.error_id, context.exception.code)
+
+    def test_incremental_rebuild(self):
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        with open('test_source.txt', 'r') as source:
+            source = source.read()
+        edited_source = source.replace('SRL A', 'SRL A\n LD A, 0xFF\n SLL A')
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            cache_path = os.path.join(output_dir, 'output.kcache')
+            for text in (source, edited_source):
+                labels = {}
+                lines = preprocessor.InputPreprocessor.parse_file(StringIO(text), labels=labels, replace_labels=False)
+                cache = incremental.EncodingCache.load(cache_path, processor_architecture)
+                output = StringIO()
+                compiler.Compiler.parse_file(lines, output, processor_architecture, False, True, encoding_cache=cache,
+                                             labels=labels)
+                cache.save(cache_path)
+
+                clean_output = StringIO()
+                compiler.Compiler.parse_file(preprocessor.InputPreprocessor.parse_file(StringIO(text)), clean_output,
+                                             processor_architecture, False, True)
+                self.assertEquals(clean_output.getvalue(), output.getvalue())
+
+            # Only the two added lines were compiled again, even though the jump to 'end' now points elsewhere
+            self.assertEquals(2, cache.misses)
+            self.assertEquals(len(lines) - 2, cache.hits)
+
+    def test_incremental_rebuild_moves_labels(self):
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        source = ''.join('loop{0}:\nINC A\nJP NZ, loop{0}\n'.format(i) for i in range(40)) + 'HALT\n'
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            cache_path = os.path.join(output_dir, 'output.kcache')
+            for text in (source, 'DEC B\n' + source):
+                labels = {}
+                lines = preprocessor.InputPreprocessor.parse_file(StringIO(text), labels=labels, replace_labels=False)
+                cache = incremental.EncodingCache.load(cache_path, processor_architecture)
+                words = compiler.Compiler.compile_program(lines, processor_architecture, cache, labels=labels)
+                cache.save(cache_path)
+                self.assertEquals(compiler.Compiler.compile_program(
+                    preprocessor.InputPreprocessor.parse_file(StringIO(text)), processor_architecture), words)
+
+            # Every line moved, but only the one that was added is compiled again
+            self.assertEquals(1, cache.misses)
+            self.assertEquals(81, cache.hits)
+
+    def test_incremental_rebuild_labels_as_literals(self):
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        source = 'start:\n  LD A, end\n  LD A, (start)\n  JP end\nend:\n  HALT\n'
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            cache_path = os.path.join(output_dir, 'output.kcache')
+            for text in (source, 'INC A\n' + source):
+                labels = {}
+                lines = preprocessor.InputPreprocessor.parse_file(StringIO(text), labels=labels, replace_labels=False)
+                cache = incremental.EncodingCache.load(cache_path, processor_architecture)
+                words = compiler.Compiler.compile_program(lines, processor_architecture, cache, labels=labels)
+                cache.save(cache_path)
+                self.assertEquals(compiler.Compiler.compile_program(
+                    preprocessor.InputPreprocessor.parse_file(StringIO(text)), processor_architecture), words)
+
+            # Labels passed as literals are the number of their line, which moved without compiling the line again
+            self.assertEquals([0b00000110, 0b00000001, 4, 0b00010010, 1, 0b00001101, 7, 0b00000000], list(words))
+            self.assertEquals(1, cache.misses)
+
+        # Literals that are neither numbers nor labels still can't be encoded
+        lines = preprocessor.InputPreprocessor.parse_file(StringIO('LD A, nowhere\n'), replace_labels=False)
+        with redirect_stdout(StringIO()), self.assertRaises(SystemExit) as context:
+            compiler.Compiler.compile_program(lines, processor_architecture, labels={})
+        self.assertEquals(compiler.COMPILER_ERR_UNCOMPILABLE_INSTRUCTION.error_id, context.exception.code)
+
+    def test_incremental_cache_is_per_architecture(self):
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        other_architecture = is_parser.InstructionSetParser.parse_file(StringIO('INSTRUCTION(0, 1, \'HALT\')'))
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            cache_path = os.path.join(output_dir, 'output.kcache')
+            cache = incremental.EncodingCache.load(cache_path, processor_architecture)
+            compiler.Compiler.parse_file(['HALT'], StringIO(), processor_architecture, False, True,
+                                         encoding_cache=cache)
+            cache.save(cache_path)
+
+            self.assertEquals(1, len(incremental.EncodingCache.load(cache_path, processor_architecture).lines))
+            self.assertEquals(0, len(incremental.EncodingCache.load(cache_path, other_architecture).lines))
+
+    def test_complex_file_streamed(self):
+        output = StringIO()
+
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        lines = preprocessor.InputPreprocessor.iter_file('test_source.txt')
+        compiler.Compiler.parse_stream(lines, output, processor_architecture, False, True)
+
+        output.seek(0)
+        with open('test_expected_output.kobj', 'r') as expected_output:
+            self.assertEquals(expected_output.read(), output.read())
+
+    def test_streamed_addresses(self):
+        source = StringIO('start:\n  JP end ; forward\n  JP start\nloop:\n  JP P, 4\n  JP M, loop\n  JP 0\n'
+                          '  ; nothing here\nend:\n')
+        output = StringIO()
+
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        lines = preprocessor.InputPreprocessor.iter_file(source)
+        compiler.Compiler.parse_stream(lines, output, processor_architecture, False, True)
+
+        source.seek(0)
+        expected = StringIO()
+        compiler.Compiler.parse_file(preprocessor.InputPreprocessor.parse_file(source), expected,
+                                     processor_architecture, False, True)
+        self.assertEquals(expected.getvalue(), output.getvalue())
+
+    def test_streamed_undefined_label(self):
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        lines = preprocessor.InputPreprocessor.iter_file(StringIO('JP nowhere'))
+        with self.assertRaises(SystemExit) as context:
+            compiler.Compiler.parse_stream(lines, StringIO(), processor_architecture, False, True)
+        self.assertEquals(compiler.COMPILER_ERR_UNDEFINED_LABEL.error_id, context.exception.code)
+
+    def test_streamed_labels_as_literals(self):
+        source = 'LD A, end\nstart:\nLD A, (start)\nLD A, start\nJP end\nend:\nHALT\n'
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        output = StringIO()
+        compiler.Compiler.parse_stream(preprocessor.InputPreprocessor.iter_file(StringIO(source)), output,
+                                       processor_architecture, False, True)
+
+        expected = StringIO()
+        compiler.Compiler.parse_file(preprocessor.InputPreprocessor.parse_file(StringIO(source)), expected,
+                                     processor_architecture, False, True)
+        self.assertEquals(expected.getvalue(), output.getvalue())
+
+    def test_streamed_errors_show_the_line(self):
+        source = 'start:\n  JP start\n  LD A, nowhere\n'
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        for reread, shown in ((None, 'nowhere'), (lambda: preprocessor.InputPreprocessor.iter_file(StringIO(source)),
+                                                   'LD A, nowhere')):
+            with redirect_stdout(StringIO()) as messages, self.assertRaises(SystemExit) as context:
+                compiler.Compiler.parse_stream(preprocessor.InputPreprocessor.iter_file(StringIO(source)), StringIO(),
+                                               processor_architecture, False, True, reread=reread)
+            self.assertEquals(compiler.COMPILER_ERR_UNCOMPILABLE_INSTRUCTION.error_id, context.exception.code)
+            self.assertIn('on line 1', messages.getvalue())
+            self.assertIn('--> {}\n'.format(shown), messages.getvalue())
+
+    def test_streamed_duplicate_label(self):
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        lines = preprocessor.InputPreprocessor.iter_file(StringIO('loop:\n  JP NZ, loop\nloop:\n  JP loop\n'))
+        with redirect_stdout(StringIO()), self.assertRaises(SystemExit) as context:
+            compiler.Compiler.parse_stream(lines, StringIO(), processor_architecture, False, True)
+        self.assertEquals(compiler.COMPILER_ERR_DUPLICATE_LABEL.error_id, context.exception.code)
+
+
+class BatchTestCase(unittest.TestCase):
+    """Tests for the BatchCompiler class"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as fout:
+            fout.write(content)
+        return path
+
+    def test_read_manifest(self):
+        manifest = self._write('manifest.txt', '# Sources\nfirst.txt\n\nsecond.txt  out/second\n')
+        self.assertEquals([(os.path.join(self.directory.name, 'first.txt'), os.path.join(self.directory.name, 'first')),
+                           (os.path.join(self.directory.name, 'second.txt'),
+                            os.path.join(self.directory.name, 'out', 'second'))],
+                          batch.BatchCompiler.read_manifest(manifest))
+
+    def test_failures_do_not_stop_the_batch(self):
+        processor_architecture = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+        jobs = [(self._write('bad.txt', 'BOGUS A\n'), os.path.join(self.directory.name, 'bad')),
+                (os.path.abspath('test_source.txt'), os.path.join(self.directory.name, 'good')),
+                (os.path.join(self.directory.name, 'missing.txt'), os.path.join(self.directory.name, 'missing'))]
+
+        results = batch.BatchCompiler.compile_batch(jobs, processor_architecture, {'output_object': True}, 2)
+
+        self.assertEquals([compiler.COMPILER_ERR_UNDEFINED_INSTRUCTION.error_id, 0,
+                           preprocessor.PREPROCESSOR_ERR_INVALID_FILE.error_id], [r.status for r in results])
+        self.assertIn('BOGUS A', results[0].messages)
+        with open(os.path.join(self.directory.name, 'good.kobj'), 'r') as output, \
+                open('test_expected_output.kobj', 'r') as expected_output:
+            self.assertEquals(expected_output.read(), output.read())
+
 
 def suite():
     integration_suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestCase)
+    batch_suite = unittest.TestLoader().loadTestsFromTestCase(BatchTestCase)
 
-    return integration_suite
+    return unittest.TestSuite([integration_suite, batch_suite])
@@ -0,0 +1,116 @@
+import os
+import pickle
+import tempfile
+from array import array
+from io import StringIO
+from contextlib import redirect_stdout
+from asm_compiler import compiler
+from asm_compiler import relocatable
+from input_preprocessor import preprocessor
+from instruction_set_parser import is_parser
+from linker import linker
+import unittest
+import kasml
+
+C = compiler.Compiler
+L = linker.Linker
+
+MAIN = 'EXTERN count, done\nINP A, 0\nLD B, 0\nJP count\n'
+COUNT = 'GLOBAL count\nEXTERN done\ncount:\nCP A, 0\nJP Z, done\nSRL A\nINC B\nJP count\n'
+DONE = 'GLOBAL done\ndone:\nLD A, B\nOUT A, 0\nHALT\n'
+
+
+class LinkerTestCase(unittest.TestCase):
+    """Tests for relocatable objects and the Linker, against the test architecture"""
+
+    def setUp(self):
+        self.pa = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+
+    def compile_module(self, text):
+        labels = {}
+        symbols = {}
+        lines = preprocessor.InputPreprocessor.parse_file(StringIO(text), labels=labels, symbols=symbols)
+        return C.compile_relocatable(lines, self.pa, labels, symbols)
+
+    def test_directives(self):
+        symbols = {}
+        lines = preprocessor.InputPreprocessor.parse_file(StringIO(COUNT), symbols=symbols)
+        self.assertEquals({'count': 'GLOBAL', 'done': 'EXTERN'}, symbols)
+        self.assertEquals(['CP A, 0', 'JP Z, done', 'SRL A', 'INC B', 'JP 0'], lines)
+
+    def test_relocatable_object(self):
+        obj = self.compile_module(COUNT)
+        self.assertEquals({'count': 0}, obj.exports)
+        self.assertEquals([(3, 'done')], obj.externals)
+        self.assertEquals([7], list(obj.relocations))
+        self.assertEquals(0, obj.words[3])
+
+    def test_link(self):
+        objects = [self.compile_module(text) for text in (MAIN, COUNT, DONE)]
+        whole = ''.join(line for text in (MAIN, COUNT, DONE) for line in text.splitlines(True)
+                        if not line.startswith(('GLOBAL', 'EXTERN')))
+        self.assertEquals(C.compile_program(preprocessor.InputPreprocessor.parse_file(StringIO(whole)), self.pa),
+                          L.link(objects))
+
+    def test_dumps(self):
+        obj = self.compile_module(COUNT)
+        loaded = relocatable.RelocatableObject.loads(obj.dumps())
+        self.assertEquals((obj.digest, obj.words, obj.relocations, obj.exports, obj.externals),
+                          (loaded.digest, loaded.words, loaded.relocations, loaded.exports, loaded.externals))
+        # Words too large for a machine type are stored as big-endian numbers
+        obj = relocatable.RelocatableObject('digest', 72, [1 << 71, 5], array('L', [1]), {'wide': 1}, [(0, 'far')])
+        loaded = relocatable.RelocatableObject.loads(obj.dumps())
+        self.assertEquals((72, [1 << 71, 5], [1], {'wide': 1}, [(0, 'far')]),
+                          (loaded.word_size, loaded.words, list(loaded.relocations), loaded.exports, loaded.externals))
+
+        # Nothing but object files is read, and pickles in particular are never loaded
+        data = self.compile_module(COUNT).dumps()
+        for invalid in (b'not an object', pickle.dumps(obj), data[:-1], data.replace(b'"itemsize"', b'"size"'),
+                        data.replace(b'{', b'[', 1)):
+            with self.assertRaises(ValueError):
+                relocatable.RelocatableObject.loads(invalid)
+
+        # And neither are objects whose positions are outside of their words, which would patch other objects
+        for relocations, exports, externals in (([2], {}, []), ([0], {}, [(-1, 'far')]), ([], {'wide': 3}, []),
+                                                ([], {}, [(1.0, 'far')]), ([], {}, [(0, 5)])):
+            corrupted = relocatable.RelocatableObject('digest', 72, [1 << 71, 5], array('L', relocations), exports,
+                                                      externals)
+            with self.assertRaises(ValueError):
+                relocatable.RelocatableObject.loads(corrupted.dumps())
+
+    def assertExits(self, error, fn, *args):
+        with redirect_stdout(StringIO()):
+            with self.assertRaises(SystemExit) as cm:
+                fn(*args)
+        self.assertEquals(error.error_id, cm.exception.code)
+
+    def test_errors(self):
+        main, count, done = [self.compile_module(text) for text in (MAIN, COUNT, DONE)]
+        self.assertExits(linker.LINKER_ERR_UNDEFINED_SYMBOL, L.link, [main, count])
+        self.assertExits(linker.LINKER_ERR_DUPLICATE_SYMBOL, L.link, [main, count, done, done])
+        # Labels that are neither defined nor imported are still undefined
+        self.assertExits(compiler.COMPILER_ERR_UNDEFINED_LABEL, self.compile_module, 'JP nowhere\n')
+        self.assertExits(compiler.COMPILER_ERR_UNDEFINED_LABEL, self.compile_module, 'GLOBAL nowhere\nHALT\n')
+        self.assertExits(compiler.COMPILER_ERR_UNDEFINED_LABEL, C.compile_program, ['JP count'], self.pa)
+
+    def test_kasml(self):
+        directory = tempfile.mkdtemp()
+        paths = []
+        for name, text in (('main', MAIN), ('count', COUNT), ('done', DONE)):
+            paths.append(relocatable.RelocatableObject.path(os.path.join(directory, name)))
+            with open(paths[-1], 'wb') as fout:
+                fout.write(self.compile_module(text).dumps())
+        output = os.path.join(directory, 'linked')
+        with redirect_stdout(StringIO()):
+            self.assertEquals(0, kasml.main(['-i'] + paths + ['-o', output, '-O']))
+        with open(output + '.kobj') as fin:
+            self.assertEquals(18, len(fin.read().split()))
+        for path in paths + [output + '.kobj']:
+            os.remove(path)
+        os.rmdir(directory)
+
+
+def suite():
+    linker_suite = unittest.TestLoader().loadTestsFromTestCase(LinkerTestCase)
+
+    return unittest.TestSuite([linker_suite])
@@ -1,7 +1,14 @@
+import os
+import tempfile
+from io import StringIO
+from contextlib import redirect_stdout
 from instruction_set_parser import is_parser
+from instruction_set_parser import arch_cache
+from instruction_set_parser import lexer
 import unittest
 
 ISP = is_parser.InstructionSetParser
+L = lexer.Lexer
 
 
 class HexToDecimalTestCase(unittest.TestCase):
@@ -71,10 +78,197 @@ class KeywordTestCases(unittest.TestCase):
         expected = is_parser.Instruction(5, 2, 'JP M,_$address')
         self.assertEquals(expected, self.PA.INSTRUCTION_SET[-1])
 
+    def test_instruction_cycles(self):
+        ISP._parse_line(0, 'INSTRUCTION(1, 1, \'HALT\', 4)', self.PA)
+        ISP._parse_line(1, 'INSTRUCTION(2, 2, \'JP Z,_$address\' , 2 , 3)', self.PA)
+        self.assertEquals(is_parser.Instruction(1, 1, 'HALT', (4, 4)), self.PA.INSTRUCTION_SET[0])
+        self.assertEquals((2, 3), self.PA.INSTRUCTION_SET[1].cycles)
+        with self.assertRaises(SystemExit):
+            ISP._parse_line(2, 'INSTRUCTION(3, 2, \'JP NZ,_$address\', 3, 2)', self.PA)
+
+    def test_flow_mnemonics(self):
+        ISP._parse_line(0, 'JUMPS(\'JP\', \'jr\')', self.PA)
+        ISP._parse_line(1, '  jumps ( \'BR\' ) ', self.PA)
+        ISP._parse_line(2, 'TERMINATORS(\'HALT\')', self.PA)
+        self.assertEquals(('JP', 'JR', 'BR'), self.PA.JUMPS)
+        self.assertEquals(('HALT',), self.PA.TERMINATORS)
+        self.assertEquals((), self.PA.MOVES)
+        with self.assertRaises(SystemExit):
+            ISP._parse_line(3, 'MOVES(LD)', self.PA)
+
+    def test_keyword_case(self):
+        ISP._parse_line(0, 'instruction(1, 1, \'HALT\')', self.PA)
+        self.assertEquals(is_parser.Instruction(1, 1, 'HALT'), self.PA.OPCODES[1])
+
+    def test_invalid_keyword(self):
+        with self.assertRaises(SystemExit):
+            ISP._parse_line(0, 'OPCODE(1, 1, \'HALT\')', self.PA)
+
+    def test_duplicate_opcode(self):
+        ISP._parse_line(0, 'INSTRUCTION(1, 1, \'HALT\')', self.PA)
+        with self.assertRaises(SystemExit):
+            ISP._parse_line(1, 'INSTRUCTION(1, 1, \'NOP\')', self.PA)
+
+
+class SignatureIndexTestCases(unittest.TestCase):
+    """Tests for the _build_signature_index function"""
+
+    def test_index_is_built_when_parsing(self):
+        pa = ISP.parse_file('test_architecture.txt')
+        self.assertEquals(len(pa.INSTRUCTION_SET), len(pa.SIGNATURES))
+        self.assertEquals({'name': 'LD', 'args': ['A', '($literal)']},
+                          pa.SIGNATURES[is_parser.Instruction(0b00010010, 2, 'LD A,_($literal)')])
+
+    def test_index_keeps_first_instruction(self):
+        pa = is_parser.ProcessorArchitecture()
+        ISP._parse_line(0, 'INSTRUCTION(1, 2, \'LD A,_$literal\')', pa)
+        ISP._parse_line(1, 'INSTRUCTION(2, 1, \'LD A,_B\')', pa)
+        ISP._build_signature_index(pa)
+        self.assertEquals((0, pa.INSTRUCTION_SET[0]), pa.SIGNATURE_INDEX[('LD', 2, ('A', None))])
+        self.assertEquals((1, pa.INSTRUCTION_SET[1]), pa.SIGNATURE_INDEX[('LD', 2, ('A', 'B'))])
+
+    def test_ambiguous_signatures(self):
+        pa = is_parser.ProcessorArchitecture()
+        ISP._parse_line(0, 'INSTRUCTION(1, 2, \'JP Z,_$address\')', pa)
+        ISP._parse_line(1, 'INSTRUCTION(2, 1, \'JP Z,_A\')', pa)
+        ISP._parse_line(2, 'INSTRUCTION(3, 2, \'JP Z,_$literal\')', pa)
+        ISP._parse_line(3, 'INSTRUCTION(4, 2, \'JP NZ,_$literal\')', pa)
+        self.assertEquals([(2, 0)], ISP._build_signature_index(pa))
+
+    def test_memory_placeholders_are_not_ambiguous(self):
+        pa = is_parser.ProcessorArchitecture()
+        ISP._parse_line(0, 'INSTRUCTION(1, 2, \'LD A,_$literal\')', pa)
+        ISP._parse_line(1, 'INSTRUCTION(2, 2, \'LD A,_($literal)\')', pa)
+        ISP._parse_line(2, 'INSTRUCTION(3, 1, \'LD A,_(B)\')', pa)
+        self.assertEquals([], ISP._build_signature_index(pa))
+        self.assertEquals((1, pa.INSTRUCTION_SET[1]), pa.SIGNATURE_INDEX[('LD', 2, ('A', lexer.MEMORY))])
+
+    def test_reference_architecture_has_no_ambiguous_signatures(self):
+        output = StringIO()
+        with redirect_stdout(output):
+            ISP.parse_file('test_architecture.txt')
+        self.assertEquals('', output.getvalue())
+
+
+class ArchitectureCacheTestCases(unittest.TestCase):
+    """Tests for the ArchitectureCache class"""
+
+    ARCHITECTURE = 'WORD_SIZE(4)\nINSTRUCTION(0b0000, 1, \'HALT\')\nINSTRUCTION(0b0001, 2, \'JP $address\')'
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        arch_cache.ArchitectureCache._memory.clear()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _entries(self):
+        return [name for name in os.listdir(self.directory.name) if name.endswith('.pickle')]
+
+    def test_load_parses_and_stores(self):
+        pa = arch_cache.ArchitectureCache.load(StringIO(self.ARCHITECTURE), self.directory.name)
+        self.assertEquals(4, pa.WORD_SIZE)
+        self.assertEquals(is_parser.Instruction(1, 2, 'JP $address'), pa.INSTRUCTION_SET[1])
+        self.assertEquals(1, len(self._entries()))
+
+    def test_load_from_cache(self):
+        arch_cache.ArchitectureCache.load(StringIO(self.ARCHITECTURE), self.directory.name)
+        cached = arch_cache.ArchitectureCache.load(StringIO(self.ARCHITECTURE), self.directory.name)
+        self.assertEquals(ISP.parse_file(StringIO(self.ARCHITECTURE)).INSTRUCTION_SET, cached.INSTRUCTION_SET)
+        self.assertEquals(len(cached.INSTRUCTION_SET), len(cached.SIGNATURES))
+        self.assertEquals(1, len(self._entries()))
+
+    def test_changed_file_is_parsed_again(self):
+        arch_cache.ArchitectureCache.load(StringIO(self.ARCHITECTURE), self.directory.name)
+        pa = arch_cache.ArchitectureCache.load(StringIO(self.ARCHITECTURE.replace('(4)', '(8)')), self.directory.name)
+        self.assertEquals(8, pa.WORD_SIZE)
+        self.assertEquals(2, len(self._entries()))
+
+    def test_corrupted_entry_is_replaced(self):
+        arch_cache.ArchitectureCache.load(StringIO(self.ARCHITECTURE), self.directory.name)
+        with open(os.path.join(self.directory.name, self._entries()[0]), 'wb') as entry:
+            entry.write(b'garbage')
+        arch_cache.ArchitectureCache._memory.clear()
+        pa = arch_cache.ArchitectureCache.load(StringIO(self.ARCHITECTURE), self.directory.name)
+        self.assertEquals(4, pa.WORD_SIZE)
+        self.assertEquals(pa.INSTRUCTION_SET,
+                          arch_cache.ArchitectureCache.load(StringIO(self.ARCHITECTURE),
+                                                            self.directory.name).INSTRUCTION_SET)
+
+    def test_load_from_memory(self):
+        pa = arch_cache.ArchitectureCache.load(StringIO(self.ARCHITECTURE), self.directory.name)
+        os.remove(os.path.join(self.directory.name, self._entries()[0]))
+        self.assertIs(pa, arch_cache.ArchitectureCache.load(StringIO(self.ARCHITECTURE), self.directory.name))
+
+    def test_warnings_are_printed_from_cache(self):
+        architecture = self.ARCHITECTURE + '\nINSTRUCTION(0b0010, 2, \'JP $literal\')'
+        outputs = []
+        for clear_memory in (False, True, False):
+            if clear_memory:
+                arch_cache.ArchitectureCache._memory.clear()
+            with redirect_stdout(StringIO()) as output:
+                arch_cache.ArchitectureCache.load(StringIO(architecture), self.directory.name)
+            outputs.append(output.getvalue())
+        # Loading the architecture from disk or from memory warns just like parsing it
+        self.assertIn('WARNING {} on line 3'.format(is_parser.PARSER_WARN_AMBIGUOUS_SIGNATURE.error_id),
+                      outputs[0])
+        self.assertEquals([outputs[0]] * 3, outputs)
+
+    def test_clear(self):
+        arch_cache.ArchitectureCache.load(StringIO(self.ARCHITECTURE), self.directory.name)
+        self.assertEquals(1, arch_cache.ArchitectureCache.clear(self.directory.name))
+        self.assertEquals([], self._entries())
+
+
+class LexerTestCases(unittest.TestCase):
+    """Tests for the lexer shared by the parser and the compiler"""
+
+    def _kinds(self, tokens):
+        return [(token.kind, token.text, token.value, token.column) for token in tokens]
+
+    def test_typed_tokens(self):
+        self.assertEquals([(lexer.MNEMONIC, 'LD', None, 0), (lexer.REGISTER, 'A', None, 3),
+                           (lexer.LITERAL, '32', 32, 6), (lexer.MEMORY, '(B)', None, 12),
+                           (lexer.MEMORY, '(5)', 5, 17), (lexer.ADDRESS, '.end', None, 24)],
+                          self._kinds(L.tokenize_line('LD A, 0x20, (B), ( 5 ), .end')))
+
+    def test_numerals(self):
+        self.assertEquals([12, 12, 12], [token.value for token in L.tokenize_line('CPLX 12, 0xC, 0b1100')[1:]])
+
+    def test_signature(self):
+        self.assertEquals([(lexer.MNEMONIC, 'LD', None, 0), (lexer.MEMORY, '($literal)', None, 3),
+                           (lexer.REGISTER, 'A', None, 15)], self._kinds(L.tokenize_signature('LD ($literal),_A')))
+        self.assertEquals(lexer.PLACEHOLDER, L.tokenize_signature('JP M,_$address')[2].kind)
+
+    def _error(self, line):
+        with self.assertRaises(lexer.LexerError) as context:
+            L.tokenize_line(line)
+        return context.exception.column, context.exception.missing
+
+    def test_error_columns(self):
+        self.assertEquals((6, True), self._error('LD A, '))
+        self.assertEquals((3, True), self._error('LD , B'))
+        self.assertEquals((6, False), self._error('LD A, 0xZZ'))
+        self.assertEquals((7, False), self._error('LD A, B-C'))
+        self.assertEquals((8, True), self._error('LD A, (5'))
+        self.assertEquals((2, False), self._error('LD, A'))
+
+    def test_invalid_signatures(self):
+        for syntax in ('LD A,', 'LD A,_5', 'LD (.end)'):
+            with self.assertRaises(lexer.LexerError):
+                L.tokenize_signature(syntax)
+
+    def test_mixed_numerals(self):
+        self.assertEquals('1 16 LD5', ISP._replace_numerals('0b1 0x10 LD0b101'))
+
 
 def suite():
     htd_suite = unittest.TestLoader().loadTestsFromTestCase(HexToDecimalTestCase)
     btd_suite = unittest.TestLoader().loadTestsFromTestCase(BinaryToDecimalTestCases)
     keyword_suite = unittest.TestLoader().loadTestsFromTestCase(KeywordTestCases)
+    signature_index_suite = unittest.TestLoader().loadTestsFromTestCase(SignatureIndexTestCases)
+    arch_cache_suite = unittest.TestLoader().loadTestsFromTestCase(ArchitectureCacheTestCases)
+    lexer_suite = unittest.TestLoader().loadTestsFromTestCase(LexerTestCases)
 
-    return unittest.TestSuite([htd_suite, btd_suite, keyword_suite])
\ No newline at end of file
+    return unittest.TestSuite([htd_suite, btd_suite, keyword_suite, signature_index_suite, arch_cache_suite,
+                               lexer_suite])
\ No newline at end of file
@@ -1,3 +1,8 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from contextlib import redirect_stdout
 from input_preprocessor import preprocessor
 import unittest
 
@@ -45,10 +50,118 @@ class LabelTestCase(unittest.TestCase):
     def test_replace_label_usage(self):
         self.assertEquals('JP M, 10', PP._replace_label_usage('JP M, fiero', {'fiero': 10}))
 
+    def test_replace_label_usage_whole_words(self):
+        self.assertEquals('JP M, 10', PP._replace_label_usage('JP M, fiero', {'fier': 5, 'fiero': 10}))
+
+    def test_replace_label_usage_instruction_untouched(self):
+        self.assertEquals('JP 2', PP._replace_label_usage('JP JP', {'JP': 2}))
+
+    def test_replace_label_usage_no_arguments(self):
+        self.assertEquals('HALT', PP._replace_label_usage('HALT', {'HALT': 1}))
+
+    def test_replace_label_usage_many_labels(self):
+        labels = {'state{}'.format(i): i for i in range(100000)}
+        self.assertEquals('CPLX 99999, (41), B', PP._replace_label_usage('CPLX state99999, (state41), B', labels))
+
+
+class IterFileTestCase(unittest.TestCase):
+    """Tests for the iter_file function of the preprocessor"""
+
+    def test_lines_are_cleaned(self):
+        source = StringIO('  LD A, B ; Copies B into A\n\n; Only a comment\nloop:\n\tJP loop\n')
+        self.assertEquals(['LD A, B', 'loop:', 'JP loop'], list(PP.iter_file(source)))
+
+    def test_lines_are_lazy(self):
+        source = StringIO('HALT\nfiero: HALT\n')
+        lines = PP.iter_file(source)
+        self.assertEquals('HALT', next(lines))
+        with self.assertRaises(SystemExit):
+            next(lines)
+
+    def test_parse_file_resolves_labels(self):
+        source = StringIO('loop:\n  JP end ; Comment\n; Comment\n  JP loop\nend:\n  HALT\n')
+        self.assertEquals(['JP 2', 'JP 0', 'HALT'], PP.parse_file(source))
+
+
+class IncludeTestCase(unittest.TestCase):
+    """Tests for the INCLUDE directive of the preprocessor"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, 'lib'))
+        self.write('lib/math.asm', 'INCLUDE "io.asm"\nGLOBAL double\ndouble:\n  ADD A, A\n  JP back\n')
+        self.write('lib/io.asm', 'INCLUDE "math.asm" ; Already included\nGLOBAL print\nprint:\n  OUT A\n')
+        self.write('main.asm', 'include "lib/math.asm"\nINCLUDE "lib/io.asm"\nback:\n  JP double\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        with open(os.path.join(self.directory, name), 'w') as fout:
+            fout.write(content)
+
+    def test_lines_are_spliced_once(self):
+        included = set()
+        lines = list(PP.iter_file(os.path.join(self.directory, 'main.asm'), included))
+        self.assertEquals(['print:', 'OUT A', 'double:', 'ADD A, A', 'JP back', 'back:', 'JP double'], lines)
+        self.assertEquals({os.path.realpath(os.path.join(self.directory, name))
+                           for name in ('main.asm', 'lib/math.asm', 'lib/io.asm')}, included)
+
+    def test_labels_are_offset(self):
+        self.assertEquals(['OUT A', 'ADD A, A', 'JP 3', 'JP 1'],
+                          PP.parse_file(os.path.join(self.directory, 'main.asm')))
+
+    def test_included_files_are_cached(self):
+        path = os.path.realpath(os.path.join(self.directory, 'lib', 'io.asm'))
+        PP.parse_file(os.path.join(self.directory, 'main.asm'))
+        self.assertIs(PP._included[path][2], PP._included_lines(path))
+
+        # A file that was modified is read again
+        self.write('lib/io.asm', 'print:\n  OUT A\n  HALT\n')
+        os.utime(path, ns=(0, 0))
+        self.assertEquals(['print:', 'OUT A', 'HALT'], PP._included_lines(path))
+
+    def test_labels_are_scoped(self):
+        # Labels that aren't GLOBAL belong to the file that defines them
+        self.write('lib/wait.asm', 'GLOBAL wait\nwait:\nloop:\n  DEC A\n  JP NZ, loop\n')
+        self.write('lib/fill.asm', 'GLOBAL fill\nfill:\nloop:\n  OUT A\n  JP NZ, loop\n')
+        self.write('loop.asm', 'INCLUDE "lib/wait.asm"\nINCLUDE "lib/fill.asm"\nloop:\n  JP wait\n  JP fill\n'
+                               '  JP loop\n')
+        self.assertEquals(['DEC A', 'JP NZ, 0', 'OUT A', 'JP NZ, 2', 'JP 0', 'JP 2', 'JP 4'],
+                          PP.parse_file(os.path.join(self.directory, 'loop.asm')))
+
+    def test_duplicate_label(self):
+        # A label exported by an included file can't be defined again by the file that includes it
+        self.write('lib/loop.asm', '; Waits\nGLOBAL loop\n\nloop:\n  DEC A\n  JP NZ, loop\n')
+        self.write('loop.asm', 'INCLUDE "lib/loop.asm"\n\n; Again\nloop:\n  JP loop\n')
+        with redirect_stdout(StringIO()) as output, self.assertRaises(SystemExit) as context:
+            PP.parse_file(os.path.join(self.directory, 'loop.asm'))
+        self.assertEquals(preprocessor.PREPROCESSOR_ERR_DUPLICATE_LABEL.error_id, context.exception.code)
+        self.assertIn('on line 4:', output.getvalue())
+        self.assertIn('loop:  (in {})'.format(os.path.join(self.directory, 'loop.asm')), output.getvalue())
+
+        # And neither can a label be defined twice by an included file
+        self.write('lib/loop.asm', 'loop:\n  DEC A\n  ; Again\nloop:\n  JP NZ, loop\n')
+        self.write('loop.asm', 'INCLUDE "lib/loop.asm"\n')
+        with redirect_stdout(StringIO()) as output, self.assertRaises(SystemExit):
+            PP.parse_file(os.path.join(self.directory, 'loop.asm'))
+        self.assertIn('on line 4:', output.getvalue())
+        self.assertIn('loop:  (in {})'.format(os.path.realpath(os.path.join(self.directory, 'lib', 'loop.asm'))),
+                      output.getvalue())
+
+    def test_missing_file(self):
+        with redirect_stdout(StringIO()) as output, self.assertRaises(SystemExit) as context:
+            PP.parse_file(StringIO('; Comment\n\nINCLUDE "{}"\n'.format(os.path.join(self.directory, 'missing.asm'))))
+        self.assertEquals(preprocessor.PREPROCESSOR_ERR_INVALID_INCLUDE.error_id, context.exception.code)
+        self.assertIn('on line 3:', output.getvalue())
+
 
 def suite():
     remove_comments_suite = unittest.TestLoader().loadTestsFromTestCase(RemoveCommentsTestCase)
     remove_whitespace_suite = unittest.TestLoader().loadTestsFromTestCase(RemoveWhitespaceTestCase)
     label_suite = unittest.TestLoader().loadTestsFromTestCase(LabelTestCase)
+    iter_file_suite = unittest.TestLoader().loadTestsFromTestCase(IterFileTestCase)
+    include_suite = unittest.TestLoader().loadTestsFromTestCase(IncludeTestCase)
 
-    return unittest.TestSuite([remove_comments_suite, remove_whitespace_suite, label_suite])
+    return unittest.TestSuite([remove_comments_suite, remove_whitespace_suite, label_suite, iter_file_suite,
+                               include_suite])
@@ -0,0 +1,93 @@
+import os
+import json
+import tempfile
+from io import StringIO
+from contextlib import redirect_stdout, redirect_stderr
+from profiling import profiler
+from asm_compiler import compiler
+from input_preprocessor import preprocessor
+from instruction_set_parser import is_parser
+import unittest
+import kasmc
+
+P = profiler.Profiler
+
+
+class ProfilerTestCase(unittest.TestCase):
+    """Tests for the Profiler and the counters updated by the compiler"""
+
+    def setUp(self):
+        self.pa = is_parser.InstructionSetParser.parse_file('test_architecture.txt')
+
+    def tearDown(self):
+        P.stop()
+
+    def _compile(self):
+        source = preprocessor.InputPreprocessor.parse_file(StringIO('start:\nLD A, 1\nJP start\nHALT\n'))
+        return compiler.Compiler.compile_program(source, self.pa)
+
+    def test_no_counters_when_disabled(self):
+        P.counters = {}
+        self._compile()
+        self.assertEquals({}, P.counters)
+
+    def test_counters(self):
+        P.start()
+        self._compile()
+        P.stop()
+        self.assertEquals(3, P.counters['lines'])
+        self.assertEquals(1, P.counters['labels_substituted'])
+        self.assertEquals(1, P.counters['address_fixups'])
+        self.assertEquals(3, P.counters['signature_lookups'])
+        self.assertTrue(P.counters['signatures_probed'] >= 3)
+        # Each of the 4 lines is looked at for comments, labels and INCLUDE directives, and again for a label once
+        # it's read (5 more, with the label itself), then labels are replaced in the 3 lines of code (HALT has no
+        # arguments, so it's the only one whose arguments aren't matched)
+        self.assertEquals(22, P.counters['regex_evaluations'])
+
+    def test_report_on_standard_output(self):
+        stdout = StringIO()
+        stderr = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                status = kasmc.main(['-i', 'test_source.txt', '-a', 'test_architecture.txt', '--no-arch-cache',
+                                     '-o', os.path.join(directory, 'output'), '-b', '--profile', '-'],
+                                    use_daemon=False)
+        self.assertEquals(0, status)
+        # The report is all there is on the standard output, and the progress went to the standard error
+        self.assertEquals(10, json.loads(stdout.getvalue())['counters']['lines'])
+        self.assertIn('ALL DONE', stderr.getvalue())
+
+    def test_cost_report_on_standard_output(self):
+        stdout = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            with redirect_stdout(stdout), redirect_stderr(StringIO()):
+                kasmc.main(['-i', 'test_source.txt', '-a', 'test_architecture.txt', '--no-arch-cache',
+                            '-o', os.path.join(directory, 'output'), '-b', '--cost-report', '-'], use_daemon=False)
+        self.assertEquals(16, json.loads(stdout.getvalue())['program']['words'])
+
+    def test_functions_restored(self):
+        original = compiler.Compiler.__dict__['_compile_line']
+        P.start()
+        self.assertIsNot(original, compiler.Compiler.__dict__['_compile_line'])
+        self._compile()
+        P.stop()
+        self.assertIs(original, compiler.Compiler.__dict__['_compile_line'])
+        self.assertEquals(3, P.functions['Compiler._compile_line'][0])
+
+    def test_report(self):
+        P.start(functions=False)
+        P.add_stage('compile', 2.0)
+        P.count('lines', 10)
+        P.count('signature_lookups', 4)
+        P.count('signatures_probed', 6)
+        P.stop()
+        report = P.report(input='source.txt')
+        self.assertEquals('source.txt', report['input'])
+        self.assertEquals(2.0, report['total'])
+        self.assertEquals(5.0, report['counters']['lines_per_second'])
+        self.assertEquals(1.5, report['counters']['signatures_probed_per_lookup'])
+
+
+def suite():
+    return unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(ProfilerTestCase)])
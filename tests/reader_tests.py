@@ -0,0 +1,54 @@
+import os
+import tempfile
+from io import StringIO
+from file_input import reader
+import unittest
+
+LR = reader.LineReader
+
+SOURCE = 'start:\r\n\tLD A, 1 ; one\r\n\r\n   \n; only a comment\n  ; indented comment\nJP start\nHALT'
+
+
+class LineReaderTestCase(unittest.TestCase):
+    """Tests for the LineReader, on both mapped files and file-like objects"""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as fout:
+            fout.write(SOURCE.encode('utf-8'))
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_skips_empty_lines(self):
+        expected = ['start:', '\tLD A, 1 ; one', '; only a comment', '  ; indented comment', 'JP start', 'HALT']
+        self.assertEquals(expected, list(LR.lines(self.path)))
+        self.assertEquals(expected, list(LR.lines(StringIO(SOURCE.replace('\r\n', '\n')))))
+
+    def test_skips_comments(self):
+        expected = ['start:', '\tLD A, 1 ; one', 'JP start', 'HALT']
+        self.assertEquals(expected, list(LR.lines(self.path, comment=';')))
+        self.assertEquals(expected, list(LR.lines(StringIO(SOURCE), comment=';')))
+
+    def test_small_blocks(self):
+        block_size = LR.BLOCK_SIZE
+        try:
+            for size in (1, 3, 7):
+                LR.BLOCK_SIZE = size
+                self.assertEquals(['start:', '\tLD A, 1 ; one', 'JP start', 'HALT'],
+                                  list(LR.lines(self.path, comment=';')))
+        finally:
+            LR.BLOCK_SIZE = block_size
+
+    def test_empty_file(self):
+        with open(self.path, 'w'):
+            pass
+        self.assertEquals([], list(LR.lines(self.path)))
+
+    def test_missing_file(self):
+        with self.assertRaises(FileNotFoundError):
+            LR.lines(self.path + '.missing')
+
+
+def suite():
+    return unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(LineReaderTestCase)])
@@ -2,11 +2,20 @@ from tests import parser_tests
 from tests import compiler_tests
 from tests import preprocessor_tests
 from tests import integration_tests
+from tests import daemon_tests
+from tests import benchmark_tests
+from tests import profiler_tests
+from tests import reader_tests
+from tests import disassembler_tests
+from tests import linker_tests
 import unittest
 
 
 def suite():
-    return unittest.TestSuite([parser_tests.suite(), preprocessor_tests.suite(), compiler_tests.suite(), integration_tests.suite()])
+    return unittest.TestSuite([parser_tests.suite(), preprocessor_tests.suite(), compiler_tests.suite(),
+                               integration_tests.suite(), daemon_tests.suite(),
+                               benchmark_tests.suite(), profiler_tests.suite(), reader_tests.suite(),
+                               disassembler_tests.suite(), linker_tests.suite()])
 
 run_all_suite = suite()
 